@@ -0,0 +1,72 @@
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.append('./')
+
+from utils.gs_renderer import MiniCam, CameraBank
+from utils.cam_utils import orbit_camera, OrbitCamera
+
+# Camera setup cost of one training step: batch_size MiniCams built from
+# orbit_camera (inverse + host-to-device copies per view), against indexing a
+# CameraBank built once from data/camera_pose_relative.json.
+
+POSE_TABLE = './data/camera_pose_relative.json'
+
+
+def minicam_step(cam, table, view_ids, resolution, opt, device):
+    cams = []
+    for view_id in view_ids:
+        pose = orbit_camera(opt.elevation + table[0][view_id], table[1][view_id], opt.radius)
+        cams.append(MiniCam(pose, resolution, resolution, cam.fovy, cam.fovx, cam.near, cam.far, device=device))
+    return cams
+
+
+def bank_step(bank, view_ids, resolution):
+    return bank.cameras(view_ids, resolution)
+
+
+def timed(fn, repeat, device):
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[4, 16, 30])
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--elevation", type=float, default=0)
+    parser.add_argument("--radius", type=float, default=2.5)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    opt = parser.parse_args()
+    device = torch.device(opt.device)
+
+    with open(POSE_TABLE, 'r') as f:
+        table = json.load(f)
+    cam = OrbitCamera(512, 512, r=opt.radius, fovy=49.1)
+
+    started = time.perf_counter()
+    bank = CameraBank.from_json(POSE_TABLE, opt.elevation, opt.radius, cam.fovy, cam.fovx, cam.near, cam.far, device=device)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    print(f"CameraBank of {len(bank)} poses x {len(bank.views)} resolutions built in {(time.perf_counter() - started) * 1000:.1f} ms on {device}")
+
+    rng = np.random.default_rng(0)
+    print(f"{'batch':>6} {'MiniCam ms':>11} {'bank ms':>9} {'speedup':>8}")
+    for batch_size in opt.batch_sizes:
+        view_ids = rng.integers(1, 180, batch_size).tolist()
+        before = timed(lambda: minicam_step(cam, table, view_ids, opt.resolution, opt, device), opt.repeat, device)
+        after = timed(lambda: bank_step(bank, view_ids, opt.resolution), opt.repeat, device)
+        print(f"{batch_size:>6} {before * 1000:>11.3f} {after * 1000:>9.3f} {before / after:>7.0f}x")
@@ -0,0 +1,91 @@
+import sys
+import time
+import argparse
+
+import torch
+
+sys.path.append('./')
+
+from utils.torch_rasterizer import packed_covariance
+
+# Packed 3D covariance (cov3D_precomp, [N, 6]) from scales and quaternions:
+# the build_rotation / build_scaling_rotation / strip_lowerdiag chain
+# GaussianModel used before, copied below, against packed_covariance.
+# Forward + backward time against N; tests/test_covariance.py checks that
+# values and gradients agree.
+
+
+def reference_covariance(scales, rotations, scale_modifier=1.0):
+    norm = torch.sqrt(rotations[:, 0] * rotations[:, 0] + rotations[:, 1] * rotations[:, 1]
+                      + rotations[:, 2] * rotations[:, 2] + rotations[:, 3] * rotations[:, 3])
+    q = rotations / norm[:, None]
+    R = torch.zeros((q.size(0), 3, 3), dtype=q.dtype, device=q.device)
+    r, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    R[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    R[:, 0, 1] = 2 * (x * y - r * z)
+    R[:, 0, 2] = 2 * (x * z + r * y)
+    R[:, 1, 0] = 2 * (x * y + r * z)
+    R[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    R[:, 1, 2] = 2 * (y * z - r * x)
+    R[:, 2, 0] = 2 * (x * z - r * y)
+    R[:, 2, 1] = 2 * (y * z + r * x)
+    R[:, 2, 2] = 1 - 2 * (x * x + y * y)
+
+    s = scale_modifier * scales
+    L = torch.zeros((s.shape[0], 3, 3), dtype=s.dtype, device=s.device)
+    L[:, 0, 0] = s[:, 0]
+    L[:, 1, 1] = s[:, 1]
+    L[:, 2, 2] = s[:, 2]
+    L = R @ L
+    sym = L @ L.transpose(1, 2)
+
+    packed = torch.zeros((sym.shape[0], 6), dtype=sym.dtype, device=sym.device)
+    packed[:, 0] = sym[:, 0, 0]
+    packed[:, 1] = sym[:, 0, 1]
+    packed[:, 2] = sym[:, 0, 2]
+    packed[:, 3] = sym[:, 1, 1]
+    packed[:, 4] = sym[:, 1, 2]
+    packed[:, 5] = sym[:, 2, 2]
+    return packed
+
+
+def make_inputs(count, device, dtype):
+    scales = torch.exp(torch.randn(count, 3, device=device, dtype=dtype) - 3).requires_grad_()
+    rotations = torch.randn(count, 4, device=device, dtype=dtype).requires_grad_()
+    return scales, rotations
+
+
+def timed(fn, scales, rotations, repeat, device):
+    def step():
+        scales.grad = rotations.grad = None
+        fn(scales, rotations, 1.0).sum().backward()
+
+    step()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    variants = [("reference", reference_covariance), ("packed", packed_covariance)]
+    if hasattr(torch, "compile"):
+        variants.append(("compiled", torch.compile(packed_covariance)))
+
+    print(f"{'count':>9} " + " ".join(f"{name + ' ms':>13}" for name, _ in variants))
+    for count in args.counts:
+        scales, rotations = make_inputs(count, device, torch.float32)
+        times = [timed(fn, scales, rotations, args.repeat, device) for _, fn in variants]
+        print(f"{count:>9} " + " ".join(f"{seconds * 1000:>13.2f}" for seconds in times))
@@ -0,0 +1,183 @@
+import sys
+import time
+import argparse
+from types import SimpleNamespace
+
+import torch
+from torch import nn
+
+sys.path.append('./')
+
+from utils.gs_renderer import GaussianModel
+from utils.gs_capacity import capacity_bytes
+
+# Densify/prune cycles on the capacity-backed GaussianModel against the
+# reallocating cat/prune code it replaced (LegacyGaussianModel below). A cycle
+# is one Adam step on random gradients, densification stats that send about
+# --densify_fraction of the gaussians to clone/split, then densify_and_prune.
+# Reports time per cycle and, on CUDA, peak allocated memory; both models run
+# from the same seed and must end with identical parameters and Adam moments.
+
+
+class LegacyGaussianModel(GaussianModel):
+    def _prune_optimizer(self, mask):
+        optimizable_tensors = {}
+        for group in self.optimizer.param_groups:
+            stored_state = self.optimizer.state.get(group['params'][0], None)
+            if stored_state is not None:
+                stored_state["exp_avg"] = stored_state["exp_avg"][mask]
+                stored_state["exp_avg_sq"] = stored_state["exp_avg_sq"][mask]
+
+                del self.optimizer.state[group['params'][0]]
+                group["params"][0] = nn.Parameter((group["params"][0][mask].requires_grad_(True)))
+                self.optimizer.state[group['params'][0]] = stored_state
+
+                optimizable_tensors[group["name"]] = group["params"][0]
+            else:
+                group["params"][0] = nn.Parameter(group["params"][0][mask].requires_grad_(True))
+                optimizable_tensors[group["name"]] = group["params"][0]
+        return optimizable_tensors
+
+    def prune_points(self, mask):
+        valid_points_mask = ~mask
+        optimizable_tensors = self._prune_optimizer(valid_points_mask)
+
+        self._xyz = optimizable_tensors["xyz"]
+        self._features_dc = optimizable_tensors["f_dc"]
+        self._features_rest = optimizable_tensors["f_rest"]
+        self._opacity = optimizable_tensors["opacity"]
+        self._scaling = optimizable_tensors["scaling"]
+        self._rotation = optimizable_tensors["rotation"]
+
+        self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
+        self.denom = self.denom[valid_points_mask]
+        self.max_radii2D = self.max_radii2D[valid_points_mask]
+
+    def cat_tensors_to_optimizer(self, tensors_dict):
+        optimizable_tensors = {}
+        for group in self.optimizer.param_groups:
+            extension_tensor = tensors_dict[group["name"]]
+            stored_state = self.optimizer.state.get(group['params'][0], None)
+            if stored_state is not None:
+                stored_state["exp_avg"] = torch.cat((stored_state["exp_avg"], torch.zeros_like(extension_tensor)), dim=0)
+                stored_state["exp_avg_sq"] = torch.cat((stored_state["exp_avg_sq"], torch.zeros_like(extension_tensor)), dim=0)
+
+                del self.optimizer.state[group['params'][0]]
+                group["params"][0] = nn.Parameter(torch.cat((group["params"][0], extension_tensor), dim=0).requires_grad_(True))
+                self.optimizer.state[group['params'][0]] = stored_state
+
+                optimizable_tensors[group["name"]] = group["params"][0]
+            else:
+                group["params"][0] = nn.Parameter(torch.cat((group["params"][0], extension_tensor), dim=0).requires_grad_(True))
+                optimizable_tensors[group["name"]] = group["params"][0]
+        return optimizable_tensors
+
+    def densification_postfix(self, new_xyz, new_features_dc, new_features_rest, new_opacities, new_scaling, new_rotation):
+        d = {"xyz": new_xyz, "f_dc": new_features_dc, "f_rest": new_features_rest,
+             "opacity": new_opacities, "scaling": new_scaling, "rotation": new_rotation}
+        optimizable_tensors = self.cat_tensors_to_optimizer(d)
+        self._xyz = optimizable_tensors["xyz"]
+        self._features_dc = optimizable_tensors["f_dc"]
+        self._features_rest = optimizable_tensors["f_rest"]
+        self._opacity = optimizable_tensors["opacity"]
+        self._scaling = optimizable_tensors["scaling"]
+        self._rotation = optimizable_tensors["rotation"]
+
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
+
+
+TRAINING_ARGS = SimpleNamespace(
+    percent_dense=0.01, position_lr_init=0.001, position_lr_final=0.00002, position_lr_delay_mult=0.02,
+    position_lr_max_steps=500, feature_lr=0.01, opacity_lr=0.05, scaling_lr=0.005, rotation_lr=0.005,
+)
+
+
+def make_model(cls, count, sh_degree, device, seed):
+    # create_from_pcd without its KNN scale init, which dominates on CPU
+    generator = torch.Generator().manual_seed(seed)
+    rand = lambda *shape: torch.rand(shape, generator=generator).to(device)
+    model = cls(sh_degree, device=device)
+    model._xyz = nn.Parameter(rand(count, 3) * 0.6 - 0.3)
+    model._features_dc = nn.Parameter(rand(count, 1, 3))
+    model._features_rest = nn.Parameter(torch.zeros((count, (sh_degree + 1) ** 2 - 1, 3), device=device))
+    model._scaling = nn.Parameter(torch.log(rand(count, 3) * 0.04 + 0.001))
+    model._rotation = nn.Parameter(torch.cat([torch.ones((count, 1), device=device), torch.zeros((count, 3), device=device)], dim=1))
+    model._opacity = nn.Parameter(rand(count, 1) * 4 - 2)
+    model.max_radii2D = torch.zeros((count,), device=device)
+    model.training_setup(TRAINING_ARGS)
+    return model
+
+
+def cycle(model, densify_fraction, generator):
+    n = model.get_xyz.shape[0]
+    params = [group["params"][0] for group in model.optimizer.param_groups]
+    for param in params:
+        param.grad = torch.randn(param.shape, generator=generator, device="cpu").to(param.device) * 1e-3
+    model.optimizer.step()
+    model.optimizer.zero_grad(set_to_none=True)
+
+    # stats that put about densify_fraction of the points over the threshold
+    chosen = torch.rand(n, generator=generator) < densify_fraction
+    model.xyz_gradient_accum[:] = torch.where(chosen, 1.0, 0.0)[:, None].to(model.device)
+    model.denom[:] = 1
+    model.max_radii2D[:] = torch.rand(n, generator=generator).to(model.device) * 2
+    model.densify_and_prune(0.5, min_opacity=0.01, extent=4, max_screen_size=1.95)
+
+
+def run(cls, args, count, device):
+    torch.manual_seed(0)
+    model = make_model(cls, count, args.sh_degree, device, seed=0)
+    generator = torch.Generator().manual_seed(1)
+    cuda = torch.device(device).type == "cuda"
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    elapsed = 0.0
+    for _ in range(args.cycles):
+        started = time.perf_counter()
+        cycle(model, args.densify_fraction, generator)
+        if cuda:
+            torch.cuda.synchronize()
+        elapsed += time.perf_counter() - started
+    peak = torch.cuda.max_memory_allocated() if cuda else None
+    return model, elapsed / args.cycles, peak
+
+
+def same_state(a, b):
+    for group_a, group_b in zip(a.optimizer.param_groups, b.optimizer.param_groups):
+        param_a, param_b = group_a["params"][0], group_b["params"][0]
+        if not torch.equal(param_a, param_b):
+            return False
+        state_a, state_b = a.optimizer.state[param_a], b.optimizer.state[param_b]
+        if not (torch.equal(state_a["exp_avg"], state_b["exp_avg"]) and torch.equal(state_a["exp_avg_sq"], state_b["exp_avg_sq"])):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--densify_fraction", type=float, default=0.05)
+    parser.add_argument("--sh_degree", type=int, default=0)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    print(f"{args.cycles} densify/prune cycles on {args.device}, sh_degree {args.sh_degree}")
+    print(f"{'count':>8} {'final':>8} {'legacy ms':>10} {'capacity ms':>12} {'legacy peak':>12} {'capacity peak':>14} {'buffers':>9}  identical")
+    mismatches = 0
+    for count in args.counts:
+        legacy, legacy_time, legacy_peak = run(LegacyGaussianModel, args, count, args.device)
+        del legacy.optimizer
+        model, model_time, model_peak = run(GaussianModel, args, count, args.device)
+        legacy_model, _, _ = run(LegacyGaussianModel, args, count, args.device)
+        identical = same_state(model, legacy_model)
+        mismatches += not identical
+        mb = lambda value: "-" if value is None else f"{value / 2**20:.1f} MB"
+        print(f"{count:>8} {model.get_xyz.shape[0]:>8} {legacy_time * 1000:>10.1f} {model_time * 1000:>12.1f} "
+              f"{mb(legacy_peak):>12} {mb(model_peak):>14} {mb(capacity_bytes(model.row_buffers)):>9}  {identical}")
+        del legacy, model, legacy_model
+
+    sys.exit(1 if mismatches else 0)
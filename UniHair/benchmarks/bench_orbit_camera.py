@@ -0,0 +1,53 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.append('./')
+
+from utils.cam_utils import orbit_camera, orbit_camera_batch
+
+# orbit_camera in a Python loop against orbit_camera_batch on numpy arrays and
+# torch tensors. The equivalence checks live in tests/test_cam_utils.py.
+
+
+def scalar_poses(elevations, azimuths, radii, target=None, opengl=True):
+    return np.stack([
+        orbit_camera(float(ver), float(hor), float(radius), target=target, opengl=opengl)
+        for ver, hor, radius in zip(elevations, azimuths, radii)
+    ], axis=0)
+
+
+def timed(fn, repeat, device):
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[4, 30, 180, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    rng = np.random.default_rng(0)
+
+    print(f"{'count':>6} {'loop ms':>9} {'numpy ms':>9} {'torch ms':>9}")
+    for count in args.counts:
+        elevations = rng.uniform(-60, 30, count)
+        azimuths = rng.uniform(-180, 180, count)
+        radii = np.full(count, 2.5)
+        elevations_t, azimuths_t = torch.from_numpy(elevations).to(device), torch.from_numpy(azimuths).to(device)
+        loop = timed(lambda: scalar_poses(elevations, azimuths, radii), args.repeat, device)
+        batched = timed(lambda: orbit_camera_batch(elevations, azimuths, 2.5), args.repeat, device)
+        tensors = timed(lambda: orbit_camera_batch(elevations_t, azimuths_t, 2.5), args.repeat, device)
+        print(f"{count:>6} {loop * 1000:>9.3f} {batched * 1000:>9.3f} {tensors * 1000:>9.3f}")
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from plyfile import PlyData, PlyElement
+
+sys.path.append('./')
+
+from utils.ply_io import write_ply, read_ply, columns
+
+# Compares the plyfile path GaussianModel.save_ply/load_ply used before
+# utils/ply_io.py with the packed float32 path, on host arrays only.
+
+
+def attribute_names(sh_degree):
+    rest = 3 * (sh_degree + 1) ** 2 - 3
+    return (['x', 'y', 'z', 'nx', 'ny', 'nz', 'f_dc_0', 'f_dc_1', 'f_dc_2']
+            + [f'f_rest_{i}' for i in range(rest)]
+            + ['opacity', 'scale_0', 'scale_1', 'scale_2', 'rot_0', 'rot_1', 'rot_2', 'rot_3'])
+
+
+def save_plyfile(path, names, attributes):
+    elements = np.empty(attributes.shape[0], dtype=[(name, 'f4') for name in names])
+    elements[:] = list(map(tuple, attributes))
+    PlyData([PlyElement.describe(elements, 'vertex')]).write(path)
+
+
+def load_plyfile(path, sh_degree):
+    plydata = PlyData.read(path)
+    vertex = plydata.elements[0]
+    xyz = np.stack((np.asarray(vertex["x"]), np.asarray(vertex["y"]), np.asarray(vertex["z"])), axis=1)
+    opacities = np.asarray(vertex["opacity"])[..., np.newaxis]
+    features_dc = np.zeros((xyz.shape[0], 3, 1))
+    for i in range(3):
+        features_dc[:, i, 0] = np.asarray(vertex[f"f_dc_{i}"])
+    groups = []
+    for prefix in ("f_rest_", "scale_", "rot"):
+        group_names = [p.name for p in vertex.properties if p.name.startswith(prefix)]
+        group = np.zeros((xyz.shape[0], len(group_names)))
+        for idx, name in enumerate(group_names):
+            group[:, idx] = np.asarray(vertex[name])
+        groups.append(group)
+    return xyz, features_dc, opacities, groups
+
+
+def load_packed(path, names):
+    names, data = read_ply(path)
+    xyz = np.array(columns(names, data, ['x', 'y', 'z']))
+    parts = [columns(names, data, [n for n in names if n.startswith(prefix)])
+             for prefix in ('f_dc_', 'f_rest_', 'opacity', 'scale_', 'rot')]
+    # what load_ply pays before the device upload
+    return xyz, [np.ascontiguousarray(part) for part in parts]
+
+
+def timed(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--sh_degree", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    names = attribute_names(args.sh_degree)
+    rng = np.random.default_rng(0)
+    print(f"{len(names)} float properties per gaussian")
+    print(f"{'count':>9} {'save plyfile':>13} {'save packed':>12} {'load plyfile':>13} {'load packed':>12}  identical")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = os.path.join(tmp, 'old.ply')
+        new_path = os.path.join(tmp, 'new.ply')
+        for count in args.counts:
+            attributes = rng.standard_normal((count, len(names))).astype(np.float32)
+
+            save_old = timed(save_plyfile, old_path, names, attributes, repeat=args.repeat)
+            save_new = timed(write_ply, new_path, names, attributes, repeat=args.repeat)
+            load_old = timed(load_plyfile, old_path, args.sh_degree, repeat=args.repeat)
+            load_new = timed(load_packed, new_path, names, repeat=args.repeat)
+
+            with open(old_path, 'rb') as f_old, open(new_path, 'rb') as f_new:
+                identical = f_old.read() == f_new.read()
+
+            print(f"{count:>9} {save_old:>12.3f}s {save_new:>11.3f}s {load_old:>12.3f}s {load_new:>11.3f}s  {identical}")
@@ -0,0 +1,64 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.append('./')
+
+from utils.gs_renderer import Renderer, MiniCam, GaussianRasterizer
+from utils.cam_utils import orbit_camera
+
+# Render (forward + backward) throughput of the pure-PyTorch rasterizer, and
+# of diff_gaussian_rasterization when it is installed, against gaussian count.
+
+
+def make_renderer(count, device, backend):
+    renderer = Renderer(sh_degree=0, device=device, backend=backend)
+    renderer.initialize(num_pts=count)
+    with torch.no_grad():
+        renderer.gaussians._opacity.fill_(0.0)
+        renderer.gaussians._features_dc.uniform_(-1, 1)
+    return renderer
+
+
+def bench(renderer, cam, repeat):
+    def step():
+        out = renderer.render(cam)
+        (out["image"].mean() + out["alpha"].mean()).backward()
+
+    step()
+    if renderer.device.type == "cuda":
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        step()
+    if renderer.device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    backends = ["torch"]
+    if torch.device(args.device).type == "cuda" and GaussianRasterizer is not None:
+        backends.append("cuda")
+
+    torch.manual_seed(0)
+    np.random.seed(0)
+    pose = orbit_camera(0, 0, 2.5)
+    fovy = np.deg2rad(49.1)
+    cam = MiniCam(pose, args.size, args.size, fovy, fovy, 0.01, 100, device=args.device)
+
+    print(f"{args.size}x{args.size} on {args.device}, forward + backward")
+    print(f"{'count':>8} " + " ".join(f"{backend + ' ms':>12}" for backend in backends))
+    for count in args.counts:
+        times = [bench(make_renderer(count, args.device, backend), cam, args.repeat) for backend in backends]
+        print(f"{count:>8} " + " ".join(f"{seconds * 1000:>12.1f}" for seconds in times))
@@ -0,0 +1,75 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.append('./')
+
+from utils.gs_renderer import Renderer, MiniCam
+from utils.cam_utils import orbit_camera
+
+# One training iteration's novel-view renders (forward + backward), as a loop
+# of Renderer.render calls with a bg tensor built per view, against a single
+# Renderer.render_batch call.
+
+
+def make_renderer(count, device, backend):
+    renderer = Renderer(sh_degree=0, device=device, backend=backend)
+    renderer.initialize(num_pts=count)
+    with torch.no_grad():
+        renderer.gaussians._opacity.fill_(0.0)
+        renderer.gaussians._features_dc.uniform_(-1, 1)
+    return renderer
+
+
+def loop_step(renderer, cams, colors):
+    images = []
+    for cam, color in zip(cams, colors):
+        bg_color = torch.tensor(color, dtype=torch.float32, device=renderer.device)
+        images.append(renderer.render(cam, bg_color=bg_color)["image"].unsqueeze(0))
+    torch.cat(images, dim=0).mean().backward()
+
+
+def batch_step(renderer, cams, colors):
+    bg_color = torch.tensor(colors, dtype=torch.float32, device=renderer.device)
+    renderer.render_batch(cams, bg_color=bg_color)["image"].mean().backward()
+
+
+def timed(step, renderer, cams, colors, repeat):
+    step(renderer, cams, colors)
+    if renderer.device.type == "cuda":
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        step(renderer, cams, colors)
+    if renderer.device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[4, 8, 16, 30])
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--backend", default=None)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    np.random.seed(0)
+    renderer = make_renderer(args.count, args.device, args.backend)
+    fovy = np.deg2rad(49.1)
+
+    print(f"{args.count} gaussians, {args.size}x{args.size}, {renderer.backend} backend on {args.device}")
+    print(f"{'batch':>6} {'loop ms':>10} {'batch ms':>10} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        hors = np.linspace(-180, 180, batch_size, endpoint=False)
+        cams = [MiniCam(orbit_camera(0, hor, 2.5), args.size, args.size, fovy, fovy, 0.01, 100, device=args.device) for hor in hors]
+        colors = [[1, 1, 1] if i % 2 else [0, 0, 0] for i in range(batch_size)]
+        loop = timed(loop_step, renderer, cams, colors, args.repeat)
+        batch = timed(batch_step, renderer, cams, colors, args.repeat)
+        print(f"{batch_size:>6} {loop * 1000:>10.1f} {batch * 1000:>10.1f} {loop / batch:>7.2f}x")
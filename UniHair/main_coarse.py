@@ -8,10 +8,12 @@ import torch.nn.functional as F
 import rembg
 
 from utils.cam_utils import orbit_camera, OrbitCamera
-from utils.gs_renderer import Renderer, MiniCam
+from utils.gs_renderer import Renderer, MiniCam, CameraBank
+from utils.progress import ProgressReporter
+from utils.checkpoint import save_training_state, load_training_state
 
 class Main:
-    def __init__(self, opt):
+    def __init__(self, opt, guidance_zero123=None, bg_remover=None):
         self.opt = opt
         self.cam = OrbitCamera(512, 512, r=opt.radius, fovy=opt.fovy)
 
@@ -26,9 +28,9 @@ class Main:
 
         # models
         self.device = torch.device("cuda")
-        self.bg_remover = None
+        self.bg_remover = bg_remover
 
-        self.guidance_zero123 = None
+        self.guidance_zero123 = guidance_zero123
 
         self.enable_zero123 = False
 
@@ -99,6 +101,14 @@ class Main:
             self.cam.far,
         )
 
+        # the pose table (used by the export), then its azimuths at each of the
+        # fixed elevations train_step samples novel views from
+        self.coarse_vers = [0.0, -18.0, -36.0]
+        elevations = [self.opt.elevation + ver for ver in self.loaded_vers]
+        for ver in self.coarse_vers:
+            elevations += [self.opt.elevation + ver] * len(self.loaded_hors)
+        self.camera_bank = CameraBank(elevations, self.loaded_hors * (1 + len(self.coarse_vers)), self.opt.radius, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far, device=self.device)
+
         self.enable_zero123 = self.opt.lambda_zero123 > 0 and self.input_img is not None
 
         if self.guidance_zero123 is None and self.enable_zero123:
@@ -137,6 +147,7 @@ class Main:
             self.renderer.gaussians.update_learning_rate(self.step)
 
             loss = 0
+            self.loss_terms = {}
 
             ### known view
             if self.input_img_torch is not None and (not self.opt.imagedream):
@@ -147,16 +158,17 @@ class Main:
                 image = out["image"].unsqueeze(0) # [1, 3, H, W] in [0, 1]
                 img_loss = 10000 * (step_ratio if self.opt.warmup_rgb_loss else 1) * F.mse_loss(image, self.input_img_torch)
                 loss = loss + img_loss
+                self.loss_terms["img"] = img_loss.detach()
 
                 # mask loss
                 mask = out["alpha"].unsqueeze(0) # [1, 1, H, W] in [0, 1]
                 mask_loss = 1000 * (step_ratio if self.opt.warmup_rgb_loss else 1) * F.mse_loss(mask, self.input_mask_torch)
                 loss = loss + mask_loss
+                self.loss_terms["mask"] = mask_loss.detach()
 
             ### novel view (manual batch)
             render_resolution = 128 if step_ratio < 0.3 else (256 if step_ratio < 0.6 else 512)
-            images = []
-            poses = []
+            bg_colors, bank_ids = [], []
             vers, hors, radii = [], [], []
 
             #random
@@ -182,24 +194,19 @@ class Main:
                 hors.append(hor)
                 radii.append(radius)
 
-                pose = orbit_camera(self.opt.elevation + ver, hor, self.opt.radius + radius)
-                poses.append(pose)
-
-                cur_cam = MiniCam(pose, render_resolution, render_resolution, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far)
-
-                bg_color = torch.tensor([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0], dtype=torch.float32, device="cuda")
-                out = self.renderer.render(cur_cam, bg_color=bg_color)
+                bank_ids.append((1 + self.coarse_vers.index(ver)) * len(self.loaded_hors) + view_ids[rand_view_i])
+                bg_colors.append([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0])
 
-                image = out["image"].unsqueeze(0) # [1, 3, H, W] in [0, 1]
-                images.append(image)
-                    
-            images = torch.cat(images, dim=0)
-            poses = torch.from_numpy(np.stack(poses, axis=0)).to(self.device)
+            cams = self.camera_bank.cameras(bank_ids, render_resolution)
+            bg_colors = torch.tensor(bg_colors, dtype=torch.float32, device=self.device)
+            out = self.renderer.render_batch(cams, bg_color=bg_colors)
+            images = out["image"] # [B, 3, H, W] in [0, 1]
 
             if self.enable_zero123:
                 sds_w = self.opt.lambda_zero123
                 sds_loss = self.guidance_zero123.train_step(images, vers, hors, radii, step_ratio=step_ratio if self.opt.anneal_timestep else None, default_elevation=self.opt.elevation)
                 loss = loss + sds_w * sds_loss
+                self.loss_terms["sds"] = (sds_w * sds_loss).detach()
 
             # optimize step
             loss.backward()
@@ -210,7 +217,7 @@ class Main:
             if self.step >= self.opt.density_start_iter and self.step <= self.opt.density_end_iter:
                 viewspace_point_tensor, visibility_filter, radii = out["viewspace_points"], out["visibility_filter"], out["radii"]
                 self.renderer.gaussians.max_radii2D[visibility_filter] = torch.max(self.renderer.gaussians.max_radii2D[visibility_filter], radii[visibility_filter])
-                self.renderer.gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
+                self.renderer.gaussians.add_densification_stats(viewspace_point_tensor, out["view_visibility"])
 
                 if self.step % self.opt.densification_interval == 0:
                     self.renderer.gaussians.densify_and_prune(self.opt.densify_grad_threshold, min_opacity=0.01, extent=4, max_screen_size=1)
@@ -221,6 +228,7 @@ class Main:
         ender.record()
         torch.cuda.synchronize()
         t = starter.elapsed_time(ender)
+        self.iter_ms = t
 
         #export mv images and save
         if self.step==self.opt.iters:
@@ -234,7 +242,8 @@ class Main:
             #render coarse imgs as noise
             for orbit_id in range(int(180/counter_num)):
                 render_resolution = 512
-                images = []
+                cams = self.camera_bank.cameras(range(orbit_id*counter_num, (orbit_id+1)*counter_num), render_resolution)
+                bg_colors = []
                 vers, hors, radii = [], [], []
                 
                 for counter_id in range(counter_num):
@@ -246,17 +255,11 @@ class Main:
                     hors.append(hor)
                     radii.append(radius)
 
-                    pose = orbit_camera(self.opt.elevation + ver, hor, self.opt.radius + radius)
-
-                    cur_cam = MiniCam(pose, render_resolution, render_resolution, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far)
-
-                    bg_color = torch.tensor([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0], dtype=torch.float32, device="cuda")
-                    out = self.renderer.render(cur_cam, bg_color=bg_color)
+                    bg_colors.append([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0])
 
-                    image = out["image"].unsqueeze(0) # [1, 3, H, W] in [0, 1]
-                    images.append(image)
-
-                images = torch.cat(images, dim=0)
+                bg_colors = torch.tensor(bg_colors, dtype=torch.float32, device=self.device)
+                out = self.renderer.render_batch(cams, bg_color=bg_colors)
+                images = out["image"] # [B, 3, H, W] in [0, 1]
 
                 #save refined imgs
                 for counter_id in range(counter_num):
@@ -295,18 +298,39 @@ class Main:
         path = os.path.join(self.opt.outdir, self.opt.save_path + '_coarse.ply')
         self.renderer.gaussians.save_ply(path)
 
+        if self.opt.save_state:
+            self.renderer.gaussians.save_checkpoint(path[:-4] + '.safetensors')
+
         print(f"[INFO] save model to {path}.")
 
+    def save_checkpoint(self):
+        save_training_state(self.opt.ckpt_path, self.renderer.gaussians, self.step)
+
+    def resume(self):
+        if not os.path.isfile(self.opt.ckpt_path):
+            return 0
+        self.step, extra = load_training_state(self.opt.ckpt_path, self.renderer.gaussians, self.opt)
+        self.optimizer = self.renderer.gaussians.optimizer
+        return self.step
+
     # no gui mode
-    def train(self, iters=500):
+    def train(self, iters=500, save=True):
         if iters > 0:
             self.prepare_train()
-            for i in tqdm.trange(iters):
+            start = self.resume() if self.opt.ckpt_path else 0
+            progress = ProgressReporter("coarse", iters)
+            progress.start(num_gaussians=self.renderer.gaussians.get_xyz.shape[0], resumed_step=start)
+            for i in tqdm.trange(start, iters):
                 self.train_step()
+                progress.update(self.step, self.loss_terms, self.renderer.gaussians.get_xyz.shape[0], self.iter_ms)
+                if self.opt.ckpt_path and self.opt.ckpt_interval > 0 and self.step % self.opt.ckpt_interval == 0:
+                    self.save_checkpoint()
             # do a last prune
             self.renderer.gaussians.prune(min_opacity=0.01, extent=1, max_screen_size=1)
+            progress.end(num_gaussians=self.renderer.gaussians.get_xyz.shape[0])
         # save
-        self.save_model()
+        if save:
+            self.save_model()
         
 
 if __name__ == "__main__":
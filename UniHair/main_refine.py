@@ -8,11 +8,13 @@ import torch.nn.functional as F
 import rembg
 
 from utils.cam_utils import orbit_camera, OrbitCamera
-from utils.gs_renderer import Renderer, MiniCam
+from utils.gs_renderer import Renderer, MiniCam, CameraBank
+from utils.progress import ProgressReporter
+from utils.checkpoint import save_training_state, load_training_state
 from utils.criterion import PerceptualLoss, ssim
 
 class Main:
-    def __init__(self, opt):
+    def __init__(self, opt, renderer=None, guidance_zero123=None, p_loss_func=None, bg_remover=None):
         self.opt = opt
         self.cam = OrbitCamera(512, 512, r=opt.radius, fovy=opt.fovy)
 
@@ -21,18 +23,18 @@ class Main:
 
         # models
         self.device = torch.device("cuda")
-        self.bg_remover = None
+        self.bg_remover = bg_remover
 
-        self.guidance_zero123 = None
+        self.guidance_zero123 = guidance_zero123
 
         self.enable_sd = False
         self.enable_zero123 = False
 
         # renderer
-        self.renderer = Renderer(sh_degree=self.opt.sh_degree)
+        self.renderer = renderer if renderer is not None else Renderer(sh_degree=self.opt.sh_degree)
         self.gaussain_scale_factor = 1
 
-        self.p_loss_func = PerceptualLoss().cuda()
+        self.p_loss_func = p_loss_func if p_loss_func is not None else PerceptualLoss().cuda()
         
 
         # l1 loss
@@ -80,8 +82,11 @@ class Main:
         if self.opt.negative_prompt is not None:
             self.negative_prompt = self.opt.negative_prompt
 
+        # gaussians handed over in memory by the previous stage
+        if renderer is not None:
+            self.renderer.gaussians.handoff()
         # override if provide a checkpoint
-        if self.opt.load is not None:
+        elif self.opt.load is not None:
             print('load gaussian from: ', self.opt.load)
             self.renderer.initialize(self.opt.load)            
         else:
@@ -129,6 +134,9 @@ class Main:
             self.cam.far,
         )
 
+        # every view of the pose table, indexed by view id in train_step and update_targets
+        self.camera_bank = CameraBank.from_json('./data/camera_pose_relative.json', self.opt.elevation, self.opt.radius, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far, resolutions=(512,), device=self.device)
+
         self.enable_sd = self.opt.lambda_sd > 0 and self.prompt != ""
         self.enable_zero123 = self.opt.lambda_zero123 > 0 and self.input_img is not None
 
@@ -174,6 +182,7 @@ class Main:
             self.renderer.gaussians.update_learning_rate(self.step)
 
             loss = 0
+            self.loss_terms = {}
 
             ### known view
             if self.input_img_torch is not None and (not self.opt.imagedream):
@@ -184,16 +193,17 @@ class Main:
                 image = out["image"].unsqueeze(0) # [1, 3, H, W] in [0, 1]
                 img_loss = 10000 * F.l1_loss(image, self.input_img_torch)
                 loss = loss + img_loss
+                self.loss_terms["img"] = img_loss.detach()
 
                 # mask loss
                 mask = out["alpha"].unsqueeze(0) # [1, 1, H, W] in [0, 1]
                 mask_loss = 1000 * F.l1_loss(mask, self.input_mask_torch)
                 loss = loss + mask_loss
+                self.loss_terms["mask"] = mask_loss.detach()
 
             ### novel view (manual batch)
             render_resolution = 512 
-            images = []
-            poses = []
+            bg_colors = []
             vers, hors, radii = [], [], []
 
             #random
@@ -213,19 +223,12 @@ class Main:
                 hors.append(hor)
                 radii.append(radius)
 
-                pose = orbit_camera(self.opt.elevation + ver, hor, self.opt.radius + radius)
-                poses.append(pose)
-
-                cur_cam = MiniCam(pose, render_resolution, render_resolution, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far)
+                bg_colors.append([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0])
 
-                bg_color = torch.tensor([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0], dtype=torch.float32, device="cuda")
-                out = self.renderer.render(cur_cam, bg_color=bg_color)
-
-                image = out["image"].unsqueeze(0) # [1, 3, H, W] in [0, 1]
-                images.append(image)
-                    
-            images = torch.cat(images, dim=0)
-            poses = torch.from_numpy(np.stack(poses, axis=0)).to(self.device)
+            cams = self.camera_bank.cameras(view_id_in_extra, render_resolution)
+            bg_colors = torch.tensor(bg_colors, dtype=torch.float32, device=self.device)
+            out = self.renderer.render_batch(cams, bg_color=bg_colors)
+            images = out["image"] # [B, 3, H, W] in [0, 1]
 
             if self.enable_zero123:
                 refined_images = self.refined_images[view_id_in_extra]
@@ -233,12 +236,15 @@ class Main:
 
                 l1_loss = 10000 * self.opt.lambda_zero123 * F.l1_loss(images, refined_images)
                 loss = loss + l1_loss
+                self.loss_terms["l1"] = l1_loss.detach()
 
                 p_loss = self.p_loss_func(images, refined_images) * self.p_loss_factor
                 loss = loss + p_loss
+                self.loss_terms["perceptual"] = p_loss.detach()
 
                 ssim_loss = (1.0 - ssim(images, refined_images)) * self.ssim_factor
                 loss = loss + ssim_loss
+                self.loss_terms["ssim"] = ssim_loss.detach()
 
             # optimize step
             loss.backward()
@@ -249,7 +255,7 @@ class Main:
             if self.step >= self.opt.density_start_iter and self.step <= self.opt.density_end_iter and self.step <= self.opt.iters:
                 viewspace_point_tensor, visibility_filter, radii = out["viewspace_points"], out["visibility_filter"], out["radii"]
                 self.renderer.gaussians.max_radii2D[visibility_filter] = torch.max(self.renderer.gaussians.max_radii2D[visibility_filter], radii[visibility_filter])
-                self.renderer.gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
+                self.renderer.gaussians.add_densification_stats(viewspace_point_tensor, out["view_visibility"])
 
 
                 if (self.step-self.opt.density_start_iter) % self.opt.prune_interval == 0:
@@ -264,6 +270,7 @@ class Main:
         ender.record()
         torch.cuda.synchronize()
         t = starter.elapsed_time(ender)
+        self.iter_ms = t
 
         if self.step==self.opt.iters:
             self.update_targets(self.stage, need_diffusion=False, save=True)
@@ -290,7 +297,8 @@ class Main:
         #render coarse imgs as noise
         for orbit_id in tqdm.tqdm(range(int(180/counter_num))):
             render_resolution = 512
-            images = []
+            cams = self.camera_bank.cameras(range(orbit_id*counter_num, (orbit_id+1)*counter_num), render_resolution)
+            bg_colors = []
             vers, hors, radii = [], [], []
             
             for counter_id in range(counter_num):
@@ -302,17 +310,11 @@ class Main:
                 hors.append(hor)
                 radii.append(radius)
 
-                pose = orbit_camera(self.opt.elevation + ver, hor, self.opt.radius + radius)
+                bg_colors.append([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0])
 
-                cur_cam = MiniCam(pose, render_resolution, render_resolution, self.cam.fovy, self.cam.fovx, self.cam.near, self.cam.far)
-
-                bg_color = torch.tensor([1, 1, 1] if np.random.rand() > self.opt.invert_bg_prob else [0, 0, 0], dtype=torch.float32, device="cuda")
-                out = self.renderer.render(cur_cam, bg_color=bg_color)
-
-                image = out["image"].unsqueeze(0) # [1, 3, H, W] in [0, 1]
-                images.append(image)
-
-            images = torch.cat(images, dim=0)
+            bg_colors = torch.tensor(bg_colors, dtype=torch.float32, device=self.device)
+            out = self.renderer.render_batch(cams, bg_color=bg_colors)
+            images = out["image"] # [B, 3, H, W] in [0, 1]
 
             if need_diffusion:
                 refined_images = self.guidance_zero123.refine(images, vers, hors, radii, strength=strength, default_elevation=self.opt.elevation).float()
@@ -359,20 +361,47 @@ class Main:
         path = os.path.join(self.opt.outdir, self.opt.save_path + '_refine.ply')
         self.renderer.gaussians.save_ply(path)
 
+        if self.opt.save_state:
+            self.renderer.gaussians.save_checkpoint(path[:-4] + '.safetensors')
+
         print(f"[INFO] save model to {path}.")
 
+    def save_checkpoint(self):
+        save_training_state(self.opt.ckpt_path, self.renderer.gaussians, self.step)
+
+    def resume(self):
+        if not os.path.isfile(self.opt.ckpt_path):
+            return 0
+        self.step, extra = load_training_state(self.opt.ckpt_path, self.renderer.gaussians, self.opt)
+        self.optimizer = self.renderer.gaussians.optimizer
+
+        # the diffusion targets are too large to checkpoint; re-render them
+        # unless train_step is about to do so anyway
+        interval = int(self.opt.iters/self.stage)
+        if self.step % interval != 0 and self.step < self.opt.iters:
+            self.update_targets(min(self.step // interval, self.stage - 1))
+        return self.step
+
     # no gui mode
-    def train(self, iters=500):
+    def train(self, iters=500, save=True):
         if iters > 0:
             self.prepare_train()
-            for i in tqdm.trange(iters + self.opt.extra_iter):
+            start = self.resume() if self.opt.ckpt_path else 0
+            progress = ProgressReporter("refine", iters + self.opt.extra_iter)
+            progress.start(num_gaussians=self.renderer.gaussians.get_xyz.shape[0], resumed_step=start)
+            for i in tqdm.trange(start, iters + self.opt.extra_iter):
                 self.train_step()
+                progress.update(self.step, self.loss_terms, self.renderer.gaussians.get_xyz.shape[0], self.iter_ms)
+                if self.opt.ckpt_path and self.opt.ckpt_interval > 0 and self.step % self.opt.ckpt_interval == 0:
+                    self.save_checkpoint()
             # do a last prune
             # self.renderer.gaussians.prune(min_opacity=0.01, extent=1, max_screen_size=1)
             self.renderer.gaussians.prune(min_opacity=0.01, extent=1, max_screen_size=None)
 
+            progress.end(num_gaussians=self.renderer.gaussians.get_xyz.shape[0])
         # save
-        self.save_model()
+        if save:
+            self.save_model()
         
 
 if __name__ == "__main__":
@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import hashlib
+import argparse
+import subprocess
+
+# per-stage arguments of scripts/run_unihair.sh
+STAGE_OVERRIDES = {
+    "coarse": {
+        "iters": 1000,
+        "batch_size": 4,
+    },
+    "refine": {
+        "use_vgg": True,
+        "iters": 600,
+        "batch_size": 4,
+        "density_start_iter": 50,
+        "density_end_iter": 500,
+        "densification_interval": 200,
+        "opacity_reset_interval": 301,
+        "densify_grad_threshold": 0.0002,
+    },
+    "enhance": {
+        "ref_size": 512,
+        "zero123_path": "PaulZhengHit/HairEnhancer",
+        "use_vgg": True,
+        "iters": 1000,
+        "batch_size": 4,
+        "density_start_iter": 50,
+        "density_end_iter": 500,
+        "densification_interval": 200,
+        "densify_grad_threshold": 0.0002,
+    },
+}
+
+CONFIG = "configs/image.yaml"
+DATA_DIR = "./data"
+ALIGN_DIR = "./data/alignment"
+RGBA_DIR = "./data/inputs"
+LOG_DIR = "./data/logs/results"
+MANIFEST_DIR = "./data/pipeline"
+CKPT_INTERVAL = 100
+HASH_CHUNK = 1024 * 1024
+
+
+class Stage:
+    # inputs/outputs are callables of the item so paths follow the item name;
+    # a directory output is hashed as the sorted list of its files
+    def __init__(self, name, deps, cmd, inputs, outputs, params=None, train=False):
+        self.name = name
+        self.deps = deps
+        self.cmd = cmd
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.train = train
+
+
+def image_name(item):
+    # the img_process scripts key every intermediate on the input file name
+    matches = sorted(glob.glob(os.path.join(DATA_DIR, "img", item + ".*")))
+    if not matches:
+        raise FileNotFoundError(f"no input image for {item} in {DATA_DIR}/img")
+    return os.path.basename(matches[0])
+
+
+def train_cmd(script, stage, load=None):
+    def cmd(item, ckpt):
+        args = [sys.executable, script, "--config", CONFIG,
+                f"input={RGBA_DIR}/{item}-rgba.png", f"save_path={item}", f"outdir={LOG_DIR}"]
+        args += [f"{key}={value}" for key, value in STAGE_OVERRIDES[stage].items()]
+        if load is not None:
+            args.append(f"load={LOG_DIR}/{item}/{item}_{load}.ply")
+        if ckpt is not None:
+            args += [f"ckpt_path={ckpt}", f"ckpt_interval={CKPT_INTERVAL}"]
+        return args
+    return cmd
+
+
+STAGES = [
+    Stage(
+        "mask", [],
+        lambda item, ckpt: [sys.executable, "img_process/img2mask.py"],
+        lambda item: [f"{DATA_DIR}/img/{image_name(item)}", "img_process/img2mask.py"],
+        lambda item: [f"{ALIGN_DIR}/resized_img/{image_name(item)}", f"{ALIGN_DIR}/seg/{image_name(item)}"],
+    ),
+    Stage(
+        "landmarks", ["mask"],
+        lambda item, ckpt: [sys.executable, "img_process/get_lmk.py"],
+        lambda item: [f"{ALIGN_DIR}/resized_img/{image_name(item)}", "img_process/get_lmk.py"],
+        lambda item: [f"{ALIGN_DIR}/lmk/{image_name(item)[:-3]}npy"],
+    ),
+    Stage(
+        "alignment", ["mask", "landmarks"],
+        lambda item, ckpt: [sys.executable, "img_process/align_hair_w_body.py"],
+        lambda item: [
+            f"{ALIGN_DIR}/resized_img/{image_name(item)}",
+            f"{ALIGN_DIR}/seg/{image_name(item)}",
+            f"{ALIGN_DIR}/lmk/{image_name(item)[:-3]}npy",
+            f"{ALIGN_DIR}/front.png",
+            f"{ALIGN_DIR}/front_lmk.json",
+            "img_process/align_hair_w_body.py",
+        ],
+        lambda item: [f"{ALIGN_DIR}/aligned_img/{image_name(item)[:-3]}png"],
+    ),
+    Stage(
+        "rgba", ["alignment"],
+        lambda item, ckpt: [sys.executable, "img_process/process_hair_real.py",
+                            f"{ALIGN_DIR}/aligned_img/{item}.png", "--size", "512",
+                            "--border_ratio", "0.0", "--out_dir", RGBA_DIR],
+        lambda item: [f"{ALIGN_DIR}/aligned_img/{item}.png", "img_process/process_hair_real.py"],
+        lambda item: [f"{RGBA_DIR}/{item}-rgba.png"],
+    ),
+    Stage(
+        "coarse", ["rgba"],
+        train_cmd("main_coarse.py", "coarse"),
+        lambda item: [f"{RGBA_DIR}/{item}-rgba.png", CONFIG, "main_coarse.py"],
+        lambda item: [f"{LOG_DIR}/{item}/{item}_coarse.ply", f"{LOG_DIR}/{item}/coarse_gaussian_render"],
+        params=STAGE_OVERRIDES["coarse"], train=True,
+    ),
+    Stage(
+        "refine", ["coarse"],
+        train_cmd("main_refine.py", "refine", load="coarse"),
+        lambda item: [f"{RGBA_DIR}/{item}-rgba.png", f"{LOG_DIR}/{item}/{item}_coarse.ply",
+                      CONFIG, "main_refine.py"],
+        lambda item: [f"{LOG_DIR}/{item}/{item}_refine.ply", f"{LOG_DIR}/{item}/l1_p_gs_refine_render"],
+        params=STAGE_OVERRIDES["refine"], train=True,
+    ),
+    Stage(
+        "enhance", ["refine"],
+        train_cmd("main_enhance.py", "enhance", load="refine"),
+        lambda item: [f"{RGBA_DIR}/{item}-rgba.png", f"{LOG_DIR}/{item}/{item}_refine.ply",
+                      CONFIG, "main_enhance.py"],
+        lambda item: [f"{LOG_DIR}/{item}/{item}_enhance.ply", f"{LOG_DIR}/{item}/l1_p_gs_enhance_render"],
+        params=STAGE_OVERRIDES["enhance"], train=True,
+    ),
+    Stage(
+        "video", ["coarse", "refine", "enhance"],
+        lambda item, ckpt: [
+            [sys.executable, "to_video/to_video_compare_all.py", f"--split={item}", f"--output={LOG_DIR}"],
+            [sys.executable, "to_video/to_video_result.py", f"--split={item}", f"--output={LOG_DIR}"],
+        ],
+        lambda item: [f"{LOG_DIR}/{item}/coarse_gaussian_render", f"{LOG_DIR}/{item}/l1_p_gs_refine_render",
+                      f"{LOG_DIR}/{item}/l1_p_gs_enhance_render", "to_video/to_video_compare_all.py",
+                      "to_video/to_video_result.py"],
+        lambda item: [f"{LOG_DIR}/video/compare_{item}.mp4", f"{LOG_DIR}/video/{item}.mp4"],
+    ),
+]
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+
+class FileHasher:
+    # sha256 of files, memoized on (size, mtime) so unchanged multi-hundred-MB
+    # plys are hashed once per run
+    def __init__(self):
+        self.memo = {}
+
+    def file(self, path):
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key not in self.memo:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                    digest.update(chunk)
+            self.memo[key] = digest.hexdigest()
+        return self.memo[key]
+
+    def path(self, path):
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for name in sorted(os.listdir(path)):
+                digest.update(name.encode())
+                digest.update(self.path(os.path.join(path, name)).encode())
+            return digest.hexdigest()
+        if os.path.isfile(path):
+            return self.file(path)
+        return None
+
+
+class Pipeline:
+    def __init__(self, item, manifest_dir=MANIFEST_DIR):
+        self.item = item
+        self.manifest_dir = os.path.join(manifest_dir, item)
+        self.hasher = FileHasher()
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def manifest_path(self, stage):
+        return os.path.join(self.manifest_dir, f"{stage.name}.json")
+
+    def ckpt_path(self, stage, input_digest):
+        return os.path.join(self.manifest_dir, f"{stage.name}-{input_digest[:12]}.ckpt")
+
+    def load_manifest(self, stage):
+        try:
+            with open(self.manifest_path(stage)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def input_hashes(self, stage):
+        hashes = {path: self.hasher.path(path) for path in stage.inputs(self.item)}
+        hashes["params"] = hashlib.sha256(
+            json.dumps(stage.params, sort_keys=True).encode()
+        ).hexdigest()
+        return hashes
+
+    def input_digest(self, hashes):
+        return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()
+
+    def status(self, stage):
+        # (valid, reason): a stage is reusable when its recorded inputs match
+        # and every recorded output is still on disk unchanged
+        manifest = self.load_manifest(stage)
+        if manifest is None:
+            return False, "never ran"
+        hashes = self.input_hashes(stage)
+        if None in hashes.values():
+            return False, "missing inputs"
+        if manifest["inputs"] != hashes:
+            changed = sorted(k for k in hashes if manifest["inputs"].get(k) != hashes[k])
+            return False, f"inputs changed: {', '.join(changed)}"
+        for path, digest in manifest["outputs"].items():
+            if self.hasher.path(path) != digest:
+                return False, f"output changed: {path}"
+        return True, "up to date"
+
+    def run_stage(self, stage):
+        hashes = self.input_hashes(stage)
+        missing = [path for path, digest in hashes.items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"{stage.name}: missing inputs {missing}")
+        digest = self.input_digest(hashes)
+
+        # stale outputs would be skipped by scripts such as get_lmk.py
+        for path in stage.outputs(self.item):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+
+        ckpt = None
+        if stage.train:
+            ckpt = self.ckpt_path(stage, digest)
+            for old in glob.glob(os.path.join(self.manifest_dir, f"{stage.name}-*.ckpt")):
+                if old != ckpt:
+                    os.remove(old)
+
+        cmds = stage.cmd(self.item, ckpt)
+        if cmds and isinstance(cmds[0], str):
+            cmds = [cmds]
+        started = time.time()
+        for cmd in cmds:
+            print(f"[PIPELINE] {self.item} {stage.name}: {' '.join(cmd)}", flush=True)
+            subprocess.run(cmd, check=True)
+
+        outputs = {}
+        for path in stage.outputs(self.item):
+            outputs[path] = self.hasher.path(path)
+            if outputs[path] is None:
+                raise FileNotFoundError(f"{stage.name}: expected output {path} was not written")
+
+        manifest = {
+            "stage": stage.name,
+            "inputs": hashes,
+            "outputs": outputs,
+            "started_at": started,
+            "finished_at": time.time(),
+        }
+        tmp = self.manifest_path(stage) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path(stage))
+        if ckpt is not None and os.path.isfile(ckpt):
+            os.remove(ckpt)
+
+    def run(self, force_from=None):
+        # stages are listed in dependency order; a stage reruns when it is
+        # invalid or any of its dependencies reran
+        rerun = set()
+        for stage in STAGES:
+            forced = force_from is not None and STAGE_NAMES.index(stage.name) >= STAGE_NAMES.index(force_from)
+            if forced:
+                reason = "forced"
+            elif rerun.intersection(stage.deps):
+                reason = "dependency reran"
+            else:
+                valid, reason = self.status(stage)
+                if valid:
+                    print(f"[PIPELINE] {self.item} {stage.name}: cached ({reason})", flush=True)
+                    continue
+            print(f"[PIPELINE] {self.item} {stage.name}: running ({reason})", flush=True)
+            self.run_stage(stage)
+            rerun.add(stage.name)
+        return rerun
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("items", nargs="+", help="image ids, read from data/img/<id>.*")
+    parser.add_argument("--force_from", choices=STAGE_NAMES, default=None,
+                        help="rerun this stage and everything after it")
+    parser.add_argument("--status", action="store_true", help="only print which stages are cached")
+    args = parser.parse_args()
+
+    failed = []
+    for item in args.items:
+        pipeline = Pipeline(item)
+        if args.status:
+            for stage in STAGES:
+                valid, reason = pipeline.status(stage)
+                print(f"{item:<40} {stage.name:<10} {'ok' if valid else 'stale':<6} {reason}")
+            continue
+        try:
+            pipeline.run(args.force_from)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"[PIPELINE] {item} failed: {e}", flush=True)
+            failed.append(item)
+
+    if failed:
+        sys.exit(f"failed items: {' '.join(failed)}")
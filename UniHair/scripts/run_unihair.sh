@@ -27,10 +27,22 @@ densification_interval=200
 opacity_reset_interval=301
 densify_grad_threshold=0.0002
 
+# 1: run every item through one warm worker process (worker.py), models load once
+# and gaussians stay in memory between stages; 0: one process per stage and item
+use_worker=${USE_WORKER:-1}
+
 for item in $list; do
-    echo $item
     python img_process/process_hair_real.py $source_img_path$item.png --size 512 --border_ratio 0.0  --out_dir $img_dir
-    
+done
+
+if [ "$use_worker" = "1" ]; then
+    CUDA_VISIBLE_DEVICES=$gpu_id python worker.py --config configs/image.yaml --items $list --img_dir $img_dir --outdir $logdir --enhancer_path $enhancer_path
+fi
+
+for item in $list; do
+    echo $item
+
+    if [ "$use_worker" != "1" ]; then
     #coarse gaussian initialization
     CUDA_VISIBLE_DEVICES=$gpu_id python main_coarse.py --config configs/image.yaml input=$img_dir/$item-rgba.png save_path=$item outdir=$logdir iters=$iters_sds batch_size=$batch_size
 
@@ -39,6 +51,7 @@ for item in $list; do
 
     #pixel-wise refinement
     CUDA_VISIBLE_DEVICES=$gpu_id python main_enhance.py --config configs/image.yaml ref_size=512 zero123_path=$enhancer_path use_vgg=True input=$img_dir/$item-rgba.png save_path=$item outdir=$logdir iters=$iters_deblur batch_size=$batch_size load=$logdir/$item/$item$refine_ply_name densification_interval=$densification_interval densify_grad_threshold=$densify_grad_threshold density_start_iter=$density_start_iter density_end_iter=$density_end_iter_deblur
+    fi
 
     python to_video/to_video_compare_all.py --split=$item --output=$logdir
     python to_video/to_video_result.py --split=$item --output=$logdir
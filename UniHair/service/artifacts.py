@@ -0,0 +1,165 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# bump when a code change alters the pipeline output for the same inputs
+PIPELINE_VERSION = "1"
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_digest(paths: Iterable[str], params: Optional[Dict[str, str]] = None) -> str:
+    # Hash of everything besides the image that decides the result: the yaml
+    # config, the stage scripts (which carry the iteration and densification
+    # parameters) and any extra parameters.
+    digest = hashlib.sha256(f"unihair-pipeline-v{PIPELINE_VERSION}".encode())
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        if os.path.isfile(path):
+            digest.update(file_sha256(path).encode())
+    for name, value in sorted((params or {}).items()):
+        digest.update(f"{name}={value}".encode())
+    return digest.hexdigest()
+
+
+def artifact_key(image_digest: str, config: str) -> str:
+    return hashlib.sha256(f"{image_digest}:{config}".encode()).hexdigest()[:32]
+
+
+class ArtifactStore:
+    # Finished pipeline outputs stored as <root>/<key>_<kind>.ply, with an
+    # index of sizes and last access times for LRU eviction under a quota.
+    # The outputs are moved in, so the store owns every byte it counts.
+    def __init__(self, root: str, quota_bytes: int):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                key TEXT PRIMARY KEY,
+                kinds TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def filename(self, key: str, kind: str) -> str:
+        return f"{key}_{kind}.ply"
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.root, filename)
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT kinds FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            files = {kind: self.filename(key, kind) for kind in row[0].split(",")}
+            if not all(os.path.isfile(self.path(name)) for name in files.values()):
+                # removed behind our back; treat as a miss
+                self._delete(key, files.values())
+                self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE artifacts SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+            self.hits += 1
+        return files
+
+    def put(self, key: str, sources: Dict[str, str]) -> Dict[str, str]:
+        # sources maps kind -> finished file; each is moved into the store and
+        # only served from there afterwards
+        files = {}
+        size = 0
+        for kind, source in sources.items():
+            name = self.filename(key, kind)
+            try:
+                os.replace(source, self.path(name))
+            except OSError:
+                # another filesystem: copy next to the target, then swap it in
+                tmp = self.path(f".{name}.tmp")
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, self.path(name))
+                os.remove(source)
+            files[kind] = name
+            size += os.path.getsize(self.path(name))
+
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO artifacts (key, kinds, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, ",".join(files), size, now, now),
+            )
+            self._evict(keep=key)
+            self.db.commit()
+        return files
+
+    def _delete(self, key: str, filenames: Iterable[str]):
+        for name in filenames:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+        self.db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+
+    def _evict(self, keep: str):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.quota_bytes:
+            return
+        rows = self.db.execute(
+            "SELECT key, kinds, size FROM artifacts WHERE key != ? ORDER BY last_access",
+            (keep,),
+        ).fetchall()
+        for key, kinds, size in rows:
+            if total <= self.quota_bytes:
+                break
+            self._delete(key, [self.filename(key, kind) for kind in kinds.split(",")])
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            entries, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "quota_bytes": self.quota_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
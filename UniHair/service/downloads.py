@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.responses import Response, StreamingResponse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+MIN_COMPRESS_SIZE = 1024
+ETAG_CACHE_SIZE = 4096
+
+SAFE_NAME = re.compile(r"^[\w\-][\w\-.]*$")
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def resolve_download(filename: str, roots: Iterable[str]) -> Optional[str]:
+    # only plain file names are served, and only from inside one of the roots
+    if not SAFE_NAME.match(filename) or ".." in filename:
+        return None
+    for root in roots:
+        root = os.path.realpath(root)
+        path = os.path.realpath(os.path.join(root, filename))
+        if os.path.dirname(path) == root and os.path.isfile(path):
+            return path
+    return None
+
+
+class ETagCache:
+    # strong ETags are the sha256 of the content; hashing a few hundred MB
+    # takes a while, so digests are kept per (path, size, mtime)
+    def __init__(self, size: int = ETAG_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.digests: Dict[Tuple[str, int, int], str] = {}
+
+    def _hash(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def get(self, path: str) -> str:
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            digest = self.digests.get(key)
+        if digest is None:
+            digest = await asyncio.to_thread(self._hash, path)
+            with self.lock:
+                if len(self.digests) >= self.size:
+                    self.digests.clear()
+                self.digests[key] = digest
+        return digest
+
+
+def make_etag(digest: str, encoding: Optional[str] = None) -> str:
+    # each encoding is a separate representation and gets its own strong tag
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def available_encodings() -> List[str]:
+    return (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def _compressor(encoding: str):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    # wbits 16+ writes the gzip header and trailer
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress_file(path: str, out_path: str, encoding: str):
+    compressor = _compressor(encoding)
+    tmp = f"{out_path}.{uuid.uuid4().hex}.tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            dst.write(compressor.compress(chunk))
+        dst.write(compressor.flush())
+    os.replace(tmp, out_path)
+
+
+class CompressedCache:
+    # Compressed representations are written once per (content digest,
+    # encoding) and then served like any other file, so they have a length
+    # and can be resumed with Range. The least recently served ones are
+    # removed once the directory exceeds quota_bytes.
+    def __init__(self, root: str, quota_bytes: int):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+
+    async def get(self, path: str, digest: str, encoding: str) -> str:
+        out_path = os.path.join(self.root, f"{digest}.{encoding}")
+        try:
+            os.utime(out_path)
+            return out_path
+        except FileNotFoundError:
+            pass
+        await asyncio.to_thread(compress_file, path, out_path, encoding)
+        await asyncio.to_thread(self._evict, out_path)
+        return out_path
+
+    def _evict(self, keep: str):
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.quota_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # (start, end) inclusive for a single byte range, None when the whole
+    # file should be sent; multiple ranges are answered with the whole file
+    if not header:
+        return None
+    match = BYTE_RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, end
+
+
+def if_range_matches(if_range: Optional[str], etag: str) -> bool:
+    # If-Range uses the strong comparison; a date never matches, which only
+    # costs a full response
+    return if_range is None or if_range.strip() == etag
+
+
+async def file_chunks(path: str, start: int, length: int):
+    def read(f, size):
+        return f.read(size)
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = await asyncio.to_thread(read, f, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(
+    path: str, method: str, request_headers, headers: Dict[str, str]
+) -> Response:
+    # 200 for the whole file, 206 with Content-Range for one satisfiable
+    # range, 416 when the range starts past the end
+    st = os.stat(path)
+    size = st.st_size
+    headers = dict(headers)
+    headers["Accept-Ranges"] = "bytes"
+    headers["Last-Modified"] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(st.st_mtime))
+
+    status_code = 200
+    start, end = 0, size - 1
+    if if_range_matches(request_headers.get("if-range"), headers.get("ETag", "")):
+        try:
+            byte_range = parse_range(request_headers.get("range"), size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    if method == "HEAD" or length == 0:
+        return Response(status_code=status_code, headers=headers, media_type="application/octet-stream")
+    return StreamingResponse(
+        file_chunks(path, start, length),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
@@ -0,0 +1,634 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from service.process_runner import EVENT, PROGRESS
+
+QUEUED = "queued"
+RUNNING = "running"
+SKIPPED = "skipped"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+PROGRESS_SAVE_INTERVAL = 1.0
+FLUSH_INTERVAL = 0.25
+# logs and events of jobs that finished longer ago than this are deleted
+LOG_RETENTION = float(os.environ.get("UNIHAIR_JOB_LOG_RETENTION_DAYS", 7)) * 86400
+RETENTION_CHECK_INTERVAL = 3600.0
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        build_cmd: Callable[[Dict[str, Any]], Any],
+        timeout: int = 1800,
+        concurrency: int = 1,
+        runner=None,
+    ):
+        # build_cmd returns whatever the runner takes: a command line for the
+        # scheduler's runner, a request for a stage-specific one
+        self.name = name
+        self.build_cmd = build_cmd
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.runner = runner
+
+
+class JobStore:
+    # Job and stage state is written as it changes. Log lines, events and
+    # progress arrive many times a second while a job runs, so they only get
+    # their seq in memory and a writer thread inserts them in batches on its
+    # own connection; reads merge in whatever is still pending. Coalesced
+    # events (training progress) keep only the latest one per job, stored at
+    # most once per progress_interval.
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = FLUSH_INTERVAL,
+        retention: float = LOG_RETENTION,
+        progress_interval: float = PROGRESS_SAVE_INTERVAL,
+    ):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                filename TEXT,
+                upload_path TEXT,
+                stem TEXT,
+                stage TEXT,
+                progress TEXT,
+                error TEXT,
+                artifacts TEXT,
+                cache_key TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS stages (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                state TEXT NOT NULL,
+                returncode INTEGER,
+                started_at REAL,
+                finished_at REAL,
+                PRIMARY KEY (job_id, name)
+            );
+            CREATE TABLE IF NOT EXISTS logs (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                line TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            );
+            """
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "cache_key" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN cache_key TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_cache_key ON jobs (cache_key)")
+        self.db.commit()
+        self.log_seq: Dict[str, int] = {}
+        self.event_seq: Dict[str, int] = {}
+        self.pending_logs: List[Tuple[str, int, float, str]] = []
+        self.pending_events: List[Tuple[str, int, float, str]] = []
+        self.pending_progress: Dict[str, str] = {}
+        self.coalesced_events: Dict[str, Tuple[float, str]] = {}
+        self.coalesced_written: Dict[str, float] = {}
+        self.coalesced = 0
+        self.last_retention = 0.0
+
+        self.write_lock = threading.Lock()
+        self.write_db: Optional[sqlite3.Connection] = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="job-store", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def create_job(
+        self,
+        filename: str,
+        upload_path: str,
+        stem: str,
+        stage_names: List[str],
+        cache_key: Optional[str] = None,
+    ) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (id, state, filename, upload_path, stem, cache_key, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, upload_path, stem, cache_key, now),
+            )
+            self.db.executemany(
+                "INSERT INTO stages (job_id, position, name, state) VALUES (?, ?, ?, ?)",
+                [(job_id, i, name, QUEUED) for i, name in enumerate(stage_names)],
+            )
+            self.db.commit()
+        return job_id
+
+    def update_job(self, job_id: str, **fields):
+        if "artifacts" in fields:
+            fields["artifacts"] = json.dumps(fields["artifacts"])
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+            self.db.commit()
+
+    def update_stage(self, job_id: str, name: str, **fields):
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock:
+            self.db.execute(
+                f"UPDATE stages SET {columns} WHERE job_id = ? AND name = ?",
+                (*fields.values(), job_id, name),
+            )
+            self.db.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            stages = self.db.execute(
+                "SELECT name, state, returncode, started_at, finished_at FROM stages "
+                "WHERE job_id = ? ORDER BY position",
+                (job_id,),
+            ).fetchall()
+        job = dict(row)
+        with self.lock:
+            job["progress"] = self.pending_progress.get(job_id, job["progress"])
+        job["artifacts"] = json.loads(job["artifacts"]) if job["artifacts"] else {}
+        job["stages"] = [dict(stage) for stage in stages]
+        for stage in job["stages"]:
+            if stage["started_at"] and stage["finished_at"]:
+                stage["duration"] = stage["finished_at"] - stage["started_at"]
+        return job
+
+    def list_jobs(self, limit: int = 100, states: Optional[List[str]] = None):
+        query = "SELECT id, state, filename, stage, created_at, finished_at FROM jobs"
+        params: List[Any] = []
+        if states:
+            query += f" WHERE state IN ({', '.join('?' for _ in states)})"
+            params.extend(states)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, params).fetchall()]
+
+    def find_active(self, cache_key: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id FROM jobs WHERE cache_key = ? AND state IN (?, ?) "
+                "ORDER BY created_at LIMIT 1",
+                (cache_key, QUEUED, RUNNING),
+            ).fetchone()
+        return row[0] if row else None
+
+    def count_by_state(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return {state: count for state, count in rows}
+
+    def _next_seq(self, seqs: Dict[str, int], table: str, job_id: str) -> int:
+        # called with self.lock held
+        seq = seqs.get(job_id)
+        if seq is None:
+            seq = self.db.execute(
+                f"SELECT COALESCE(MAX(seq), -1) FROM {table} WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+        seq += 1
+        seqs[job_id] = seq
+        return seq
+
+    def append_log(self, job_id: str, line: str) -> int:
+        with self.lock:
+            seq = self._next_seq(self.log_seq, "logs", job_id)
+            self.pending_logs.append((job_id, seq, time.time(), line))
+        return seq
+
+    def append_event(self, job_id: str, event: Dict[str, Any], coalesce: bool = False) -> Optional[int]:
+        # returns the seq, or None for a coalesced event that has none yet
+        with self.lock:
+            if coalesce:
+                if job_id in self.coalesced_events:
+                    self.coalesced += 1
+                self.coalesced_events[job_id] = (time.time(), json.dumps(event))
+                return None
+            # a held back event goes first, so the stored order stays the arrival order
+            self._release_coalesced(job_id)
+            seq = self._next_seq(self.event_seq, "events", job_id)
+            self.pending_events.append((job_id, seq, time.time(), json.dumps(event)))
+        return seq
+
+    def _release_coalesced(self, job_id: str):
+        # called with self.lock held
+        held = self.coalesced_events.pop(job_id, None)
+        if held is not None:
+            seq = self._next_seq(self.event_seq, "events", job_id)
+            self.pending_events.append((job_id, seq, *held))
+            self.coalesced_written[job_id] = time.time()
+
+    def set_progress(self, job_id: str, progress: str):
+        with self.lock:
+            self.pending_progress[job_id] = progress
+
+    def _read(self, table: str, column: str, pending, job_id: str, offset: int, limit: int):
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT seq, {column} FROM {table} WHERE job_id = ? AND seq >= ? "
+                "ORDER BY seq LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+            if len(rows) < limit:
+                # rows are flushed in seq order, so the pending ones follow the stored ones
+                start = rows[-1][0] + 1 if rows else offset
+                rows = list(rows) + [
+                    (seq, value)
+                    for row_job, seq, _, value in pending
+                    if row_job == job_id and seq >= start
+                ][: limit - len(rows)]
+        return rows
+
+    def read_events(self, job_id: str, offset: int = 0, limit: int = 1000):
+        return self._read("events", "data", self.pending_events, job_id, offset, limit)
+
+    def read_logs(self, job_id: str, offset: int = 0, limit: int = 1000):
+        return self._read("logs", "line", self.pending_logs, job_id, offset, limit)
+
+    def flush(self, final: bool = False):
+        # only the writer thread (or close, after it stopped) calls this
+        with self.write_lock:
+            with self.lock:
+                now = time.time()
+                for job_id in list(self.coalesced_events):
+                    if final or now - self.coalesced_written.get(job_id, 0.0) >= self.progress_interval:
+                        self._release_coalesced(job_id)
+                logs = list(self.pending_logs)
+                events = list(self.pending_events)
+                progress = dict(self.pending_progress)
+            if not (logs or events or progress):
+                return
+            if self.write_db is None:
+                self.write_db = sqlite3.connect(self.path, check_same_thread=False)
+            self.write_db.executemany(
+                "INSERT OR REPLACE INTO logs (job_id, seq, ts, line) VALUES (?, ?, ?, ?)", logs
+            )
+            self.write_db.executemany(
+                "INSERT OR REPLACE INTO events (job_id, seq, ts, data) VALUES (?, ?, ?, ?)", events
+            )
+            self.write_db.executemany(
+                "UPDATE jobs SET progress = ? WHERE id = ?",
+                [(value, job_id) for job_id, value in progress.items()],
+            )
+            self.write_db.commit()
+            with self.lock:
+                del self.pending_logs[: len(logs)]
+                del self.pending_events[: len(events)]
+                for job_id, value in progress.items():
+                    if self.pending_progress.get(job_id) == value:
+                        del self.pending_progress[job_id]
+
+    def prune(self, now: Optional[float] = None):
+        # deletes the logs and events of jobs that finished more than retention ago
+        cutoff = (now or time.time()) - self.retention
+        with self.write_lock:
+            if self.write_db is None:
+                self.write_db = sqlite3.connect(self.path, check_same_thread=False)
+            expired = [
+                row[0]
+                for row in self.write_db.execute(
+                    "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                    (cutoff,),
+                )
+            ]
+            for table in ("logs", "events"):
+                self.write_db.execute(
+                    f"DELETE FROM {table} WHERE job_id IN "
+                    "(SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)",
+                    (cutoff,),
+                )
+            self.write_db.commit()
+        with self.lock:
+            for job_id in expired:
+                self.log_seq.pop(job_id, None)
+                self.event_seq.pop(job_id, None)
+                self.coalesced_written.pop(job_id, None)
+        return len(expired)
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                now = time.time()
+                if now - self.last_retention >= RETENTION_CHECK_INTERVAL:
+                    self.last_retention = now
+                    self.prune(now)
+            except sqlite3.Error as e:
+                print(f"[ERROR] 无法写入任务数据库: {str(e)}", file=sys.stderr)
+
+    def recover(self) -> List[str]:
+        # Jobs that were running when the server stopped cannot be resumed;
+        # queued ones are handed back to the scheduler.
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE state = ?",
+                (FAILED, "server restarted while the job was running", now, RUNNING),
+            )
+            self.db.execute(
+                "UPDATE stages SET state = ?, finished_at = ? WHERE state = ?",
+                (FAILED, now, RUNNING),
+            )
+            self.db.commit()
+            rows = self.db.execute(
+                "SELECT id FROM jobs WHERE state = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush(final=True)
+        with self.write_lock:
+            if self.write_db is not None:
+                self.write_db.close()
+                self.write_db = None
+        with self.lock:
+            self.db.close()
+
+
+class JobScheduler:
+    # runner(cmd, job_id, prefix, timeout, result) is an async generator of
+    # (item, kind) tuples (see service/process_runner.py) that stores the exit
+    # code in result["returncode"] and kills the child process when it is
+    # cancelled.
+    def __init__(
+        self,
+        store: JobStore,
+        stages: List[Stage],
+        runner,
+        workers: int = 1,
+        collect_artifacts: Optional[Callable[[Dict[str, Any]], Dict[str, str]]] = None,
+        log: Callable[..., None] = print,
+    ):
+        self.store = store
+        self.stages = stages
+        self.runner = runner
+        self.workers = workers
+        self.collect_artifacts = collect_artifacts
+        self.log = log
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker_tasks: List[asyncio.Task] = []
+        self.running: Dict[str, asyncio.Task] = {}
+        self.stage_limits: Dict[str, asyncio.Semaphore] = {}
+        self.updates: Dict[str, asyncio.Event] = {}
+        self.stopping = False
+
+    @property
+    def stage_names(self) -> List[str]:
+        return [stage.name for stage in self.stages]
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.stage_limits = {
+            stage.name: asyncio.Semaphore(stage.concurrency) for stage in self.stages
+        }
+        for job_id in self.store.recover():
+            self.queue.put_nowait(job_id)
+        self.worker_tasks = [
+            asyncio.get_running_loop().create_task(self._worker())
+            for _ in range(self.workers)
+        ]
+        return self
+
+    async def stop(self):
+        self.stopping = True
+        for task in list(self.running.values()) + self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(
+            *self.running.values(), *self.worker_tasks, return_exceptions=True
+        )
+
+    def submit(
+        self, filename: str, upload_path: str, stem: str, cache_key: Optional[str] = None
+    ) -> str:
+        # A job for the same cache key that is still queued or running is
+        # shared instead of starting the pipeline twice.
+        if cache_key is not None:
+            job_id = self.store.find_active(cache_key)
+            if job_id is not None:
+                self.log(f"复用进行中的任务: {filename}", job_id)
+                return job_id
+        job_id = self.store.create_job(
+            filename, upload_path, stem, self.stage_names, cache_key=cache_key
+        )
+        self.queue.put_nowait(job_id)
+        self.log(f"任务已加入队列: {filename}", job_id)
+        return job_id
+
+    def complete_cached(
+        self,
+        filename: str,
+        upload_path: str,
+        stem: str,
+        cache_key: str,
+        artifacts: Dict[str, str],
+    ) -> str:
+        # Records a job whose outputs came from the artifact cache, so the
+        # regular job endpoints work for cache hits too.
+        job_id = self.store.create_job(
+            filename, upload_path, stem, self.stage_names, cache_key=cache_key
+        )
+        for name in self.stage_names:
+            self.store.update_stage(job_id, name, state=SKIPPED)
+        self.store.update_job(job_id, started_at=time.time())
+        self._append(job_id, f"[JOB] cache hit {cache_key}")
+        self._finish(job_id, SUCCEEDED, artifacts=artifacts)
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.store.get_job(job_id)
+        if job is None or job["state"] in TERMINAL_STATES:
+            return False
+        task = self.running.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            self._finish(job_id, CANCELLED, error="cancelled before start")
+        return True
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        if self.queue is None:
+            return None
+        # asyncio.Queue keeps its items in a deque
+        pending = list(self.queue._queue)
+        return pending.index(job_id) if job_id in pending else None
+
+    async def wait_for_update(self, job_id: str, timeout: float = 1.0):
+        event = self.updates.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify(self, job_id: str):
+        event = self.updates.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _append(self, job_id: str, line: str):
+        self.store.append_log(job_id, line)
+        self._notify(job_id)
+
+    def _event(self, job_id: str, event: Dict[str, Any], coalesce: bool = False):
+        self.store.append_event(job_id, event, coalesce=coalesce)
+        self._notify(job_id)
+
+    def _finish(self, job_id: str, state: str, **fields):
+        self.store.update_job(job_id, state=state, finished_at=time.time(), **fields)
+        self._event(job_id, {"type": "state", "state": state, "error": fields.get("error")})
+        self._append(job_id, f"[JOB] {state}")
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            job = self.store.get_job(job_id)
+            if job is None or job["state"] != QUEUED:
+                continue
+            task = asyncio.get_running_loop().create_task(self._run_job(job))
+            self.running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # a cancelled job only ends that job, not the worker
+                if self.stopping or not task.cancelled():
+                    raise
+            finally:
+                self.running.pop(job_id, None)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        self.store.update_job(job_id, state=RUNNING, started_at=time.time())
+        self._event(job_id, {"type": "state", "state": RUNNING})
+        self._append(job_id, f"[JOB] running {job['filename']}")
+        stage = None
+        try:
+            for stage in self.stages:
+                returncode = await self._run_stage(job, stage)
+                if returncode != 0:
+                    self._finish(
+                        job_id,
+                        FAILED,
+                        error=f"{stage.name} exited with code {returncode}",
+                    )
+                    return
+
+            # may move or copy large files and commit the artifact index
+            artifacts = (
+                await asyncio.to_thread(self.collect_artifacts, job)
+                if self.collect_artifacts
+                else {}
+            )
+            self._finish(job_id, SUCCEEDED, stage=None, artifacts=artifacts)
+        except asyncio.CancelledError:
+            if stage is not None:
+                self.store.update_stage(
+                    job_id, stage.name, state=CANCELLED, finished_at=time.time()
+                )
+            self._finish(job_id, CANCELLED, error="cancelled")
+            raise
+        except Exception as e:
+            self.log(f"任务执行异常: {str(e)}", job_id, error=True)
+            self.log(traceback.format_exc(), job_id, error=True)
+            self._finish(job_id, FAILED, error=str(e))
+
+    async def _run_stage(self, job: Dict[str, Any], stage: Stage) -> Optional[int]:
+        job_id = job["id"]
+        async with self.stage_limits[stage.name]:
+            self.store.update_job(job_id, stage=stage.name)
+            self.store.update_stage(job_id, stage.name, state=RUNNING, started_at=time.time())
+            self._event(job_id, {"type": "job_stage", "job_stage": stage.name, "state": RUNNING})
+            self._append(job_id, f"===== {stage.name} =====")
+
+            result: Dict[str, Any] = {}
+            last_progress = None
+            last_progress_save = 0.0
+            runner = stage.runner or self.runner
+            async for item, kind in runner(
+                stage.build_cmd(job), job_id, stage.name, stage.timeout, result
+            ):
+                if kind == EVENT:
+                    self._event(
+                        job_id,
+                        {**item, "job_stage": stage.name},
+                        coalesce=item.get("type") == "progress",
+                    )
+                    if item.get("type") != "progress":
+                        continue
+                    item = (
+                        f"{stage.name} [PROGRESS]: {item.get('stage')} "
+                        f"{item.get('step')}/{item.get('total')}"
+                    )
+                if kind in (EVENT, PROGRESS):
+                    # progress bars redraw constantly; keep only the latest one
+                    last_progress = item
+                    now = time.monotonic()
+                    if now - last_progress_save >= PROGRESS_SAVE_INTERVAL:
+                        self.store.set_progress(job_id, item)
+                        last_progress_save = now
+                    self._notify(job_id)
+                else:
+                    self._append(job_id, item)
+
+            returncode = result.get("returncode")
+            if last_progress is not None:
+                self.store.set_progress(job_id, last_progress)
+            state = SUCCEEDED if returncode == 0 else FAILED
+            self.store.update_stage(
+                job_id,
+                stage.name,
+                state=state,
+                returncode=returncode,
+                finished_at=time.time(),
+            )
+            self._event(
+                job_id,
+                {"type": "job_stage", "job_stage": stage.name, "state": state, "returncode": returncode},
+            )
+            return returncode
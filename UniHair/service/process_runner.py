@@ -0,0 +1,195 @@
+import asyncio
+import os
+import re
+import signal
+import subprocess
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from utils.progress import parse_event
+
+PROGRESS_REGEX = re.compile(r"(\d+%|\d+/\d+|\d+\.\d+it/s)")
+ANSI_ESCAPE = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+# tqdm redraws its bar with \r, so both characters end a line
+LINE_BREAK = re.compile(rb"[\r\n]")
+
+READ_CHUNK = 64 * 1024
+QUEUE_SIZE = 256
+TERMINATE_GRACE = 0.5
+EXIT_WAIT = 5.0
+
+# kinds of items yielded by run_process
+OUTPUT = "output"
+PROGRESS = "progress"
+EVENT = "event"
+
+
+def is_progress_line(line: str) -> bool:
+    if not line.strip():
+        return False
+    return bool(PROGRESS_REGEX.search(line))
+
+
+def process_output_line(
+    line: str, prefix: str, is_error: bool = False
+) -> Tuple[str, bool]:
+    cleaned_line = ANSI_ESCAPE.sub("", line).rstrip()
+
+    is_progress = is_progress_line(cleaned_line)
+
+    if is_progress:
+        type_label = "PROGRESS"
+    elif is_error:
+        type_label = "ERR"
+    else:
+        type_label = "OUT"
+
+    formatted_line = f"{prefix} [{type_label}]: {cleaned_line}"
+
+    return formatted_line, is_progress
+
+
+async def read_lines(stream: asyncio.StreamReader) -> AsyncGenerator[str, None]:
+    buffer = b""
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        *lines, buffer = LINE_BREAK.split(buffer + chunk)
+        for line in lines:
+            if line:
+                yield line.decode("utf-8", errors="replace")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+async def terminate_process(process: asyncio.subprocess.Process):
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "nt":
+            process.kill()
+            return
+        pgid = os.getpgid(process.pid)
+        os.killpg(pgid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+        except asyncio.TimeoutError:
+            os.killpg(pgid, signal.SIGKILL)
+            await process.wait()
+    except (ProcessLookupError, OSError):
+        pass
+
+
+async def run_process(
+    cmd: List[str],
+    process_id: str,
+    prefix: str,
+    timeout: float,
+    result: Dict[str, Any],
+    log: Optional[Callable[..., None]] = None,
+    queue_size: int = QUEUE_SIZE,
+) -> AsyncGenerator[Tuple[Any, str], None]:
+    # Yields (formatted_line, OUTPUT | PROGRESS) for every stdout/stderr line
+    # of cmd, or (event_dict, EVENT) for structured progress events written by
+    # utils/progress.py, and stores the exit code in result["returncode"]. Both pipes are read by
+    # event-loop tasks; when the consumer falls behind, the bounded queue stops
+    # the readers, the pipe fills and the child blocks on write. Progress
+    # redraws are the exception: they are dropped while the queue is full and
+    # only the latest one is delivered.
+    log = log or (lambda *args, **kwargs: None)
+    log(f"启动命令: {' '.join(cmd)}", process_id)
+
+    env = os.environ.copy()
+    env["PYTHONUNBUFFERED"] = "1"
+    if os.name == "nt":
+        group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group = {"start_new_session": True}
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            **group,
+        )
+    except OSError as e:
+        log(f"启动进程失败: {str(e)}", process_id, error=True)
+        result["returncode"] = -1
+        yield f"{prefix} [ERROR]: 启动进程失败: {str(e)}", OUTPUT
+        return
+
+    log(f"启动{prefix}进程 PID: {process.pid}", process_id)
+
+    queue: asyncio.Queue = asyncio.Queue(queue_size)
+    skipped_progress: Dict[bool, str] = {}
+
+    async def pump(stream: asyncio.StreamReader, is_error: bool):
+        try:
+            async for raw in read_lines(stream):
+                event = parse_event(raw)
+                if event is not None:
+                    # already throttled by the training loop, so never dropped
+                    log(raw, process_id, progress=True)
+                    await queue.put((event, EVENT))
+                    continue
+                line, is_progress = process_output_line(raw, prefix, is_error)
+                log(raw, process_id, error=is_error, progress=is_progress)
+                if not is_progress:
+                    await queue.put((line, OUTPUT))
+                elif queue.full():
+                    skipped_progress[is_error] = line
+                else:
+                    skipped_progress.pop(is_error, None)
+                    queue.put_nowait((line, PROGRESS))
+        except (OSError, ValueError) as e:
+            log(f"{prefix}读取出错: {str(e)}", process_id, error=True)
+        # end-of-stream marker; not sent when the reader is cancelled
+        await queue.put(None)
+
+    readers = [
+        asyncio.ensure_future(pump(process.stdout, False)),
+        asyncio.ensure_future(pump(process.stderr, True)),
+    ]
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    open_streams = len(readers)
+    output_count = 0
+    try:
+        while open_streams:
+            try:
+                item = await asyncio.wait_for(queue.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                log(f"{prefix}进程超时 ({timeout}秒)", process_id, error=True)
+                yield f"{prefix} [ERROR]: 进程超时 ({timeout}秒)", OUTPUT
+                break
+            if item is None:
+                open_streams -= 1
+                continue
+            output_count += 1
+            yield item
+
+        for line in skipped_progress.values():
+            yield line, PROGRESS
+
+        if output_count == 0:
+            log(f"{prefix}进程没有产生任何输出", process_id, error=True)
+            yield f"{prefix} [WARNING]: 进程没有产生任何输出", OUTPUT
+
+        if open_streams == 0:
+            try:
+                await asyncio.wait_for(process.wait(), EXIT_WAIT)
+            except asyncio.TimeoutError:
+                log(f"强制终止{prefix}进程", process_id)
+    finally:
+        # reached on normal exit, timeout, cancellation and consumer aclose()
+        if process.returncode is None:
+            log(f"终止进程 PID: {process.pid}", process_id)
+            await terminate_process(process)
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        result["returncode"] = process.returncode
+        log(f"{prefix}进程处理完成，退出码: {process.returncode}", process_id)
@@ -0,0 +1,176 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+QUEUE_SIZE = 10000
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 1.0
+
+
+class ServerLog:
+    # log() is the hot path: it builds a record and hands it to a bounded
+    # queue (dropping, never blocking, when the writer falls behind). A single
+    # writer thread owns the daily JSON-lines file and the console, and writes
+    # in batches. Progress lines are coalesced per process id: only the latest
+    # one is kept and it is written at most once per PROGRESS_INTERVAL.
+    def __init__(
+        self,
+        log_dir: str,
+        queue_size: int = QUEUE_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        batch_size: int = BATCH_SIZE,
+        progress_interval: float = PROGRESS_INTERVAL,
+        echo: bool = True,
+    ):
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.echo = echo
+        self.pid = os.getpid()
+
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.progress_lock = threading.Lock()
+        self.pending_progress: Dict[Optional[str], Dict[str, Any]] = {}
+        self.progress_written: Dict[Optional[str], float] = {}
+        self.dropped = 0
+        self.coalesced = 0
+
+        self.file = None
+        self.file_date = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="server-log", daemon=True)
+
+    def start(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.thread.start()
+        return self
+
+    def log(
+        self,
+        message: str,
+        process_id: Optional[str] = None,
+        error: bool = False,
+        progress: bool = False,
+    ):
+        record = {
+            "ts": time.time(),
+            "level": "error" if error else ("progress" if progress else "info"),
+            "pid": self.pid,
+            "process_id": process_id,
+            "msg": message,
+        }
+        if progress:
+            with self.progress_lock:
+                if process_id in self.pending_progress:
+                    self.coalesced += 1
+                self.pending_progress[process_id] = record
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5.0):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        else:
+            self._write(self._drain(final=True))
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.dropped,
+            "coalesced_progress": self.coalesced,
+        }
+
+    def _drain(self, final: bool = False) -> List[Dict[str, Any]]:
+        records = []
+        while len(records) < self.batch_size or final:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        now = time.time()
+        with self.progress_lock:
+            if len(self.progress_written) > QUEUE_SIZE:
+                self.progress_written.clear()
+            for process_id, record in list(self.pending_progress.items()):
+                last = self.progress_written.get(process_id, 0.0)
+                if final or now - last >= self.progress_interval:
+                    records.append(record)
+                    self.progress_written[process_id] = now
+                    del self.pending_progress[process_id]
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.append(
+                {
+                    "ts": now,
+                    "level": "error",
+                    "pid": self.pid,
+                    "process_id": None,
+                    "msg": f"日志队列已满，丢弃了 {dropped} 条记录",
+                }
+            )
+        return records
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                first = None
+            records = self._drain()
+            if first is not None:
+                records.insert(0, first)
+            self._write(records)
+        self._write(self._drain(final=True))
+
+    def _open(self, date: str):
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.log_dir, f"server_{date}.jsonl")
+        self.file = open(path, "a", encoding="utf-8")
+        self.file_date = date
+
+    def _write(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        records.sort(key=lambda record: record["ts"])
+        try:
+            for record in records:
+                date = time.strftime("%Y-%m-%d", time.localtime(record["ts"]))
+                if date != self.file_date:
+                    self._open(date)
+                self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if self.echo:
+                    self._echo(record)
+            self.file.flush()
+        except Exception as e:
+            print(f"[ERROR] 无法写入日志文件: {str(e)}", file=sys.stderr)
+        if self.echo:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    def _echo(self, record: Dict[str, Any]):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["ts"]))
+        prefix = f"[{timestamp}]"
+        if record["process_id"]:
+            prefix += f" [PID:{record['process_id']}]"
+        if record["level"] == "progress":
+            prefix += " [PROGRESS]"
+        stream = sys.stderr if record["level"] == "error" else sys.stdout
+        print(f"{prefix} {record['msg']}", file=stream)
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import subprocess
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from service.process_runner import (
+    EVENT,
+    OUTPUT,
+    PROGRESS,
+    QUEUE_SIZE,
+    process_output_line,
+    read_lines,
+    terminate_process,
+)
+from utils.progress import parse_event
+
+# matches worker.RESULT_PREFIX; worker.py itself is not imported, it pulls in torch
+RESULT_PREFIX = "[WORKER RESULT] "
+
+
+class ResidentWorker:
+    # One `worker.py --serve` process pinned to a GPU. Its output is read for
+    # the whole lifetime of the process: lines go to the job that is running
+    # (sink), or to the server log between jobs (model loading at startup).
+    def __init__(
+        self,
+        cmd: List[str],
+        gpu: str,
+        cwd: Optional[str] = None,
+        log: Callable[..., None] = print,
+    ):
+        self.cmd = cmd
+        self.gpu = gpu
+        self.cwd = cwd
+        self.log = log
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.reader: Optional[asyncio.Task] = None
+        self.sink: Optional[asyncio.Queue] = None
+        self.starts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def ensure_started(self):
+        if self.alive:
+            return
+        await self.stop()
+        env = os.environ.copy()
+        env["PYTHONUNBUFFERED"] = "1"
+        env["CUDA_VISIBLE_DEVICES"] = self.gpu
+        if os.name == "nt":
+            group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {"start_new_session": True}
+        self.process = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=self.cwd,
+            env=env,
+            **group,
+        )
+        self.starts += 1
+        self.log(f"启动常驻 worker (GPU {self.gpu}) PID: {self.process.pid}")
+        self.reader = asyncio.get_running_loop().create_task(self._read(self.process))
+
+    async def _read(self, process: asyncio.subprocess.Process):
+        try:
+            async for line in read_lines(process.stdout):
+                sink = self.sink
+                if sink is None:
+                    self.log(f"[worker GPU {self.gpu}] {line}")
+                elif sink.qsize() < QUEUE_SIZE or line.startswith(RESULT_PREFIX):
+                    sink.put_nowait(line)
+                elif not parse_event(line) and not process_output_line(line, "")[1]:
+                    # never drop plain output; progress redraws are dropped while the job falls behind
+                    sink.put_nowait(line)
+        except (OSError, ValueError) as e:
+            self.log(f"worker (GPU {self.gpu}) 读取出错: {str(e)}", error=True)
+        if self.sink is not None:
+            self.sink.put_nowait(None)
+
+    async def send(self, request: Dict[str, Any]):
+        self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+
+    async def stop(self):
+        if self.process is not None:
+            await terminate_process(self.process)
+        if self.reader is not None:
+            try:
+                await asyncio.wait_for(self.reader, 1.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self.reader.cancel()
+        self.process = None
+        self.reader = None
+
+
+class WorkerPool:
+    # Keeps one resident worker per GPU and hands each job to an idle one.
+    # run() has the signature of service/process_runner.run_process, so a
+    # Stage can use it as its runner; build_cmd then returns the worker
+    # request instead of a command line. A worker is killed when its job
+    # times out or is cancelled and restarted (reloading its models) for the
+    # next job.
+    def __init__(
+        self,
+        cmd: List[str],
+        gpus: List[str],
+        cwd: Optional[str] = None,
+        log: Callable[..., None] = print,
+    ):
+        self.log = log
+        self.workers = [ResidentWorker(cmd, gpu, cwd=cwd, log=log) for gpu in gpus]
+        self.idle: Optional[asyncio.Queue] = None
+
+    async def start(self):
+        # workers start loading their models right away, not with the first job
+        self.idle = asyncio.Queue()
+        for worker in self.workers:
+            try:
+                await worker.ensure_started()
+            except OSError as e:
+                # retried by the first job on this worker
+                self.log(f"启动常驻 worker (GPU {worker.gpu}) 失败: {str(e)}", error=True)
+            self.idle.put_nowait(worker)
+        return self
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers), return_exceptions=True)
+
+    def kill(self):
+        # for signal handlers, where the loop cannot await stop()
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.kill()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "gpu": worker.gpu,
+                "pid": worker.process.pid if worker.alive else None,
+                "busy": worker.sink is not None,
+                "starts": worker.starts,
+            }
+            for worker in self.workers
+        ]
+
+    async def run(
+        self,
+        request: Dict[str, Any],
+        process_id: str,
+        prefix: str,
+        timeout: float,
+        result: Dict[str, Any],
+    ) -> AsyncGenerator[Tuple[Any, str], None]:
+        # Yields the same (item, kind) tuples as run_process and stores the
+        # worker's answer in result["response"]; returncode is 0 when the
+        # worker reports success, 1 when the job failed inside the worker and
+        # the process exit code (or -1) when the worker died.
+        worker = await self.idle.get()
+        finished = False
+        try:
+            try:
+                await worker.ensure_started()
+            except OSError as e:
+                self.log(f"启动进程失败: {str(e)}", process_id, error=True)
+                result["returncode"] = -1
+                yield f"{prefix} [ERROR]: 启动进程失败: {str(e)}", OUTPUT
+                finished = True
+                return
+            worker.sink = asyncio.Queue()
+            self.log(f"{prefix}任务交给常驻 worker (GPU {worker.gpu}) PID: {worker.process.pid}", process_id)
+            await worker.send(request)
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                try:
+                    line = await asyncio.wait_for(worker.sink.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    self.log(f"{prefix}进程超时 ({timeout}秒)", process_id, error=True)
+                    result["returncode"] = -1
+                    yield f"{prefix} [ERROR]: 进程超时 ({timeout}秒)", OUTPUT
+                    break
+                if line is None:
+                    await worker.process.wait()
+                    result["returncode"] = worker.process.returncode or -1
+                    self.log(f"{prefix} worker 意外退出，退出码: {result['returncode']}", process_id, error=True)
+                    yield f"{prefix} [ERROR]: worker 意外退出，退出码: {result['returncode']}", OUTPUT
+                    finished = True
+                    break
+                if line.startswith(RESULT_PREFIX):
+                    response = json.loads(line[len(RESULT_PREFIX):])
+                    result["response"] = response
+                    result["returncode"] = 0 if response.get("ok") else 1
+                    if not response.get("ok"):
+                        self.log(f"{prefix}失败: {response.get('error')}", process_id, error=True)
+                        yield f"{prefix} [ERROR]: {response.get('error')}", OUTPUT
+                    finished = True
+                    break
+
+                event = parse_event(line)
+                if event is not None:
+                    self.log(line, process_id, progress=True)
+                    yield event, EVENT
+                    continue
+                formatted, is_progress = process_output_line(line, prefix)
+                self.log(line, process_id, progress=is_progress)
+                yield formatted, PROGRESS if is_progress else OUTPUT
+        finally:
+            worker.sink = None
+            if not finished:
+                # timed out or cancelled mid-job: the only way to stop training is to kill it
+                await worker.stop()
+            self.idle.put_nowait(worker)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules import each other from the UniHair root, as the scripts run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import torch
+
+from utils.cam_utils import look_at, look_at_batch, orbit_camera, orbit_camera_batch
+
+DEVICES = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+
+def random_orbits(rng):
+    count = int(rng.integers(1, 500))
+    elevations = rng.uniform(-89, 89, count)
+    azimuths = rng.uniform(-360, 360, count)
+    radii = rng.uniform(0.5, 5, count)
+    if rng.random() < 0.3:
+        # integer degrees hit the exact zeros / right angles
+        elevations, azimuths = np.round(elevations), np.round(azimuths)
+    target = rng.uniform(-1, 1, 3).astype(np.float32) if rng.random() < 0.5 else None
+    opengl = bool(rng.random() < 0.5)
+    return elevations, azimuths, radii, target, opengl
+
+
+def scalar_poses(elevations, azimuths, radii, target=None, opengl=True):
+    return np.stack([
+        orbit_camera(float(ver), float(hor), float(radius), target=target, opengl=opengl)
+        for ver, hor, radius in zip(elevations, azimuths, radii)
+    ], axis=0)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_orbit_camera_batch_numpy(seed):
+    elevations, azimuths, radii, target, opengl = random_orbits(np.random.default_rng(seed))
+    expected = scalar_poses(elevations, azimuths, radii, target, opengl)
+    got = orbit_camera_batch(elevations, azimuths, radii, target=target, opengl=opengl)
+    assert got.dtype == expected.dtype
+    assert np.array_equal(got, expected)
+
+
+@pytest.mark.parametrize("device", DEVICES)
+@pytest.mark.parametrize("seed", range(20))
+def test_orbit_camera_batch_torch(seed, device):
+    elevations, azimuths, radii, target, opengl = random_orbits(np.random.default_rng(seed))
+    expected = scalar_poses(elevations, azimuths, radii, target, opengl)
+    got = orbit_camera_batch(
+        torch.from_numpy(elevations).to(device),
+        torch.from_numpy(azimuths).to(device),
+        torch.from_numpy(radii).to(device),
+        target=None if target is None else torch.from_numpy(target).to(device),
+        opengl=opengl,
+    )
+    assert got.device.type == device
+    got = got.cpu().numpy()
+    assert got.dtype == expected.dtype
+    if device == "cpu":
+        assert np.array_equal(got, expected)
+    else:
+        np.testing.assert_allclose(got, expected, rtol=0, atol=1e-6)
+
+
+def test_look_at_batch():
+    rng = np.random.default_rng(0)
+    campos = rng.uniform(-3, 3, (64, 3)).astype(np.float32)
+    target = np.zeros([3], dtype=np.float32)
+    for opengl in (True, False):
+        expected = np.stack([look_at(pos, target, opengl) for pos in campos])
+        assert np.array_equal(look_at_batch(campos, target, opengl), expected)
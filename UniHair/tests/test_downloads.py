@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import os
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("httpx")
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from service.downloads import (
+    CompressedCache,
+    RangeNotSatisfiable,
+    file_response,
+    make_etag,
+    parse_range,
+)
+
+ETAG = make_etag("0" * 64)
+
+
+@pytest.fixture
+def payload(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    path = tmp_path / "model.ply"
+    path.write_bytes(data)
+    return str(path), data
+
+
+@pytest.fixture
+def client(payload):
+    path, _ = payload
+
+    async def download(request: Request):
+        return file_response(path, request.method, request.headers, {"ETag": ETAG})
+
+    app = Starlette(routes=[Route("/f", download, methods=["GET", "HEAD"])])
+    return TestClient(app)
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=90-500", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=100-", 100)
+
+
+def test_full_get(client, payload):
+    _, data = payload
+    response = client.get("/f")
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    assert int(response.headers["content-length"]) == len(data)
+    assert response.content == data
+
+
+def test_ranged_get(client, payload):
+    _, data = payload
+    start, end = 1024 * 1024 - 5, 2 * 1024 * 1024 + 5
+    response = client.get("/f", headers={"Range": f"bytes={start}-{end}"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(data)}"
+    assert int(response.headers["content-length"]) == end - start + 1
+    assert response.content == data[start:end + 1]
+
+    response = client.get("/f", headers={"Range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.content == data[-100:]
+
+
+def test_unsatisfiable_range(client, payload):
+    _, data = payload
+    response = client.get("/f", headers={"Range": f"bytes={len(data)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(data)}"
+
+
+def test_if_range(client, payload):
+    _, data = payload
+    response = client.get("/f", headers={"Range": "bytes=10-19", "If-Range": ETAG})
+    assert response.status_code == 206
+    assert response.content == data[10:20]
+
+    response = client.get("/f", headers={"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == data
+
+
+def test_head(client, payload):
+    _, data = payload
+    response = client.head("/f", headers={"Range": "bytes=0-99"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "100"
+    assert response.content == b""
+
+
+def test_compressed_cache(tmp_path, payload):
+    path, data = payload
+    cache = CompressedCache(str(tmp_path / "cache"), quota_bytes=1)
+    first = asyncio.run(cache.get(path, "a" * 64, "gzip"))
+    assert gzip.decompress(open(first, "rb").read()) == data
+    # over quota: the older representation goes, the one just served stays
+    second = asyncio.run(cache.get(path, "b" * 64, "gzip"))
+    assert os.path.isfile(second)
+    assert not os.path.exists(first)
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import stat
+import time
+
+from service.jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobScheduler, JobStore, Stage
+from service.process_runner import run_process
+from utils.progress import EVENT_MARKER
+
+# Stand-ins for run_hairalign.sh / run_unihair.sh. They log start/end
+# timestamps to $STUB_TRACE so the concurrency limit can be checked, emit a
+# progress event and a few lines, and fail for uploads named fail.png.
+HAIRALIGN_STUB = """#!/bin/bash
+echo "start hairalign $1 $(date +%s.%N)" >> "$STUB_TRACE"
+echo "aligning $1"
+sleep 0.2
+echo "end hairalign $1 $(date +%s.%N)" >> "$STUB_TRACE"
+"""
+UNIHAIR_STUB = """#!/bin/bash
+echo "start unihair $1 $(date +%s.%N)" >> "$STUB_TRACE"
+echo '""" + EVENT_MARKER + """{"type": "progress", "stage": "coarse", "step": 1, "total": 2}'
+sleep 0.2
+case "$1" in *fail.png) echo "boom" >&2; echo "end unihair $1 $(date +%s.%N)" >> "$STUB_TRACE"; exit 3;; esac
+echo "done $1"
+echo "end unihair $1 $(date +%s.%N)" >> "$STUB_TRACE"
+"""
+
+
+def write_script(path, text):
+    path.write_text(text)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def make_stages(tmp_path, concurrency=1):
+    hairalign = write_script(tmp_path / "run_hairalign.sh", HAIRALIGN_STUB)
+    unihair = write_script(tmp_path / "run_unihair.sh", UNIHAIR_STUB)
+    return [
+        Stage("HairAlign", lambda job: ["bash", hairalign, job["upload_path"]], timeout=30, concurrency=concurrency),
+        Stage("UniHair", lambda job: ["bash", unihair, job["upload_path"]], timeout=30, concurrency=concurrency),
+    ]
+
+
+async def wait_done(store, job_ids, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [store.get_job(job_id) for job_id in job_ids]
+        if all(job["state"] in (SUCCEEDED, FAILED, CANCELLED) for job in jobs):
+            return jobs
+        await asyncio.sleep(0.05)
+    raise AssertionError("jobs did not finish")
+
+
+def read_trace(path):
+    spans = {}
+    for line in open(path):
+        edge, stage, upload, ts = line.split()
+        spans.setdefault((stage, upload), {})[edge] = float(ts)
+    return spans
+
+
+def test_job_lifecycle(tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_TRACE", str(tmp_path / "trace"))
+    store = JobStore(str(tmp_path / "jobs.db"), flush_interval=0.05).start()
+
+    async def main():
+        scheduler = JobScheduler(store, make_stages(tmp_path), run_process, workers=2).start()
+        ok = scheduler.submit("ok.png", "ok.png", "ok")
+        bad = scheduler.submit("fail.png", "fail.png", "fail")
+        assert store.get_job(ok)["state"] == QUEUED
+        states = set()
+        deadline = time.monotonic() + 30
+        while store.get_job(ok)["state"] not in (SUCCEEDED, FAILED) and time.monotonic() < deadline:
+            states.add(store.get_job(ok)["state"])
+            await asyncio.sleep(0.02)
+        jobs = await wait_done(store, [ok, bad])
+        await scheduler.stop()
+        return states, jobs
+
+    states, (ok_job, bad_job) = asyncio.run(main())
+    assert RUNNING in states
+    assert ok_job["state"] == SUCCEEDED
+    assert [stage["state"] for stage in ok_job["stages"]] == [SUCCEEDED, SUCCEEDED]
+    assert bad_job["state"] == FAILED
+    assert bad_job["error"] == "UniHair exited with code 3"
+    assert [stage["returncode"] for stage in bad_job["stages"]] == [0, 3]
+
+    lines = [line for _, line in store.read_logs(ok_job["id"])]
+    assert "UniHair [OUT]: done ok.png" in lines
+    assert lines[-1] == "[JOB] succeeded"
+    events = [row[1] for row in store.read_events(ok_job["id"])]
+    assert any('"type": "progress"' in data for data in events)
+    store.close()
+
+    # everything written through the writer thread is on disk after close
+    reopened = JobStore(str(tmp_path / "jobs.db"))
+    assert [line for _, line in reopened.read_logs(ok_job["id"])] == lines
+    reopened.close()
+
+
+def test_stage_concurrency_limit(tmp_path, monkeypatch):
+    trace = tmp_path / "trace"
+    monkeypatch.setenv("STUB_TRACE", str(trace))
+    store = JobStore(str(tmp_path / "jobs.db"), flush_interval=0.05).start()
+
+    async def main():
+        scheduler = JobScheduler(store, make_stages(tmp_path, concurrency=1), run_process, workers=3).start()
+        job_ids = [scheduler.submit(f"{i}.png", f"{i}.png", str(i)) for i in range(3)]
+        jobs = await wait_done(store, job_ids)
+        await scheduler.stop()
+        return jobs
+
+    jobs = asyncio.run(main())
+    store.close()
+    assert all(job["state"] == SUCCEEDED for job in jobs)
+    spans = read_trace(trace)
+    for stage in ("hairalign", "unihair"):
+        intervals = sorted((span["start"], span["end"]) for (name, _), span in spans.items() if name == stage)
+        assert len(intervals) == 3
+        # one at a time per stage
+        for (_, end), (start, _) in zip(intervals, intervals[1:]):
+            assert start >= end
+    # but the stages themselves overlap across jobs, so the workers run in parallel
+    hairalign = sorted((s["start"], s["end"]) for (n, _), s in spans.items() if n == "hairalign")
+    unihair = sorted((s["start"], s["end"]) for (n, _), s in spans.items() if n == "unihair")
+    assert any(u[0] < h[1] and h[0] < u[1] for u in unihair for h in hairalign)
+
+
+def test_recover(tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_TRACE", str(tmp_path / "trace"))
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path)
+    interrupted = store.create_job("a.png", "a.png", "a", ["HairAlign", "UniHair"])
+    store.update_job(interrupted, state=RUNNING, started_at=time.time())
+    store.update_stage(interrupted, "HairAlign", state=RUNNING)
+    waiting = store.create_job("b.png", "b.png", "b", ["HairAlign", "UniHair"])
+    store.close()
+
+    store = JobStore(path, flush_interval=0.05).start()
+
+    async def main():
+        scheduler = JobScheduler(store, make_stages(tmp_path), run_process).start()
+        jobs = await wait_done(store, [interrupted, waiting])
+        await scheduler.stop()
+        return jobs
+
+    interrupted_job, waiting_job = asyncio.run(main())
+    store.close()
+    assert interrupted_job["state"] == FAILED
+    assert interrupted_job["stages"][0]["state"] == FAILED
+    assert waiting_job["state"] == SUCCEEDED
+
+
+def test_log_retention(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), retention=60)
+    old = store.create_job("a.png", "a.png", "a", ["HairAlign"])
+    recent = store.create_job("b.png", "b.png", "b", ["HairAlign"])
+    for job_id in (old, recent):
+        store.append_log(job_id, "line")
+        store.append_event(job_id, {"type": "state", "state": SUCCEEDED})
+    now = time.time()
+    store.update_job(old, state=SUCCEEDED, finished_at=now - 120)
+    store.update_job(recent, state=SUCCEEDED, finished_at=now - 10)
+    store.flush()
+    assert store.prune(now) == 1
+    assert store.read_logs(old) == [] and store.read_events(old) == []
+    assert len(store.read_logs(recent)) == 1
+    store.close()
+
+
+def test_coalesced_progress_events(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), progress_interval=3600)
+    job_id = store.create_job("a.png", "a.png", "a", ["UniHair"])
+    store.append_event(job_id, {"type": "stage_start"})
+    for step in range(100):
+        assert store.append_event(job_id, {"type": "progress", "step": step}, coalesce=True) is None
+    store.flush()
+    # the first progress event after a quiet interval is stored, later ones wait
+    assert [json.loads(data)["type"] for _, data in store.read_events(job_id)] == ["stage_start", "progress"]
+    for step in range(100, 200):
+        store.append_event(job_id, {"type": "progress", "step": step}, coalesce=True)
+    store.flush()
+    assert len(store.read_events(job_id)) == 2
+    # a regular event releases the held one first, keeping the arrival order
+    store.append_event(job_id, {"type": "stage_end"})
+    events = [json.loads(data) for _, data in store.read_events(job_id)]
+    assert [event["type"] for event in events] == ["stage_start", "progress", "progress", "stage_end"]
+    assert events[1]["step"] == 99 and events[2]["step"] == 199
+    assert store.coalesced == 198
+    store.close()
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import sys
+import time
+
+from service.jobs import FAILED, SUCCEEDED, JobScheduler, JobStore, Stage
+from service.process_runner import EVENT, OUTPUT, run_process
+from service.worker_pool import RESULT_PREFIX, WorkerPool
+from utils.progress import EVENT_MARKER
+
+# Stand-in for `worker.py --serve`: one JSON request per stdin line, some
+# output and a progress event, then the result line carrying its own pid.
+# save_path picks the outcome: "error" fails the job, "crash" kills the
+# process and "hang" never answers.
+WORKER_STUB = """
+import json, os, sys, time
+print("loading models", flush=True)
+for line in sys.stdin:
+    request = json.loads(line)
+    name = request["save_path"]
+    print("training " + name, flush=True)
+    print(%r + json.dumps({"type": "progress", "stage": "coarse", "step": 1, "total": 2}), flush=True)
+    if name == "crash":
+        os._exit(7)
+    if name == "hang":
+        time.sleep(60)
+    if name == "error":
+        response = {"ok": False, "error": "ValueError: bad input"}
+    else:
+        response = {"ok": True, "save_path": name, "pid": os.getpid()}
+    print(%r + json.dumps(response), flush=True)
+""" % (EVENT_MARKER, RESULT_PREFIX)
+
+
+def make_pool(tmp_path, gpus=("0",), log=None):
+    stub = tmp_path / "worker_stub.py"
+    stub.write_text(WORKER_STUB)
+    return WorkerPool([sys.executable, str(stub)], list(gpus), log=log or (lambda *args, **kwargs: None))
+
+
+async def run_job(pool, name, timeout=10.0):
+    result = {}
+    items = [item async for item in pool.run({"save_path": name}, name, "UniHair", timeout, result)]
+    return result, items
+
+
+def test_jobs_reuse_resident_worker(tmp_path):
+    logged = []
+
+    async def main():
+        pool = await make_pool(tmp_path, log=lambda message, *args, **kwargs: logged.append(message)).start()
+        try:
+            deadline = time.monotonic() + 10
+            while not any("loading models" in line for line in logged) and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            first, items = await run_job(pool, "a")
+            second, _ = await run_job(pool, "b")
+            return first, second, items, pool.workers[0].starts
+        finally:
+            await pool.stop()
+
+    first, second, items, starts = asyncio.run(main())
+    assert first["returncode"] == 0 and second["returncode"] == 0
+    assert first["response"]["pid"] == second["response"]["pid"]
+    assert starts == 1
+    assert ("UniHair [OUT]: training a", OUTPUT) in items
+    assert any(kind == EVENT and item["type"] == "progress" for item, kind in items)
+    # output between jobs goes to the server log, not to the next job
+    assert any("loading models" in line for line in logged)
+    assert not any("loading models" in str(item) for item, _ in items)
+
+
+def test_worker_error_and_crash(tmp_path):
+    async def main():
+        pool = await make_pool(tmp_path).start()
+        try:
+            error, _ = await run_job(pool, "error")
+            crash, _ = await run_job(pool, "crash")
+            after, _ = await run_job(pool, "after")
+            return error, crash, after, pool.workers[0].starts
+        finally:
+            await pool.stop()
+
+    error, crash, after, starts = asyncio.run(main())
+    assert error["returncode"] == 1 and error["response"]["error"] == "ValueError: bad input"
+    assert crash["returncode"] == 7
+    assert after["returncode"] == 0
+    assert starts == 2
+
+
+def test_worker_timeout_kills_worker(tmp_path):
+    async def main():
+        pool = await make_pool(tmp_path).start()
+        try:
+            pid = pool.workers[0].process.pid
+            started = time.monotonic()
+            hung, items = await run_job(pool, "hang", timeout=0.5)
+            elapsed = time.monotonic() - started
+            after, _ = await run_job(pool, "after")
+            return pid, hung, items, elapsed, after
+        finally:
+            await pool.stop()
+
+    pid, hung, items, elapsed, after = asyncio.run(main())
+    assert hung["returncode"] == -1
+    assert any("超时" in str(item) for item, _ in items)
+    assert elapsed < 5
+    assert after["returncode"] == 0 and after["response"]["pid"] != pid
+
+
+def test_scheduler_worker_stage(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), flush_interval=0.05).start()
+
+    async def main():
+        pool = await make_pool(tmp_path, gpus=("0", "1")).start()
+        stages = [
+            Stage("UniHair", lambda job: {"save_path": job["stem"]}, timeout=10, concurrency=2, runner=pool.run),
+        ]
+        scheduler = JobScheduler(store, stages, run_process, workers=2).start()
+        job_ids = [scheduler.submit(f"{name}.png", f"{name}.png", name) for name in ("a", "b", "error")]
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            jobs = [store.get_job(job_id) for job_id in job_ids]
+            if all(job["state"] in (SUCCEEDED, FAILED) for job in jobs):
+                break
+            await asyncio.sleep(0.05)
+        await scheduler.stop()
+        await pool.stop()
+        return jobs, [[line for _, line in store.read_logs(job_id)] for job_id in job_ids], pool.workers
+
+    jobs, logs, workers = asyncio.run(main())
+    store.close()
+    assert [job["state"] for job in jobs] == [SUCCEEDED, SUCCEEDED, FAILED]
+    assert any("training a" in line for line in logs[0])
+    assert any("bad input" in line for line in logs[2])
+    assert all(worker.starts == 1 for worker in workers)
+
+
+def test_worker_spawn_failure(tmp_path):
+    async def main():
+        pool = await WorkerPool([str(tmp_path / "missing")], ["0"], log=lambda *args, **kwargs: None).start()
+        failed = await run_job(pool, "a")
+        await pool.stop()
+        return failed
+
+    result, items = asyncio.run(main())
+    assert result["returncode"] == -1
+    assert any("启动进程失败" in str(item) for item, _ in items)
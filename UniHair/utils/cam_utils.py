@@ -62,6 +62,71 @@ def orbit_camera(elevation, azimuth, radius=1, is_degree=True, target=None, open
     return T
 
 
+def look_at_batch(campos, target, opengl=True):
+    # campos: [N, 3], camera/eye positions, numpy array or torch tensor
+    # target: [N, 3] or [3], objects to look at
+    # return: [N, 3, 3], rotation matrices, row n equals look_at(campos[n], target)
+    if isinstance(campos, np.ndarray):
+        up_vector = np.broadcast_to(np.array([0, 1, 0], dtype=np.float32), campos.shape)
+        cross = np.cross
+    else:
+        up_vector = torch.tensor([0, 1, 0], dtype=campos.dtype, device=campos.device).expand(campos.shape)
+        cross = lambda x, y: torch.cross(x, y, dim=-1)
+    if not opengl:
+        # camera forward aligns with -z
+        forward_vector = safe_normalize(target - campos)
+        right_vector = safe_normalize(cross(forward_vector, up_vector))
+        up_vector = safe_normalize(cross(right_vector, forward_vector))
+    else:
+        # camera forward aligns with +z
+        forward_vector = safe_normalize(campos - target)
+        right_vector = safe_normalize(cross(up_vector, forward_vector))
+        up_vector = safe_normalize(cross(forward_vector, right_vector))
+    # the vectors are the columns, as in look_at
+    if isinstance(campos, np.ndarray):
+        return np.stack([right_vector, up_vector, forward_vector], axis=-1)
+    return torch.stack([right_vector, up_vector, forward_vector], dim=-1)
+
+
+def orbit_camera_batch(elevation, azimuth, radius=1, is_degree=True, target=None, opengl=True):
+    # elevation, azimuth: [N] numpy arrays or torch tensors (on any device)
+    # radius: scalar or [N]
+    # return: [N, 4, 4] float32 poses, row n equals orbit_camera(elevation[n], azimuth[n], radius[n]);
+    # bit for bit on numpy and CPU tensors when the inputs have the dtype of the scalars passed to
+    # orbit_camera (float64 for python floats), within 1e-6 on CUDA, whose sin/cos may differ in
+    # the last ulp. Tensors are returned on the device of elevation
+    if isinstance(elevation, torch.Tensor):
+        if not elevation.is_floating_point():
+            elevation = elevation.double()
+        azimuth = torch.as_tensor(azimuth, dtype=elevation.dtype, device=elevation.device)
+        if is_degree:
+            elevation = torch.deg2rad(elevation)
+            azimuth = torch.deg2rad(azimuth)
+        x = radius * torch.cos(elevation) * torch.sin(azimuth)
+        y = - radius * torch.sin(elevation)
+        z = radius * torch.cos(elevation) * torch.cos(azimuth)
+        if target is None:
+            target = torch.zeros([3], dtype=torch.float32, device=elevation.device)
+        campos = torch.stack([x, y, z], dim=-1) + target  # [N, 3]
+        T = torch.eye(4, dtype=torch.float32, device=elevation.device).repeat(campos.shape[0], 1, 1)
+    else:
+        elevation = np.asarray(elevation)
+        azimuth = np.asarray(azimuth)
+        if is_degree:
+            elevation = np.deg2rad(elevation)
+            azimuth = np.deg2rad(azimuth)
+        x = radius * np.cos(elevation) * np.sin(azimuth)
+        y = - radius * np.sin(elevation)
+        z = radius * np.cos(elevation) * np.cos(azimuth)
+        if target is None:
+            target = np.zeros([3], dtype=np.float32)
+        campos = np.stack([x, y, z], axis=-1) + target  # [N, 3]
+        T = np.tile(np.eye(4, dtype=np.float32), (campos.shape[0], 1, 1))
+    T[:, :3, :3] = look_at_batch(campos, target, opengl)
+    T[:, :3, 3] = campos
+    return T
+
+
 class OrbitCamera:
     def __init__(self, W, H, r=2, fovy=60, near=0.01, far=100):
         self.W = W
@@ -0,0 +1,41 @@
+import os
+import random
+
+import numpy as np
+import torch
+
+
+def save_training_state(path, gaussians, step, extra=None):
+    # GaussianModel.capture() (parameters, densification stats and optimizer
+    # state) plus the step and rng states, written atomically.
+    state = {
+        "gaussians": gaussians.capture(),
+        "step": step,
+        "extra": extra or {},
+        "rng": {
+            "python": random.getstate(),
+            "numpy": np.random.get_state(),
+            "torch": torch.get_rng_state(),
+            "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        },
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+    print(f"[INFO] saved checkpoint at step {step} to {path}")
+
+
+def load_training_state(path, gaussians, opt):
+    state = torch.load(path, map_location=gaussians.device)
+    gaussians.restore(state["gaussians"], opt)
+
+    rng = state["rng"]
+    random.setstate(rng["python"])
+    np.random.set_state(rng["numpy"])
+    torch.set_rng_state(rng["torch"].cpu())
+    if rng["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([s.cpu() for s in rng["cuda"]])
+
+    print(f"[INFO] resumed from checkpoint {path} at step {state['step']}")
+    return state["step"], state["extra"]
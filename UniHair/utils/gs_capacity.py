@@ -0,0 +1,81 @@
+import os
+import math
+import torch
+
+# Row storage behind the gaussian parameters, their Adam moments and the
+# densification stats. Every tensor the model and the optimizer see is the
+# first n rows of an over-allocated buffer: densification writes the new rows
+# into the spare capacity and pruning compacts the kept rows to the front of
+# the same buffer, so neither reallocates the model. A buffer is replaced
+# only when it runs out of rows (it then grows to CAPACITY_GROWTH times what
+# is needed, which amortizes the copies) or when less than CAPACITY_SHRINK
+# of it is in use. Tensors that are not backed by a buffer yet (fresh
+# parameters, reset_opacity, loaded Adam moments) are adopted on their first
+# resize.
+
+CAPACITY_GROWTH = float(os.environ.get("GS_CAPACITY_GROWTH", 1.5))
+CAPACITY_SHRINK = float(os.environ.get("GS_CAPACITY_SHRINK", 0.25))
+MIN_CAPACITY = 4096
+
+
+def backed_by(buffer, tensor):
+    return (
+        buffer is not None
+        and tensor.data_ptr() == buffer.data_ptr()
+        and tensor.dtype == buffer.dtype
+        and tensor.device == buffer.device
+        and tensor.shape[1:] == buffer.shape[1:]
+        and tensor.shape[0] <= buffer.shape[0]
+        and tensor.is_contiguous()
+    )
+
+
+def allocate(rows, shape, dtype, device, limit=None):
+    # limit: the most rows the buffer will need (a gaussian budget), caps the headroom
+    capacity = max(MIN_CAPACITY, math.ceil(rows * CAPACITY_GROWTH))
+    if limit is not None:
+        capacity = max(rows, min(capacity, limit))
+    return torch.empty((capacity,) + tuple(shape), dtype=dtype, device=device)
+
+
+def oversized(buffer, rows):
+    return buffer.shape[0] > MIN_CAPACITY and rows < CAPACITY_SHRINK * buffer.shape[0]
+
+
+@torch.no_grad()
+def append_rows(buffer, tensor, extension, limit=None):
+    # (buffer, rows) where rows = cat(tensor, extension) is the front of buffer
+    n = tensor.shape[0]
+    rows = n + extension.shape[0]
+    if not backed_by(buffer, tensor) or rows > buffer.shape[0]:
+        grown = allocate(rows, tensor.shape[1:], tensor.dtype, tensor.device, limit)
+        grown[:n] = tensor
+        buffer = grown
+    buffer[n:rows] = extension
+    return buffer, buffer[:rows]
+
+
+@torch.no_grad()
+def keep_rows(buffer, tensor, keep):
+    # (buffer, rows) where rows = tensor[keep] is the front of buffer
+    kept = tensor[keep]
+    rows = kept.shape[0]
+    if not backed_by(buffer, tensor) or oversized(buffer, rows):
+        buffer = allocate(rows, tensor.shape[1:], tensor.dtype, tensor.device)
+    buffer[:rows] = kept
+    return buffer, buffer[:rows]
+
+
+@torch.no_grad()
+def zero_rows(buffer, rows, shape, device, dtype=torch.float32, limit=None):
+    # (buffer, zeros) with zeros the first rows of buffer
+    shape = tuple(shape)
+    if (buffer is None or rows > buffer.shape[0] or tuple(buffer.shape[1:]) != shape
+            or buffer.dtype != dtype or oversized(buffer, rows)):
+        buffer = allocate(rows, shape, dtype, device, limit)
+    buffer[:rows].zero_()
+    return buffer, buffer[:rows]
+
+
+def capacity_bytes(buffers):
+    return sum(buffer.numel() * buffer.element_size() for buffer in buffers.values())
@@ -0,0 +1,168 @@
+import os
+import json
+import struct
+import numpy as np
+import torch
+
+# Gaussian parameters and Adam moments in the safetensors layout: an 8 byte
+# little-endian header length, a JSON header mapping each tensor name to
+# dtype/shape/byte range, then the raw tensor bytes. Files open with the
+# safetensors package too, but reading needs nothing beyond numpy: the data is
+# memory-mapped and uploaded to the device one tensor at a time.
+
+CHECKPOINT_SUFFIX = ".safetensors"
+FORMAT = "unihair-gaussians"
+VERSION = "1"
+PARAM_NAMES = ("xyz", "f_dc", "f_rest", "opacity", "scaling", "rotation")
+STAGING_BYTES = 64 * 1024 * 1024
+
+DTYPES = {
+    torch.float32: ("F32", np.float32),
+    torch.float16: ("F16", np.float16),
+    torch.float64: ("F64", np.float64),
+    torch.int64: ("I64", np.int64),
+    torch.int32: ("I32", np.int32),
+    torch.uint8: ("U8", np.uint8),
+    torch.bool: ("BOOL", np.bool_),
+}
+NUMPY_DTYPES = {code: np_dtype for code, np_dtype in DTYPES.values()}
+TORCH_DTYPES = {code: torch_dtype for torch_dtype, (code, _) in DTYPES.items()}
+DTYPES_BY_NUMPY = {np.dtype(np_dtype): code for code, np_dtype in NUMPY_DTYPES.items()}
+
+
+def write_tensors(path, tensors, metadata=None):
+    header = {}
+    offset = 0
+    arrays = []
+    for name, tensor in tensors.items():
+        array = tensor.detach().contiguous().cpu().numpy()
+        header[name] = {
+            "dtype": DTYPES[tensor.dtype][0],
+            "shape": list(array.shape),
+            "data_offsets": [offset, offset + array.nbytes],
+        }
+        offset += array.nbytes
+        arrays.append(array)
+    if metadata:
+        header["__metadata__"] = {key: str(value) for key, value in metadata.items()}
+
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # the data section starts 8-byte aligned, as safetensors writes it
+    encoded += b" " * (-len(encoded) % 8)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for array in arrays:
+            f.write(memoryview(array.reshape(-1)).cast("B"))
+    os.replace(tmp, path)
+
+
+def read_tensors(path):
+    # returns ({name: numpy view into the mapped file}, metadata); nothing is
+    # read from disk until a view is touched
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    metadata = header.pop("__metadata__", {})
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + length)
+
+    arrays = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        arrays[name] = data[begin:end].view(NUMPY_DTYPES[info["dtype"]]).reshape(info["shape"])
+    return arrays, metadata
+
+
+class PinnedUploader:
+    # copies host arrays to the device through two pinned staging buffers, so
+    # the page-in/memcpy of one chunk overlaps the DMA of the previous one
+    def __init__(self, device, nbytes=STAGING_BYTES):
+        self.device = device
+        self.buffers = [torch.empty(nbytes, dtype=torch.uint8, pin_memory=True) for _ in range(2)]
+        self.events = [None, None]
+        self.index = 0
+
+    def __call__(self, array):
+        out = torch.empty(array.shape, dtype=TORCH_DTYPES[DTYPES_BY_NUMPY[array.dtype]], device=self.device)
+        src = array.reshape(-1).view(np.uint8)
+        dst = out.view(-1).view(torch.uint8)
+        size = self.buffers[0].numel()
+        for start in range(0, src.size, size):
+            chunk = src[start:start + size]
+            buffer = self.buffers[self.index]
+            if self.events[self.index] is not None:
+                self.events[self.index].synchronize()
+            buffer[:chunk.size].copy_(torch.from_numpy(chunk))
+            dst[start:start + chunk.size].copy_(buffer[:chunk.size], non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+            self.events[self.index] = event
+            self.index ^= 1
+        return out
+
+    def finish(self):
+        for event in self.events:
+            if event is not None:
+                event.synchronize()
+
+
+def upload(arrays, names, device="cuda", pinned=True):
+    if pinned and torch.cuda.is_available() and str(device).startswith("cuda"):
+        uploader = PinnedUploader(device)
+        tensors = {name: uploader(arrays[name]) for name in names}
+        uploader.finish()
+        return tensors
+    return {name: torch.from_numpy(np.ascontiguousarray(arrays[name])).to(device) for name in names}
+
+
+def save_gaussians(gaussians, path):
+    tensors = {
+        "xyz": gaussians._xyz,
+        "f_dc": gaussians._features_dc,
+        "f_rest": gaussians._features_rest,
+        "opacity": gaussians._opacity,
+        "scaling": gaussians._scaling,
+        "rotation": gaussians._rotation,
+    }
+    metadata = {
+        "format": FORMAT,
+        "version": VERSION,
+        "active_sh_degree": gaussians.active_sh_degree,
+        "max_sh_degree": gaussians.max_sh_degree,
+    }
+    if gaussians.optimizer is not None:
+        for group in gaussians.optimizer.param_groups:
+            state = gaussians.optimizer.state.get(group["params"][0])
+            if not state:
+                continue
+            tensors[f"adam.{group['name']}.exp_avg"] = state["exp_avg"]
+            tensors[f"adam.{group['name']}.exp_avg_sq"] = state["exp_avg_sq"]
+            metadata[f"adam.{group['name']}.step"] = int(state["step"])
+    write_tensors(path, tensors, metadata)
+
+
+def load_gaussians(path, device="cuda", pinned=True):
+    # returns (params, optimizer state by group name, metadata, host xyz)
+    arrays, metadata = read_tensors(path)
+    if metadata.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a gaussian checkpoint")
+
+    groups = sorted({name.split(".")[1] for name in arrays if name.startswith("adam.")})
+    names = list(PARAM_NAMES)
+    for group in groups:
+        names += [f"adam.{group}.exp_avg", f"adam.{group}.exp_avg_sq"]
+    tensors = upload(arrays, names, device, pinned)
+
+    params = {name: tensors[name] for name in PARAM_NAMES}
+    optimizer_state = {
+        group: {
+            "step": int(metadata[f"adam.{group}.step"]),
+            "exp_avg": tensors[f"adam.{group}.exp_avg"],
+            "exp_avg_sq": tensors[f"adam.{group}.exp_avg_sq"],
+        }
+        for group in groups
+    }
+    return params, optimizer_state, metadata, np.array(arrays["xyz"])
@@ -1,23 +1,46 @@
 import os
+import json
 import math
 import numpy as np
 from typing import NamedTuple
-from plyfile import PlyData, PlyElement
 
 import torch
 from torch import nn
 
-from diff_gaussian_rasterization import (
-    GaussianRasterizationSettings,
-    GaussianRasterizer,
-)
-from simple_knn._C import distCUDA2
+# the CUDA extensions are optional; without them everything runs on the
+# pure-PyTorch rasterizer and KNN in utils/torch_rasterizer.py
+try:
+    from diff_gaussian_rasterization import (
+        GaussianRasterizationSettings,
+        GaussianRasterizer,
+    )
+except ImportError:
+    GaussianRasterizationSettings = GaussianRasterizer = None
+try:
+    from simple_knn._C import distCUDA2
+except ImportError:
+    distCUDA2 = None
 
 from utils.sh_utils import eval_sh, SH2RGB, RGB2SH
+from utils.cam_utils import orbit_camera_batch
+from utils.splat_export import export_splat, gaussians_to_numpy
+from utils.ply_io import write_ply, read_ply, columns
+from utils.gs_checkpoint import CHECKPOINT_SUFFIX, save_gaussians, load_gaussians
+from utils.gs_capacity import append_rows, keep_rows, zero_rows, capacity_bytes
+from utils.torch_rasterizer import (
+    RasterSettings, TorchGaussianRasterizer, knn_dist2,
+    quaternion_to_matrix, packed_covariance, UPPER_ROWS, UPPER_COLS,
+)
 
 def inverse_sigmoid(x):
     return torch.log(x/(1-x))
 
+def mean_knn_dist2(points):
+    # simple_knn on CUDA tensors when it is built, the torch version otherwise
+    if points.is_cuda and distCUDA2 is not None:
+        return distCUDA2(points)
+    return knn_dist2(points)
+
 def save_obj(mesh_path, verts):
     file = open(mesh_path, 'w')
 
@@ -52,15 +75,7 @@ def get_expon_lr_func(
 
 
 def strip_lowerdiag(L):
-    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
-
-    uncertainty[:, 0] = L[:, 0, 0]
-    uncertainty[:, 1] = L[:, 0, 1]
-    uncertainty[:, 2] = L[:, 0, 2]
-    uncertainty[:, 3] = L[:, 1, 1]
-    uncertainty[:, 4] = L[:, 1, 2]
-    uncertainty[:, 5] = L[:, 2, 2]
-    return uncertainty
+    return L[:, UPPER_ROWS, UPPER_COLS]
 
 def strip_symmetric(sym):
     return strip_lowerdiag(sym)
@@ -87,38 +102,11 @@ def gaussian_3d_coeff(xyzs, covs):
     return torch.exp(power)
 
 def build_rotation(r):
-    norm = torch.sqrt(r[:,0]*r[:,0] + r[:,1]*r[:,1] + r[:,2]*r[:,2] + r[:,3]*r[:,3])
-
-    q = r / norm[:, None]
-
-    R = torch.zeros((q.size(0), 3, 3), device='cuda')
-
-    r = q[:, 0]
-    x = q[:, 1]
-    y = q[:, 2]
-    z = q[:, 3]
-
-    R[:, 0, 0] = 1 - 2 * (y*y + z*z)
-    R[:, 0, 1] = 2 * (x*y - r*z)
-    R[:, 0, 2] = 2 * (x*z + r*y)
-    R[:, 1, 0] = 2 * (x*y + r*z)
-    R[:, 1, 1] = 1 - 2 * (x*x + z*z)
-    R[:, 1, 2] = 2 * (y*z - r*x)
-    R[:, 2, 0] = 2 * (x*z - r*y)
-    R[:, 2, 1] = 2 * (y*z + r*x)
-    R[:, 2, 2] = 1 - 2 * (x*x + y*y)
-    return R
+    return quaternion_to_matrix(r)
 
 def build_scaling_rotation(s, r):
-    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device="cuda")
-    R = build_rotation(r)
-
-    L[:,0,0] = s[:,0]
-    L[:,1,1] = s[:,1]
-    L[:,2,2] = s[:,2]
-
-    L = R @ L
-    return L
+    # R @ diag(s)
+    return build_rotation(r) * s[:, None, :]
 
 class BasicPointCloud(NamedTuple):
     points: np.array
@@ -130,10 +118,7 @@ class GaussianModel:
 
     def setup_functions(self):
         def build_covariance_from_scaling_rotation(scaling, scaling_modifier, rotation):
-            L = build_scaling_rotation(scaling_modifier * scaling, rotation)
-            actual_covariance = L @ L.transpose(1, 2)
-            symm = strip_symmetric(actual_covariance)
-            return symm
+            return packed_covariance(scaling, rotation, scaling_modifier)
         
         self.scaling_activation = torch.exp
         self.scaling_inverse_activation = torch.log
@@ -146,7 +131,8 @@ class GaussianModel:
         self.rotation_activation = torch.nn.functional.normalize
 
 
-    def __init__(self, sh_degree : int):
+    def __init__(self, sh_degree : int, device="cuda"):
+        self.device = torch.device(device)
         self.active_sh_degree = 0
         self.max_sh_degree = sh_degree  
         self._xyz = torch.empty(0)
@@ -159,24 +145,41 @@ class GaussianModel:
         self.xyz_gradient_accum = torch.empty(0)
         self.denom = torch.empty(0)
         self.optimizer = None
+        # Adam moments from a checkpoint, applied by the next training_setup
+        self.pending_optimizer_state = None
+        # over-allocated storage behind parameters, moments and stats, see utils/gs_capacity.py
+        self.row_buffers = {}
+        self.row_limit = None
+        # density budget, set from the config by training_setup (0 = no limit)
+        self.max_gaussians = 0
+        self.gaussian_memory_mb = 0
+        self.log_density = False
+        self.density_stats = {}
         self.percent_dense = 0
         # self.spatial_lr_scale = 0
         self.spatial_lr_scale = 1
         self.setup_functions()
 
     def capture(self):
+        # copies of the active rows: torch.save of a row buffer view writes the whole buffer
+        rows = lambda tensor: tensor.detach().clone()
+        opt_dict = self.optimizer.state_dict()
+        opt_dict["state"] = {
+            index: {name: rows(value) if torch.is_tensor(value) and value.dim() > 0 else value for name, value in state.items()}
+            for index, state in opt_dict["state"].items()
+        }
         return (
             self.active_sh_degree,
-            self._xyz,
-            self._features_dc,
-            self._features_rest,
-            self._scaling,
-            self._rotation,
-            self._opacity,
-            self.max_radii2D,
-            self.xyz_gradient_accum,
-            self.denom,
-            self.optimizer.state_dict(),
+            nn.Parameter(rows(self._xyz)),
+            nn.Parameter(rows(self._features_dc)),
+            nn.Parameter(rows(self._features_rest)),
+            nn.Parameter(rows(self._scaling)),
+            nn.Parameter(rows(self._rotation)),
+            nn.Parameter(rows(self._opacity)),
+            rows(self.max_radii2D),
+            rows(self.xyz_gradient_accum),
+            rows(self.denom),
+            opt_dict,
             self.spatial_lr_scale,
         )
     
@@ -193,6 +196,7 @@ class GaussianModel:
         denom,
         opt_dict, 
         self.spatial_lr_scale) = model_args
+        self.row_buffers = {}
         self.training_setup(training_args)
         self.xyz_gradient_accum = xyz_gradient_accum
         self.denom = denom
@@ -229,20 +233,20 @@ class GaussianModel:
 
     def create_from_pcd(self, pcd : BasicPointCloud, spatial_lr_scale : float = 1):
         self.spatial_lr_scale = spatial_lr_scale
-        fused_point_cloud = torch.tensor(np.asarray(pcd.points)).float().cuda()
-        fused_color = RGB2SH(torch.tensor(np.asarray(pcd.colors)).float().cuda())
-        features = torch.zeros((fused_color.shape[0], 3, (self.max_sh_degree + 1) ** 2)).float().cuda()
+        fused_point_cloud = torch.tensor(np.asarray(pcd.points)).float().to(self.device)
+        fused_color = RGB2SH(torch.tensor(np.asarray(pcd.colors)).float().to(self.device))
+        features = torch.zeros((fused_color.shape[0], 3, (self.max_sh_degree + 1) ** 2)).float().to(self.device)
         features[:, :3, 0 ] = fused_color
         features[:, 3:, 1:] = 0.0
 
         print("Number of points at initialisation : ", fused_point_cloud.shape[0])
 
-        dist2 = torch.clamp_min(distCUDA2(torch.from_numpy(np.asarray(pcd.points)).float().cuda()), 0.0000001)
+        dist2 = torch.clamp_min(mean_knn_dist2(torch.from_numpy(np.asarray(pcd.points)).float().to(self.device)), 0.0000001)
         scales = torch.log(torch.sqrt(dist2))[...,None].repeat(1, 3)
-        rots = torch.zeros((fused_point_cloud.shape[0], 4), device="cuda")
+        rots = torch.zeros((fused_point_cloud.shape[0], 4), device=self.device)
         rots[:, 0] = 1
 
-        opacities = inverse_sigmoid(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device="cuda"))
+        opacities = inverse_sigmoid(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device=self.device))
 
         self._xyz = nn.Parameter(fused_point_cloud.requires_grad_(True))
         self._features_dc = nn.Parameter(features[:,:,0:1].transpose(1, 2).contiguous().requires_grad_(True))
@@ -250,12 +254,16 @@ class GaussianModel:
         self._scaling = nn.Parameter(scales.requires_grad_(True))
         self._rotation = nn.Parameter(rots.requires_grad_(True))
         self._opacity = nn.Parameter(opacities.requires_grad_(True))
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.row_buffers = {}
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def training_setup(self, training_args):
         self.percent_dense = training_args.percent_dense
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
+        self.max_gaussians = getattr(training_args, "max_gaussians", 0) or 0
+        self.gaussian_memory_mb = getattr(training_args, "gaussian_memory_mb", 0) or 0
+        self.log_density = bool(getattr(training_args, "log_density", False))
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
 
         l = [
             {'params': [self._xyz], 'lr': training_args.position_lr_init * self.spatial_lr_scale, "name": "xyz"},
@@ -276,6 +284,22 @@ class GaussianModel:
                                                     lr_delay_mult=1.0,
                                                     max_steps=200)
 
+        if self.pending_optimizer_state is not None:
+            self.apply_optimizer_state(self.pending_optimizer_state)
+            self.pending_optimizer_state = None
+
+    def apply_optimizer_state(self, optimizer_state):
+        for group in self.optimizer.param_groups:
+            state = optimizer_state.get(group["name"])
+            param = group["params"][0]
+            if state is None or state["exp_avg"].shape != param.shape:
+                continue
+            self.optimizer.state[param] = {
+                "step": torch.tensor(float(state["step"])),
+                "exp_avg": state["exp_avg"].to(param.device),
+                "exp_avg_sq": state["exp_avg_sq"].to(param.device),
+            }
+
     def update_learning_rate(self, iteration):
         ''' Learning rate scheduling per step '''
         for param_group in self.optimizer.param_groups:
@@ -323,25 +347,51 @@ class GaussianModel:
     def save_ply(self, path):
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
-        xyz = self._xyz.detach().cpu().numpy()
-        print('xyz: ', xyz.shape)
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
+        xyz = self._xyz.detach()
+        print('xyz: ', tuple(xyz.shape))
+        normals = torch.zeros_like(xyz)
+        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1)
+        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1)
+        opacities = self._opacity.detach()
+        scale = self._scaling.detach()
+        rotation = self._rotation.detach()
 
-        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
+        # one packed (N, K) float32 buffer, copied to the host once
+        attributes = torch.cat((xyz, normals, f_dc, f_rest, opacities, scale, rotation), dim=1).float().cpu().numpy()
 
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
-        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-        
         print(attributes.shape)
 
-        elements[:] = list(map(tuple, attributes))
-        el = PlyElement.describe(elements, 'vertex')
-        PlyData([el]).write(path)
+        write_ply(path, self.construct_list_of_attributes(), attributes)
+
+    def save_splat(self, path, **kwargs):
+        # quantized export for the web viewer, see utils/splat_export.py
+        report = export_splat(gaussians_to_numpy(self), path, **kwargs)
+        print(f"[INFO] splat export: {report['splats_out']}/{report['splats_in']} splats, {report['bytes']} bytes")
+        return report
+
+    def save_checkpoint(self, path):
+        # parameters plus Adam moments, see utils/gs_checkpoint.py
+        save_gaussians(self, path)
+
+    def load_checkpoint(self, path, pinned=True):
+        params, optimizer_state, metadata, xyz = load_gaussians(path, self.device, pinned)
+
+        print("Number of points at loading : ", xyz.shape[0])
+
+        self._xyz = nn.Parameter(params["xyz"].requires_grad_(True))
+        self._features_dc = nn.Parameter(params["f_dc"].requires_grad_(True))
+        self._features_rest = nn.Parameter(params["f_rest"].requires_grad_(True))
+        self._opacity = nn.Parameter(params["opacity"].requires_grad_(True))
+        self._rotation = nn.Parameter(params["rotation"].requires_grad_(True))
+        self._scaling = nn.Parameter(params["scaling"].requires_grad_(True))
+
+        self.load_xyz = xyz
+        self.pending_optimizer_state = optimizer_state
+        self.row_buffers = {}
+
+        self.active_sh_degree = self.max_sh_degree
+
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def reset_opacity(self):
         opacities_new = inverse_sigmoid(torch.min(self.get_opacity, torch.ones_like(self.get_opacity)*0.01))
@@ -349,54 +399,67 @@ class GaussianModel:
         self._opacity = optimizable_tensors["opacity"]
 
     def load_ply(self, path):
-        plydata = PlyData.read(path)
+        names, data = read_ply(path)
 
-        xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                        np.asarray(plydata.elements[0]["y"]),
-                        np.asarray(plydata.elements[0]["z"])),  axis=1)
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
+        xyz = np.array(columns(names, data, ['x', 'y', 'z']))
+        opacities = columns(names, data, ['opacity'])
 
         print("Number of points at loading : ", xyz.shape[0])
 
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
+        features_dc = columns(names, data, ['f_dc_0', 'f_dc_1', 'f_dc_2'])[..., np.newaxis]
 
-        extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
+        extra_f_names = sorted([name for name in names if name.startswith("f_rest_")], key=lambda name: int(name.split('_')[-1]))
         assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        features_extra = columns(names, data, extra_f_names)
         # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
         features_extra = features_extra.reshape((features_extra.shape[0], 3, (self.max_sh_degree + 1) ** 2 - 1))
 
-        scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        scale_names = sorted([name for name in names if name.startswith("scale_")], key=lambda name: int(name.split('_')[-1]))
+        scales = columns(names, data, scale_names)
 
-        rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        rot_names = sorted([name for name in names if name.startswith("rot")], key=lambda name: int(name.split('_')[-1]))
+        rots = columns(names, data, rot_names)
 
-        self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._features_rest = nn.Parameter(torch.tensor(features_extra, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(True))
+        self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device=self.device).requires_grad_(True))
+        self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device=self.device).transpose(1, 2).contiguous().requires_grad_(True))
+        self._features_rest = nn.Parameter(torch.tensor(features_extra, dtype=torch.float, device=self.device).transpose(1, 2).contiguous().requires_grad_(True))
+        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device=self.device).requires_grad_(True))
+        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device=self.device).requires_grad_(True))
 
-        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(True))
+        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device=self.device).requires_grad_(True))
         
         self.load_xyz = xyz
+        self.pending_optimizer_state = None
+        self.row_buffers = {}
 
         self.active_sh_degree = self.max_sh_degree
 
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
+
+    def handoff(self):
+        # Leaves the model in the state load_ply would give for a save_ply of
+        # it, so the next training stage can start without the disk round trip.
+        self._xyz = nn.Parameter(self._xyz.detach().clone().requires_grad_(True))
+        self._features_dc = nn.Parameter(self._features_dc.detach().clone().requires_grad_(True))
+        self._features_rest = nn.Parameter(self._features_rest.detach().clone().requires_grad_(True))
+        self._opacity = nn.Parameter(self._opacity.detach().clone().requires_grad_(True))
+        self._rotation = nn.Parameter(self._rotation.detach().clone().requires_grad_(True))
+        self._scaling = nn.Parameter(self._scaling.detach().clone().requires_grad_(True))
+
+        print("Number of points at handoff : ", self.get_xyz.shape[0])
+
+        self.load_xyz = self._xyz.detach().cpu().numpy()
+
+        self.active_sh_degree = self.max_sh_degree
+        self.spatial_lr_scale = 1
+        self.optimizer = None
+        self.pending_optimizer_state = None
+        self.row_buffers = {}
+
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def reset_scale(self):
-        dist2 = torch.clamp_min(distCUDA2(torch.from_numpy(np.asarray(self.load_xyz)).float().cuda()), 0.0000001)
+        dist2 = torch.clamp_min(mean_knn_dist2(torch.from_numpy(np.asarray(self.load_xyz)).float().to(self.device)), 0.0000001)
         scales = torch.log(torch.sqrt(dist2))[...,None].repeat(1, 3)
         self._scaling = nn.Parameter(scales.requires_grad_(True))
 
@@ -416,21 +479,23 @@ class GaussianModel:
         return optimizable_tensors
 
     def _prune_optimizer(self, mask):
+        # compacts parameters and Adam moments in their row buffers, see utils/gs_capacity.py
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
+            name = group["name"]
             stored_state = self.optimizer.state.get(group['params'][0], None)
             if stored_state is not None:
-                stored_state["exp_avg"] = stored_state["exp_avg"][mask]
-                stored_state["exp_avg_sq"] = stored_state["exp_avg_sq"][mask]
-
+                for key in ("exp_avg", "exp_avg_sq"):
+                    buffer_name = f"adam.{name}.{key}"
+                    self.row_buffers[buffer_name], stored_state[key] = keep_rows(self.row_buffers.get(buffer_name), stored_state[key], mask)
                 del self.optimizer.state[group['params'][0]]
-                group["params"][0] = nn.Parameter((group["params"][0][mask].requires_grad_(True)))
+
+            self.row_buffers[name], rows = keep_rows(self.row_buffers.get(name), group["params"][0], mask)
+            group["params"][0] = nn.Parameter(rows)
+            if stored_state is not None:
                 self.optimizer.state[group['params'][0]] = stored_state
 
-                optimizable_tensors[group["name"]] = group["params"][0]
-            else:
-                group["params"][0] = nn.Parameter(group["params"][0][mask].requires_grad_(True))
-                optimizable_tensors[group["name"]] = group["params"][0]
+            optimizable_tensors[name] = group["params"][0]
         return optimizable_tensors
 
     def prune_points(self, mask):
@@ -444,30 +509,31 @@ class GaussianModel:
         self._scaling = optimizable_tensors["scaling"]
         self._rotation = optimizable_tensors["rotation"]
 
-        self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
-
-        self.denom = self.denom[valid_points_mask]
-        self.max_radii2D = self.max_radii2D[valid_points_mask]
+        for name in ("xyz_gradient_accum", "denom", "max_radii2D"):
+            self.row_buffers[name], rows = keep_rows(self.row_buffers.get(name), getattr(self, name), valid_points_mask)
+            setattr(self, name, rows)
 
     def cat_tensors_to_optimizer(self, tensors_dict):
+        # appends to parameters and Adam moments in place while their row buffers have room
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             assert len(group["params"]) == 1
-            extension_tensor = tensors_dict[group["name"]]
+            name = group["name"]
+            extension_tensor = tensors_dict[name]
             stored_state = self.optimizer.state.get(group['params'][0], None)
             if stored_state is not None:
-
-                stored_state["exp_avg"] = torch.cat((stored_state["exp_avg"], torch.zeros_like(extension_tensor)), dim=0)
-                stored_state["exp_avg_sq"] = torch.cat((stored_state["exp_avg_sq"], torch.zeros_like(extension_tensor)), dim=0)
-
+                zeros = torch.zeros_like(extension_tensor)
+                for key in ("exp_avg", "exp_avg_sq"):
+                    buffer_name = f"adam.{name}.{key}"
+                    self.row_buffers[buffer_name], stored_state[key] = append_rows(self.row_buffers.get(buffer_name), stored_state[key], zeros, self.row_limit)
                 del self.optimizer.state[group['params'][0]]
-                group["params"][0] = nn.Parameter(torch.cat((group["params"][0], extension_tensor), dim=0).requires_grad_(True))
+
+            self.row_buffers[name], rows = append_rows(self.row_buffers.get(name), group["params"][0], extension_tensor, self.row_limit)
+            group["params"][0] = nn.Parameter(rows)
+            if stored_state is not None:
                 self.optimizer.state[group['params'][0]] = stored_state
 
-                optimizable_tensors[group["name"]] = group["params"][0]
-            else:
-                group["params"][0] = nn.Parameter(torch.cat((group["params"][0], extension_tensor), dim=0).requires_grad_(True))
-                optimizable_tensors[group["name"]] = group["params"][0]
+            optimizable_tensors[name] = group["params"][0]
 
         return optimizable_tensors
 
@@ -487,14 +553,15 @@ class GaussianModel:
         self._scaling = optimizable_tensors["scaling"]
         self._rotation = optimizable_tensors["rotation"]
 
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        n = self.get_xyz.shape[0]
+        self.row_buffers["xyz_gradient_accum"], self.xyz_gradient_accum = zero_rows(self.row_buffers.get("xyz_gradient_accum"), n, (1,), self.device, limit=self.row_limit)
+        self.row_buffers["denom"], self.denom = zero_rows(self.row_buffers.get("denom"), n, (1,), self.device, limit=self.row_limit)
+        self.row_buffers["max_radii2D"], self.max_radii2D = zero_rows(self.row_buffers.get("max_radii2D"), n, (), self.device, limit=self.row_limit)
 
     def densify_and_split(self, grads, grad_threshold, scene_extent, N=2):
         n_init_points = self.get_xyz.shape[0]
         # Extract points that satisfy the gradient condition
-        padded_grad = torch.zeros((n_init_points), device="cuda")
+        padded_grad = torch.zeros((n_init_points), device=self.device)
         padded_grad[:grads.shape[0]] = grads.squeeze()
         selected_pts_mask = torch.where(padded_grad >= grad_threshold, True, False)
         selected_pts_mask = torch.logical_and(selected_pts_mask,
@@ -502,7 +569,7 @@ class GaussianModel:
         )
 
         stds = self.get_scaling[selected_pts_mask].repeat(N,1)
-        means =torch.zeros((stds.size(0), 3),device="cuda")
+        means =torch.zeros((stds.size(0), 3),device=self.device)
         samples = torch.normal(mean=means, std=stds)
         rots = build_rotation(self._rotation[selected_pts_mask]).repeat(N,1,1)
         new_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + self.get_xyz[selected_pts_mask].repeat(N, 1)
@@ -514,7 +581,7 @@ class GaussianModel:
 
         self.densification_postfix(new_xyz, new_features_dc, new_features_rest, new_opacity, new_scaling, new_rotation)
 
-        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device="cuda", dtype=bool)))
+        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device=self.device, dtype=bool)))
         self.prune_points(prune_filter)
 
     def densify_and_clone(self, grads, grad_threshold, scene_extent):
@@ -533,35 +600,130 @@ class GaussianModel:
 
         self.densification_postfix(new_xyz, new_features_dc, new_features_rest, new_opacities, new_scaling, new_rotation)
 
+    def bytes_per_gaussian(self):
+        # float32 parameters, their gradients and both Adam moments, plus the three densification stats
+        floats = sum(t.shape[1:].numel() for t in (self._xyz, self._features_dc, self._features_rest, self._opacity, self._scaling, self._rotation))
+        return 4 * (4 * floats + 3)
+
+    def gaussian_budget(self):
+        # most gaussians allowed by max_gaussians and gaussian_memory_mb, None without either
+        budgets = []
+        if self.max_gaussians > 0:
+            budgets.append(int(self.max_gaussians))
+        if self.gaussian_memory_mb > 0:
+            budgets.append(int(self.gaussian_memory_mb * 2**20) // self.bytes_per_gaussian())
+        return min(budgets) if budgets else None
+
+    def contribution_score(self):
+        # rough share of the rendered alpha: opacity x fraction of the views the
+        # gaussian was visible in x its largest screen radius since the last
+        # densification; plain opacity while no stats have been collected
+        opacity = self.get_opacity.detach().squeeze(-1)
+        seen = self.denom.squeeze(-1)
+        if seen.numel() == 0 or seen.max() <= 0:
+            return opacity
+        return opacity * (seen / seen.max()) * self.max_radii2D.clamp_min(1)
+
+    def prune_to_budget(self, prune_mask, budget, score=None):
+        # adds the lowest contributions to prune_mask until at most budget gaussians remain
+        excess = int((~prune_mask).sum()) - budget
+        if excess <= 0:
+            return prune_mask, 0
+        if score is None:
+            score = self.contribution_score()
+        score = score.masked_fill(prune_mask, float("inf"))
+        prune_mask = prune_mask.clone()
+        prune_mask[torch.topk(score, excess, largest=False).indices] = True
+        return prune_mask, excess
+
+    def prune_mask(self, min_opacity, extent, max_screen_size):
+        prune_mask = (self.get_opacity < min_opacity).squeeze()
+        if max_screen_size:
+            big_points_vs = self.max_radii2D > max_screen_size
+            big_points_ws = self.get_scaling.max(dim=1).values > 0.1 * extent
+            prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
+        return prune_mask
+
     def densify_and_prune(self, max_grad, min_opacity, extent, max_screen_size):
         grads = self.xyz_gradient_accum / self.denom
         grads[grads.isnan()] = 0.0
 
+        budget = self.gaussian_budget()
+        self.row_limit = budget
+        n_before = self.get_xyz.shape[0]
+        grad_norm = torch.norm(grads, dim=-1)
+        # every candidate adds one gaussian: a clone, or two split children replacing their parent
+        candidates = int((grad_norm >= max_grad).sum())
+        stats = {"before": n_before, "candidates": candidates, "grad_threshold": float(max_grad), "budget": budget}
+
+        score = None
+        if budget is not None and n_before + candidates > budget:
+            # scored now: densification_postfix clears the stats the score is built from
+            score = self.contribution_score()
+            # over budget: only the top-k gradients densify, k = room left
+            room = max(budget - n_before, 0)
+            selected = torch.zeros_like(grad_norm, dtype=torch.bool)
+            if room > 0:
+                top = torch.topk(torch.where(grad_norm >= max_grad, grad_norm, torch.full_like(grad_norm, -1.0)), room).indices
+                selected[top] = True
+                stats["grad_threshold"] = float(grad_norm[top].min())
+            grads = torch.where(selected[:, None], grads, torch.zeros_like(grads))
+            max_grad = max(max_grad, torch.finfo(grads.dtype).tiny)
+
         self.densify_and_clone(grads, max_grad, extent)
         self.densify_and_split(grads, max_grad, extent)
-
-        prune_mask = (self.get_opacity < min_opacity).squeeze()
-        if max_screen_size:
-            big_points_vs = self.max_radii2D > max_screen_size
-            big_points_ws = self.get_scaling.max(dim=1).values > 0.1 * extent
-            prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
+        stats["densified"] = self.get_xyz.shape[0] - n_before
+
+        prune_mask = self.prune_mask(min_opacity, extent, max_screen_size)
+        stats["pruned"] = int(prune_mask.sum())
+        stats["budget_pruned"] = 0
+        if budget is not None:
+            # only bites when there was no room to densify, so the rows still match the scores
+            prune_mask, stats["budget_pruned"] = self.prune_to_budget(prune_mask, budget, score)
         self.prune_points(prune_mask)
 
-        torch.cuda.empty_cache()
+        self.report_density("densify", stats)
+
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
 
     def prune(self, min_opacity, extent, max_screen_size):
 
-        prune_mask = (self.get_opacity < min_opacity).squeeze()
-        if max_screen_size:
-            big_points_vs = self.max_radii2D > max_screen_size
-            big_points_ws = self.get_scaling.max(dim=1).values > 0.1 * extent
-            prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
+        budget = self.gaussian_budget()
+        stats = {"before": self.get_xyz.shape[0], "candidates": 0, "densified": 0, "grad_threshold": None, "budget": budget}
+        prune_mask = self.prune_mask(min_opacity, extent, max_screen_size)
+        stats["pruned"] = int(prune_mask.sum())
+        stats["budget_pruned"] = 0
+        if budget is not None:
+            prune_mask, stats["budget_pruned"] = self.prune_to_budget(prune_mask, budget)
         self.prune_points(prune_mask)
 
-        torch.cuda.empty_cache()
+        self.report_density("prune", stats)
+
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    def report_density(self, kind, stats):
+        stats["after"] = self.get_xyz.shape[0]
+        stats["buffer_mb"] = capacity_bytes(self.row_buffers) / 2**20
+        self.density_stats = stats
+        if not self.log_density:
+            return
+        threshold = "-" if stats["grad_threshold"] is None else f"{stats['grad_threshold']:.3g}"
+        budget = "none" if stats["budget"] is None else stats["budget"]
+        print(f"[INFO] {kind}: {stats['before']} -> {stats['after']} gaussians "
+              f"(+{stats['densified']} of {stats['candidates']} candidates at grad >= {threshold}, "
+              f"-{stats['pruned']} pruned, -{stats['budget_pruned']} over budget), "
+              f"budget {budget}, buffers {stats['buffer_mb']:.1f} MB")
 
 
     def add_densification_stats(self, viewspace_point_tensor, update_filter):
+        if viewspace_point_tensor.dim() == 3:
+            # [B, N, 3] points and [B, N] filters from Renderer.render_batch, one update per view
+            norms = torch.norm(viewspace_point_tensor.grad[..., :2], dim=-1) * update_filter
+            self.xyz_gradient_accum += norms.sum(dim=0).unsqueeze(-1)
+            self.denom += update_filter.sum(dim=0).unsqueeze(-1)
+            return
         self.xyz_gradient_accum[update_filter] += torch.norm(viewspace_point_tensor.grad[update_filter,:2], dim=-1, keepdim=True)
         self.denom[update_filter] += 1
 
@@ -582,7 +744,7 @@ def getProjectionMatrix(znear, zfar, fovX, fovY):
 
 
 class MiniCam:
-    def __init__(self, c2w, width, height, fovy, fovx, znear, zfar):
+    def __init__(self, c2w, width, height, fovy, fovx, znear, zfar, device="cuda"):
         # c2w (pose) should be in NeRF convention.
 
         self.image_width = width
@@ -598,31 +760,106 @@ class MiniCam:
         w2c[1:3, :3] *= -1
         w2c[:3, 3] *= -1
 
-        self.world_view_transform = torch.tensor(w2c).transpose(0, 1).cuda()
+        self.world_view_transform = torch.tensor(w2c).transpose(0, 1).to(device)
         self.projection_matrix = (
             getProjectionMatrix(
                 znear=self.znear, zfar=self.zfar, fovX=self.FoVx, fovY=self.FoVy
             )
             .transpose(0, 1)
-            .cuda()
+            .to(device)
         )
         self.full_proj_transform = self.world_view_transform @ self.projection_matrix
-        self.camera_center = -torch.tensor(c2w[:3, 3]).cuda()
+        self.camera_center = -torch.tensor(c2w[:3, 3]).to(device)
+
+
+class BankCamera:
+    # a MiniCam whose tensors are rows of a CameraBank, nothing is allocated
+    def __init__(self, bank, index, resolution):
+        self.image_width = resolution
+        self.image_height = resolution
+        self.FoVy = bank.fovy
+        self.FoVx = bank.fovx
+        self.znear = bank.znear
+        self.zfar = bank.zfar
+
+        self.world_view_transform = bank.world_view_transform[index]
+        self.projection_matrix = bank.projection_matrix
+        self.full_proj_transform = bank.full_proj_transform[index]
+        self.camera_center = bank.camera_center[index]
+
+
+class CameraBank:
+    # the cameras of a fixed pose table (elevations / azimuths in degrees),
+    # built once with the same matrices MiniCam computes and kept as stacked
+    # device tensors; the projection only depends on the fov, so resolutions
+    # share every matrix and differ in the image size of their BankCameras
+    def __init__(self, elevations, azimuths, radius, fovy, fovx, znear, zfar, resolutions=(128, 256, 512), device="cuda"):
+        self.fovy = fovy
+        self.fovx = fovx
+        self.znear = znear
+        self.zfar = zfar
+
+        c2w = orbit_camera_batch(np.asarray(elevations, dtype=np.float64), np.asarray(azimuths, dtype=np.float64), radius)
+        w2c = np.linalg.inv(c2w)
+
+        # rectify...
+        w2c[:, 1:3, :3] *= -1
+        w2c[:, :3, 3] *= -1
+
+        self.poses = torch.from_numpy(c2w).to(device)
+        self.world_view_transform = torch.from_numpy(w2c).transpose(1, 2).contiguous().to(device)
+        self.projection_matrix = (
+            getProjectionMatrix(znear=znear, zfar=zfar, fovX=fovx, fovY=fovy)
+            .transpose(0, 1)
+            .to(device)
+        )
+        self.full_proj_transform = self.world_view_transform @ self.projection_matrix
+        self.camera_center = -torch.from_numpy(c2w[:, :3, 3].copy()).to(device)
+
+        self.views = {}
+        for resolution in resolutions:
+            self.add_resolution(resolution)
+
+    @classmethod
+    def from_json(cls, path, elevation, radius, fovy, fovx, znear, zfar, resolutions=(128, 256, 512), device="cuda"):
+        # data/camera_pose_relative.json: [elevations, azimuths] relative to the input view
+        with open(path, 'r') as f:
+            poses = json.load(f)
+        elevations = [elevation + ver for ver in poses[0]]
+        return cls(elevations, poses[1], radius, fovy, fovx, znear, zfar, resolutions, device)
+
+    def __len__(self):
+        return self.poses.shape[0]
+
+    def add_resolution(self, resolution):
+        self.views[resolution] = [BankCamera(self, index, resolution) for index in range(len(self))]
+
+    def cameras(self, view_ids, resolution):
+        if resolution not in self.views:
+            self.add_resolution(resolution)
+        views = self.views[resolution]
+        return [views[index] for index in view_ids]
 
 
 class Renderer:
-    def __init__(self, sh_degree=3, white_background=True, radius=1):
+    def __init__(self, sh_degree=3, white_background=True, radius=1, device="cuda", backend=None):
         
         self.sh_degree = sh_degree
         self.white_background = white_background
         self.radius = radius
+        self.device = torch.device(device)
 
-        self.gaussians = GaussianModel(sh_degree)
+        # "cuda": diff_gaussian_rasterization, "torch": utils/torch_rasterizer.py
+        if backend is None:
+            backend = "cuda" if self.device.type == "cuda" and GaussianRasterizer is not None else "torch"
+        self.backend = backend
+
+        self.gaussians = GaussianModel(sh_degree, device=self.device)
 
         self.bg_color = torch.tensor(
             [1, 1, 1] if white_background else [0, 0, 0],
             dtype=torch.float32,
-            device="cuda",
+            device=self.device,
         )
     
     def initialize(self, input=None, num_pts=5000, radius=0.5):
@@ -643,44 +880,59 @@ class Renderer:
         elif isinstance(input, BasicPointCloud):
             # load from a provided pcd
             self.gaussians.create_from_pcd(input, 1)
+        elif str(input).endswith(CHECKPOINT_SUFFIX):
+            # load parameters and Adam moments saved by save_checkpoint
+            self.gaussians.load_checkpoint(input)
         else:
             # load from saved ply
             self.gaussians.load_ply(input)
 
-    def render(
-        self,
-        viewpoint_camera,
-        scaling_modifier=1.0,
-        bg_color=None,
-        override_color=None,
-        compute_cov3D_python=False,
-        convert_SHs_python=False,
-    ):
-        # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-        screenspace_points = (
-            torch.zeros_like(
-                self.gaussians.get_xyz,
-                dtype=self.gaussians.get_xyz.dtype,
-                requires_grad=True,
-                device="cuda",
+    def activations(self, scaling_modifier=1.0, compute_cov3D_python=False, convert_SHs_python=False):
+        # activated parameters, computed once and shared by every view of a step
+        params = {
+            "means3D": self.gaussians.get_xyz,
+            "opacities": self.gaussians.get_opacity,
+            "scales": None,
+            "rotations": None,
+            "cov3D_precomp": None,
+            "shs": None,
+            "shs_view": None,
+        }
+
+        # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
+        # scaling / rotation by the rasterizer.
+        if compute_cov3D_python:
+            params["cov3D_precomp"] = self.gaussians.get_covariance(scaling_modifier)
+        else:
+            params["scales"] = self.gaussians.get_scaling
+            params["rotations"] = self.gaussians.get_rotation
+
+        # If it is desired to precompute colors from SHs in Python, do it per view in rasterize.
+        # If not, then SH -> RGB conversion will be done by rasterizer.
+        if convert_SHs_python:
+            params["shs_view"] = self.gaussians.get_features.transpose(1, 2).view(
+                -1, 3, (self.gaussians.max_sh_degree + 1) ** 2
             )
-            + 0
-        )
-        try:
-            screenspace_points.retain_grad()
-        except:
-            pass
+        else:
+            params["shs"] = self.gaussians.get_features
+        return params
 
+    def rasterize(self, viewpoint_camera, params, means2D, bg_color, scaling_modifier=1.0):
         # Set up rasterization configuration
         tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
         tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
 
-        raster_settings = GaussianRasterizationSettings(
+        if self.backend == "cuda":
+            settings_class, rasterizer_class = GaussianRasterizationSettings, GaussianRasterizer
+        else:
+            settings_class, rasterizer_class = RasterSettings, TorchGaussianRasterizer
+
+        raster_settings = settings_class(
             image_height=int(viewpoint_camera.image_height),
             image_width=int(viewpoint_camera.image_width),
             tanfovx=tanfovx,
             tanfovy=tanfovy,
-            bg=self.bg_color if bg_color is None else bg_color,
+            bg=bg_color,
             scale_modifier=scaling_modifier,
             viewmatrix=viewpoint_camera.world_view_transform,
             projmatrix=viewpoint_camera.full_proj_transform,
@@ -690,58 +942,65 @@ class Renderer:
             debug=False,
         )
 
-        rasterizer = GaussianRasterizer(raster_settings=raster_settings)
-
-        means3D = self.gaussians.get_xyz
-        means2D = screenspace_points
-        opacity = self.gaussians.get_opacity
+        rasterizer = rasterizer_class(raster_settings=raster_settings)
 
-        # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-        # scaling / rotation by the rasterizer.
-        scales = None
-        rotations = None
-        cov3D_precomp = None
-        if compute_cov3D_python:
-            cov3D_precomp = self.gaussians.get_covariance(scaling_modifier)
-        else:
-            scales = self.gaussians.get_scaling
-            rotations = self.gaussians.get_rotation
-
-        # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
-        # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
-        shs = None
         colors_precomp = None
-        if colors_precomp is None:
-            if convert_SHs_python:
-                shs_view = self.gaussians.get_features.transpose(1, 2).view(
-                    -1, 3, (self.gaussians.max_sh_degree + 1) ** 2
-                )
-                dir_pp = self.gaussians.get_xyz - viewpoint_camera.camera_center.repeat(
-                    self.gaussians.get_features.shape[0], 1
-                )
-                dir_pp_normalized = dir_pp / dir_pp.norm(dim=1, keepdim=True)
-                sh2rgb = eval_sh(
-                    self.gaussians.active_sh_degree, shs_view, dir_pp_normalized
-                )
-                colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
-            else:
-                shs = self.gaussians.get_features
-        else:
-            colors_precomp = override_color
+        if params["shs_view"] is not None:
+            dir_pp = params["means3D"] - viewpoint_camera.camera_center.repeat(
+                params["means3D"].shape[0], 1
+            )
+            dir_pp_normalized = dir_pp / dir_pp.norm(dim=1, keepdim=True)
+            sh2rgb = eval_sh(
+                self.gaussians.active_sh_degree, params["shs_view"], dir_pp_normalized
+            )
+            colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
 
         # Rasterize visible Gaussians to image, obtain their radii (on screen).
         rendered_image, radii, rendered_depth, rendered_alpha = rasterizer(
-            means3D=means3D,
+            means3D=params["means3D"],
             means2D=means2D,
-            shs=shs,
+            shs=params["shs"],
             colors_precomp=colors_precomp,
-            opacities=opacity,
-            scales=scales,
-            rotations=rotations,
-            cov3D_precomp=cov3D_precomp,
+            opacities=params["opacities"],
+            scales=params["scales"],
+            rotations=params["rotations"],
+            cov3D_precomp=params["cov3D_precomp"],
         )
 
-        rendered_image = rendered_image.clamp(0, 1)
+        return rendered_image.clamp(0, 1), radii, rendered_depth, rendered_alpha
+
+    def render(
+        self,
+        viewpoint_camera,
+        scaling_modifier=1.0,
+        bg_color=None,
+        override_color=None,
+        compute_cov3D_python=False,
+        convert_SHs_python=False,
+    ):
+        # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
+        screenspace_points = (
+            torch.zeros_like(
+                self.gaussians.get_xyz,
+                dtype=self.gaussians.get_xyz.dtype,
+                requires_grad=True,
+                device=self.device,
+            )
+            + 0
+        )
+        try:
+            screenspace_points.retain_grad()
+        except:
+            pass
+
+        params = self.activations(scaling_modifier, compute_cov3D_python, convert_SHs_python)
+        rendered_image, radii, rendered_depth, rendered_alpha = self.rasterize(
+            viewpoint_camera,
+            params,
+            screenspace_points,
+            self.bg_color if bg_color is None else bg_color,
+            scaling_modifier,
+        )
 
         # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
         # They will be excluded from value updates used in the splitting criteria.
@@ -753,3 +1012,60 @@ class Renderer:
             "visibility_filter": radii > 0,
             "radii": radii,
         }
+
+    def render_batch(
+        self,
+        viewpoint_cameras,
+        scaling_modifier=1.0,
+        bg_color=None,
+        compute_cov3D_python=False,
+        convert_SHs_python=False,
+    ):
+        # B views of the same size; bg_color is None, one [3] color or one per view [B, 3]
+        B = len(viewpoint_cameras)
+        if bg_color is None:
+            bg_color = self.bg_color
+        if bg_color.dim() == 1:
+            bg_color = bg_color.expand(B, 3)
+
+        # one [B, N, 3] screen-space tensor, row b receives the gradients of view b
+        screenspace_points = (
+            torch.zeros(
+                (B,) + tuple(self.gaussians.get_xyz.shape),
+                dtype=self.gaussians.get_xyz.dtype,
+                requires_grad=True,
+                device=self.device,
+            )
+            + 0
+        )
+        try:
+            screenspace_points.retain_grad()
+        except:
+            pass
+
+        params = self.activations(scaling_modifier, compute_cov3D_python, convert_SHs_python)
+        images, depths, alphas, radii = [], [], [], []
+        for i, viewpoint_camera in enumerate(viewpoint_cameras):
+            rendered_image, rendered_radii, rendered_depth, rendered_alpha = self.rasterize(
+                viewpoint_camera, params, screenspace_points[i], bg_color[i], scaling_modifier
+            )
+            images.append(rendered_image)
+            depths.append(rendered_depth)
+            alphas.append(rendered_alpha)
+            radii.append(rendered_radii)
+        radii = torch.stack(radii, dim=0)
+        view_visibility = radii > 0
+        max_radii = radii.max(dim=0).values
+
+        # visibility_filter / radii are merged over the views (any / max) and feed
+        # max_radii2D; view_visibility [B, N] goes to add_densification_stats
+        # together with viewspace_points
+        return {
+            "image": torch.stack(images, dim=0),
+            "depth": torch.stack(depths, dim=0),
+            "alpha": torch.stack(alphas, dim=0),
+            "viewspace_points": screenspace_points,
+            "view_visibility": view_visibility,
+            "visibility_filter": max_radii > 0,
+            "radii": max_radii,
+        }
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+
+# Binary PLY with a single "vertex" element of float properties, the layout
+# GaussianModel.save_ply has always written through plyfile. Rows are read and
+# written as one packed float32 buffer, so there is no per-gaussian Python work.
+# Anything else (ascii, other element or property types) goes through plyfile.
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+MAX_HEADER = 64 * 1024
+
+
+def ply_header(names, count):
+    lines = ["ply", "format binary_little_endian 1.0", f"element vertex {count}"]
+    lines += [f"property float {name}" for name in names]
+    lines.append("end_header")
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def write_ply(path, names, data):
+    # data: (N, len(names)) array, written as little-endian float32 rows;
+    # byte-identical to PlyData([PlyElement.describe(...)]).write on x86
+    data = np.ascontiguousarray(data, dtype="<f4")
+    assert data.ndim == 2 and data.shape[1] == len(names)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(ply_header(names, data.shape[0]))
+        f.write(memoryview(data).cast("B"))
+    os.replace(tmp, path)
+
+
+def parse_header(f):
+    # returns (format, [(element, count, [(name, type)])], header size)
+    if f.readline().strip() != b"ply":
+        raise ValueError("not a ply file")
+    fmt = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line or f.tell() > MAX_HEADER:
+            raise ValueError("unterminated ply header")
+        words = line.decode("ascii").split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "end_header":
+            return fmt, elements, f.tell()
+        if words[0] == "format":
+            fmt = words[1]
+        elif words[0] == "element":
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == "property":
+            if words[1] == "list":
+                raise ValueError("list properties are not supported")
+            elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+
+
+def read_ply(path, mmap=True):
+    # returns (names, data) with data a (N, K) float32 array; memory-mapped
+    # copy-on-write when the file is already packed float32 little-endian
+    try:
+        with open(path, "rb") as f:
+            fmt, elements, offset = parse_header(f)
+        if fmt != "binary_little_endian" or len(elements) != 1 or elements[0][0] != "vertex":
+            raise ValueError("unsupported ply layout")
+    except (ValueError, KeyError):
+        return read_ply_fallback(path)
+
+    _, count, properties = elements[0]
+    names = [name for name, _ in properties]
+    if all(kind == "f4" for _, kind in properties):
+        shape = (count, len(names))
+        if mmap and count:
+            return names, np.memmap(path, dtype="<f4", mode="c", offset=offset, shape=shape)
+        return names, np.fromfile(path, dtype="<f4", count=count * len(names), offset=offset).reshape(shape)
+
+    records = np.fromfile(path, dtype=np.dtype([(name, "<" + kind) for name, kind in properties]), count=count, offset=offset)
+    return names, np.stack([records[name].astype(np.float32) for name in names], axis=1)
+
+
+def read_ply_fallback(path):
+    from plyfile import PlyData
+
+    vertex = PlyData.read(path)["vertex"]
+    names = [p.name for p in vertex.properties]
+    return names, np.stack([np.asarray(vertex[name], dtype=np.float32) for name in names], axis=1)
+
+
+def columns(names, data, wanted):
+    # a view when the wanted properties are stored next to each other, which
+    # they are in every file save_ply writes
+    index = [names.index(name) for name in wanted]
+    if index and index == list(range(index[0], index[0] + len(index))):
+        return data[:, index[0]:index[0] + len(index)]
+    return data[:, index]
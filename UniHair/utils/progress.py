@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import time
+
+# Lines starting with this marker carry one JSON progress event. The server
+# parses them instead of scraping the tqdm bar.
+EVENT_MARKER = "@@UNIHAIR_EVENT "
+EVENT_INTERVAL = float(os.environ.get("UNIHAIR_EVENT_INTERVAL", 0.5))
+
+
+def emit_event(event):
+    sys.stdout.write(EVENT_MARKER + json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def parse_event(line):
+    if not line.startswith(EVENT_MARKER):
+        return None
+    try:
+        return json.loads(line[len(EVENT_MARKER):])
+    except ValueError:
+        return None
+
+
+class ProgressReporter:
+    def __init__(self, stage, total, interval=EVENT_INTERVAL):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.last_emit = 0.0
+        self.started = time.time()
+
+    def start(self, **fields):
+        self.started = time.time()
+        emit_event({"type": "stage_start", "stage": self.stage, "total": self.total, **fields})
+
+    def update(self, step, losses=None, num_gaussians=None, iter_ms=None):
+        # losses may hold cuda tensors; they are only read back when an event goes out
+        now = time.time()
+        if now - self.last_emit < self.interval and step < self.total:
+            return
+        self.last_emit = now
+        emit_event({
+            "type": "progress",
+            "stage": self.stage,
+            "step": step,
+            "total": self.total,
+            "losses": {name: float(value) for name, value in (losses or {}).items()},
+            "num_gaussians": num_gaussians,
+            "iter_ms": None if iter_ms is None else round(iter_ms, 3),
+            "elapsed": round(now - self.started, 3),
+        })
+
+    def end(self, **fields):
+        emit_event({
+            "type": "stage_end",
+            "stage": self.stage,
+            "total": self.total,
+            "elapsed": round(time.time() - self.started, 3),
+            **fields,
+        })
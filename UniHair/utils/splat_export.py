@@ -0,0 +1,261 @@
+import os
+import json
+import struct
+import argparse
+import numpy as np
+from utils.ply_io import read_ply, columns
+
+# "splat": the layout read by the web viewer (@mkkellogg/gaussian-splats-3d
+# SplatLoader), 32 bytes per splat, no header
+SPLAT_DTYPE = np.dtype([
+    ("xyz", "<f4", (3,)),
+    ("scale", "<f4", (3,)),
+    ("rgba", "u1", (4,)),
+    ("rot", "u1", (4,)),
+])
+
+# "compact": header, then one array per attribute (groups similar bytes for
+# gzip/zstd on download), 17 bytes per splat:
+#   positions  uint16 x3, normalized to the bounding box in the header
+#   scales     uint8 x3, log scale normalized to the range in the header
+#   rgba       uint8 x4, DC colour and sigmoid opacity
+#   rotations  uint32, smallest-three: 2 bit index of the dropped largest
+#              component, then the other three in 10 bits each
+COMPACT_MAGIC = b"QSPL"
+COMPACT_VERSION = 1
+COMPACT_HEADER = struct.Struct("<4sII3f3f2f")
+COMPACT_BYTES = 17
+
+SH_C0 = 0.28209479177387814
+SQRT2 = np.sqrt(2.0)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def read_ply_gaussians(path):
+    names, data = read_ply(path)
+    f_rest = sorted([name for name in names if name.startswith("f_rest_")], key=lambda name: int(name.split("_")[-1]))
+    return {
+        "xyz": columns(names, data, ["x", "y", "z"]),
+        "f_dc": columns(names, data, ["f_dc_0", "f_dc_1", "f_dc_2"]),
+        "f_rest": columns(names, data, f_rest),
+        "opacity": columns(names, data, ["opacity"])[:, 0],
+        "scale": columns(names, data, ["scale_0", "scale_1", "scale_2"]),
+        "rot": columns(names, data, ["rot_0", "rot_1", "rot_2", "rot_3"]),
+    }
+
+
+def gaussians_to_numpy(gaussians):
+    # the pre-activation values save_ply writes
+    return {
+        "xyz": gaussians._xyz.detach().cpu().numpy(),
+        "f_dc": gaussians._features_dc.detach().transpose(1, 2).flatten(start_dim=1).cpu().numpy(),
+        "f_rest": gaussians._features_rest.detach().transpose(1, 2).flatten(start_dim=1).cpu().numpy(),
+        "opacity": gaussians._opacity.detach().cpu().numpy()[:, 0],
+        "scale": gaussians._scaling.detach().cpu().numpy(),
+        "rot": gaussians._rotation.detach().cpu().numpy(),
+    }
+
+
+def normalize(q):
+    return q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+
+
+def importance(g):
+    # screen coverage proxy: ellipsoid volume times opacity
+    return np.exp(g["scale"].astype(np.float64).sum(axis=1)) * sigmoid(g["opacity"].astype(np.float64))
+
+
+def select(g, max_splats=None, max_count=None, quality=None, min_opacity=1 / 255):
+    # indices of the kept splats, most important first. quality keeps the
+    # smallest prefix holding that fraction of the total importance
+    score = importance(g)
+    order = np.argsort(-score, kind="stable")
+    order = order[sigmoid(g["opacity"][order]) >= min_opacity]
+
+    keep = len(order)
+    if max_splats is not None:
+        keep = min(keep, max_splats)
+    if max_count is not None:
+        keep = min(keep, max(max_count, 0))
+    if quality is not None and len(order):
+        mass = np.cumsum(score[order])
+        keep = min(keep, int(np.searchsorted(mass, quality * mass[-1])) + 1)
+    return order[:keep]
+
+
+def colors(g, order):
+    color = 0.5 + SH_C0 * g["f_dc"][order]
+    alpha = sigmoid(g["opacity"][order])[:, None]
+    return np.clip(np.round(np.concatenate([color, alpha], axis=1) * 255), 0, 255).astype(np.uint8)
+
+
+def encode_splat(g, order):
+    rot = normalize(g["rot"][order].astype(np.float64))
+    # q and -q are the same rotation; a positive w keeps it away from the clip at 255
+    rot *= np.where(rot[:, :1] < 0, -1.0, 1.0)
+
+    records = np.empty(len(order), SPLAT_DTYPE)
+    records["xyz"] = g["xyz"][order]
+    records["scale"] = np.exp(g["scale"][order])
+    records["rgba"] = colors(g, order)
+    records["rot"] = np.clip(np.round(rot * 128 + 128), 0, 255)
+    return records.tobytes()
+
+
+def decode_splat(buf):
+    records = np.frombuffer(buf, SPLAT_DTYPE)
+    return {
+        "xyz": records["xyz"].astype(np.float32),
+        "scale": records["scale"].astype(np.float32),
+        "rgba": records["rgba"] / 255.0,
+        "rot": normalize((records["rot"].astype(np.float32) - 128) / 128),
+    }
+
+
+def encode_compact(g, order):
+    xyz = g["xyz"][order].astype(np.float64)
+    log_scale = g["scale"][order].astype(np.float64)
+    if len(order):
+        lo, hi = xyz.min(axis=0), xyz.max(axis=0)
+        s_lo, s_hi = log_scale.min(), log_scale.max()
+    else:
+        lo, hi, s_lo, s_hi = np.zeros(3), np.zeros(3), 0.0, 0.0
+    header = COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, len(order), *lo, *hi, s_lo, s_hi)
+
+    positions = np.round((xyz - lo) / np.maximum(hi - lo, 1e-12) * 65535).astype(np.uint16)
+    scales = np.round((log_scale - s_lo) / max(s_hi - s_lo, 1e-12) * 255).astype(np.uint8)
+
+    rot = normalize(g["rot"][order].astype(np.float64))
+    largest = np.abs(rot).argmax(axis=1)
+    rot *= np.where(rot[np.arange(len(order)), largest] < 0, -1.0, 1.0)[:, None]
+    rest = rot[np.arange(4)[None, :] != largest[:, None]].reshape(-1, 3)
+    bits = np.clip(np.round((rest * SQRT2 + 1) / 2 * 1023), 0, 1023).astype(np.uint32)
+    packed = (largest.astype(np.uint32) << 30) | (bits[:, 0] << 20) | (bits[:, 1] << 10) | bits[:, 2]
+
+    return b"".join([
+        header,
+        positions.astype("<u2").tobytes(),
+        scales.tobytes(),
+        colors(g, order).tobytes(),
+        packed.astype("<u4").tobytes(),
+    ])
+
+
+def decode_compact(buf):
+    magic, version, count, *bounds = COMPACT_HEADER.unpack_from(buf)
+    if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+        raise ValueError(f"not a version {COMPACT_VERSION} compact splat file")
+    lo, hi = np.array(bounds[0:3]), np.array(bounds[3:6])
+    s_lo, s_hi = bounds[6:8]
+
+    offset = COMPACT_HEADER.size
+    positions = np.frombuffer(buf, "<u2", count * 3, offset).reshape(count, 3)
+    offset += positions.nbytes
+    scales = np.frombuffer(buf, np.uint8, count * 3, offset).reshape(count, 3)
+    offset += scales.nbytes
+    rgba = np.frombuffer(buf, np.uint8, count * 4, offset).reshape(count, 4)
+    offset += rgba.nbytes
+    packed = np.frombuffer(buf, "<u4", count, offset)
+
+    rest = np.stack([(packed >> shift) & 1023 for shift in (20, 10, 0)], axis=1) / 1023 * 2 - 1
+    rest /= SQRT2
+    largest = (packed >> 30).astype(np.int64)
+    rot = np.zeros((count, 4))
+    mask = np.arange(4)[None, :] != largest[:, None]
+    rot[mask] = rest.reshape(-1)
+    rot[np.arange(count), largest] = np.sqrt(np.clip(1 - (rest ** 2).sum(axis=1), 0, 1))
+
+    return {
+        "xyz": (lo + positions / 65535 * (hi - lo)).astype(np.float32),
+        "scale": np.exp(s_lo + scales / 255 * (s_hi - s_lo)).astype(np.float32),
+        "rgba": rgba / 255.0,
+        "rot": normalize(rot),
+    }
+
+
+FORMATS = {
+    "splat": (encode_splat, decode_splat, SPLAT_DTYPE.itemsize, 0),
+    "compact": (encode_compact, decode_compact, COMPACT_BYTES, COMPACT_HEADER.size),
+}
+
+
+def error_report(g, order, decoded, size, ply_bytes=None):
+    # compares the decoded export against the float values of the same splats
+    n = len(order)
+    ref_rgba = np.concatenate([0.5 + SH_C0 * g["f_dc"][order], sigmoid(g["opacity"][order])[:, None]], axis=1)
+    dot = np.abs((decoded["rot"] * normalize(g["rot"][order].astype(np.float64))).sum(axis=1))
+    angle = np.degrees(2 * np.arccos(np.clip(dot, 0, 1)))
+    extent = float(np.ptp(g["xyz"], axis=0).max()) if len(g["xyz"]) else 0.0
+    score = importance(g)
+
+    def stats(err):
+        if n == 0:
+            return {"mean": 0.0, "max": 0.0}
+        err = np.abs(err).reshape(n, -1).max(axis=1)
+        return {"mean": float(err.mean()), "max": float(err.max())}
+
+    report = {
+        "splats_in": int(len(g["xyz"])),
+        "splats_out": int(n),
+        "dropped_importance": float(1 - score[order].sum() / max(score.sum(), 1e-12)),
+        "bytes": int(size),
+        "position": stats(decoded["xyz"] - g["xyz"][order]),
+        "position_rel_extent": stats((decoded["xyz"] - g["xyz"][order]) / max(extent, 1e-12)),
+        "scale_rel": stats(decoded["scale"] / np.exp(g["scale"][order]) - 1),
+        "color": stats(decoded["rgba"][:, :3] - np.clip(ref_rgba[:, :3], 0, 1)),
+        "color_clipped": float(((ref_rgba[:, :3] < 0) | (ref_rgba[:, :3] > 1)).any(axis=1).mean()) if n else 0.0,
+        "alpha": stats(decoded["rgba"][:, 3] - ref_rgba[:, 3]),
+        "rotation_deg": stats(angle),
+        # neither layout keeps view-dependent colour; this is what is lost
+        "sh_rest_abs_mean": float(np.abs(g["f_rest"][order]).mean()) if g["f_rest"].size and n else 0.0,
+    }
+    if ply_bytes:
+        report["ply_bytes"] = int(ply_bytes)
+        report["ratio"] = ply_bytes / max(size, 1)
+    return report
+
+
+def export_splat(g, path, fmt="splat", max_splats=None, target_bytes=None, quality=None,
+                 min_opacity=1 / 255, ply_bytes=None):
+    encode, decode, record_bytes, header_bytes = FORMATS[fmt]
+    max_count = None if target_bytes is None else (target_bytes - header_bytes) // record_bytes
+    order = select(g, max_splats, max_count, quality, min_opacity)
+    buf = encode(g, order)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf)
+    os.replace(tmp, path)
+    return error_report(g, order, decode(buf), len(buf), ply_bytes)
+
+
+if __name__ == "__main__":
+    # from the UniHair root: python -m utils.splat_export <ply>
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ply", help="gaussian ply written by GaussianModel.save_ply")
+    parser.add_argument("-o", "--output", default=None, help="defaults to the ply path with a .splat/.qsplat suffix")
+    parser.add_argument("--format", choices=list(FORMATS), default="splat")
+    parser.add_argument("--max_splats", type=int, default=None)
+    parser.add_argument("--target_mb", type=float, default=None, help="upper bound on the output size")
+    parser.add_argument("--quality", type=float, default=None, help="fraction of total importance to keep, e.g. 0.995")
+    parser.add_argument("--min_opacity", type=float, default=1 / 255)
+    parser.add_argument("--report", default=None, help="also write the error report as json")
+    args = parser.parse_args()
+
+    suffix = ".splat" if args.format == "splat" else ".qsplat"
+    output = args.output or os.path.splitext(args.ply)[0] + suffix
+    target_bytes = None if args.target_mb is None else int(args.target_mb * 1024 * 1024)
+    report = export_splat(
+        read_ply_gaussians(args.ply), output, fmt=args.format,
+        max_splats=args.max_splats, target_bytes=target_bytes, quality=args.quality,
+        min_opacity=args.min_opacity, ply_bytes=os.path.getsize(args.ply),
+    )
+    print(f"[INFO] wrote {report['splats_out']}/{report['splats_in']} splats to {output}")
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
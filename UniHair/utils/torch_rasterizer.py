@@ -0,0 +1,259 @@
+import math
+from typing import NamedTuple
+
+import torch
+
+from utils.sh_utils import eval_sh
+
+# Reference implementation of the diff_gaussian_rasterization forward pass
+# (the variant returning depth and alpha) in plain PyTorch, differentiable
+# through autograd. It follows the CUDA kernels step by step: EWA projection
+# with the 0.3 low-pass, 3-sigma radii, 16x16 tiles, per-tile depth order,
+# alpha clamped to 0.99 and dropped below 1/255, early stop at T < 1e-4.
+# Gradients reaching means2D are w.r.t. NDC coordinates, as in CUDA, so the
+# densification thresholds mean the same thing on both backends.
+
+BLOCK = 16
+MIN_ALPHA = 1.0 / 255.0
+MAX_ALPHA = 0.99
+MIN_TRANSMITTANCE = 1e-4
+# elements of the [tiles, pixels, gaussians] blocks evaluated at once
+CHUNK_ELEMENTS = 1 << 24
+KNN_CHUNK = 1024
+
+
+class RasterSettings(NamedTuple):
+    # same fields as diff_gaussian_rasterization.GaussianRasterizationSettings
+    image_height: int
+    image_width: int
+    tanfovx: float
+    tanfovy: float
+    bg: torch.Tensor
+    scale_modifier: float
+    viewmatrix: torch.Tensor
+    projmatrix: torch.Tensor
+    sh_degree: int
+    campos: torch.Tensor
+    prefiltered: bool
+    debug: bool
+
+
+def quaternion_to_matrix(q):
+    q = torch.nn.functional.normalize(q, dim=-1)
+    r, x, y, z = q.unbind(-1)
+    return torch.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - r * z), 2 * (x * z + r * y),
+        2 * (x * y + r * z), 1 - 2 * (x * x + z * z), 2 * (y * z - r * x),
+        2 * (x * z - r * y), 2 * (y * z + r * x), 1 - 2 * (x * x + y * y),
+    ], dim=-1).view(-1, 3, 3)
+
+
+# upper triangle of a symmetric 3x3 in the cov3D_precomp order (xx, xy, xz, yy, yz, zz)
+UPPER_ROWS = [0, 0, 0, 1, 1, 2]
+UPPER_COLS = [0, 1, 2, 1, 2, 2]
+
+
+def packed_covariance(scales, rotations, scale_modifier=1.0):
+    # cov3D_precomp [N, 6] of M M^T, M = R(q) S, from the nine entries of M
+    # as [N] tensors: no 3x3 buffers, no indexed writes, no batched matmul
+    q = torch.nn.functional.normalize(rotations, dim=-1)
+    r, x, y, z = q.unbind(-1)
+    sx, sy, sz = (scale_modifier * scales).unbind(-1)
+    m00, m01, m02 = (1 - 2 * (y * y + z * z)) * sx, 2 * (x * y - r * z) * sy, 2 * (x * z + r * y) * sz
+    m10, m11, m12 = 2 * (x * y + r * z) * sx, (1 - 2 * (x * x + z * z)) * sy, 2 * (y * z - r * x) * sz
+    m20, m21, m22 = 2 * (x * z - r * y) * sx, 2 * (y * z + r * x) * sy, (1 - 2 * (x * x + y * y)) * sz
+    return torch.stack([
+        m00 * m00 + m01 * m01 + m02 * m02,
+        m00 * m10 + m01 * m11 + m02 * m12,
+        m00 * m20 + m01 * m21 + m02 * m22,
+        m10 * m10 + m11 * m11 + m12 * m12,
+        m10 * m20 + m11 * m21 + m12 * m22,
+        m20 * m20 + m21 * m21 + m22 * m22,
+    ], dim=-1)
+
+
+def unpack_covariance(cov6):
+    a, b, c, d, e, f = cov6.unbind(-1)
+    return torch.stack([a, b, c, b, d, e, c, e, f], dim=-1).view(-1, 3, 3)
+
+
+def ndc_to_pixel(v, size):
+    return ((v + 1.0) * size - 1.0) * 0.5
+
+
+class TorchGaussianRasterizer:
+    def __init__(self, raster_settings):
+        self.raster_settings = raster_settings
+
+    def __call__(self, means3D, means2D, opacities, shs=None, colors_precomp=None,
+                 scales=None, rotations=None, cov3D_precomp=None):
+        s = self.raster_settings
+        H, W = int(s.image_height), int(s.image_width)
+        device = means3D.device
+        N = means3D.shape[0]
+
+        ones = torch.ones((N, 1), dtype=means3D.dtype, device=device)
+        p_hom = torch.cat([means3D, ones], dim=1)
+        p_view = p_hom @ s.viewmatrix
+        p_proj = p_hom @ s.projmatrix
+        p_proj = p_proj[:, :3] / (p_proj[:, 3:4] + 1e-7)
+        depths = p_view[:, 2]
+
+        # 2D covariance (EWA splatting)
+        if cov3D_precomp is not None:
+            cov3D = unpack_covariance(cov3D_precomp)
+        else:
+            cov3D = unpack_covariance(packed_covariance(scales, rotations, s.scale_modifier))
+        focal_x = W / (2.0 * s.tanfovx)
+        focal_y = H / (2.0 * s.tanfovy)
+        tz = depths.clamp_min(1e-6)
+        tx = (p_view[:, 0] / tz).clamp(-1.3 * s.tanfovx, 1.3 * s.tanfovx) * tz
+        ty = (p_view[:, 1] / tz).clamp(-1.3 * s.tanfovy, 1.3 * s.tanfovy) * tz
+        zeros = torch.zeros_like(tz)
+        J = torch.stack([
+            focal_x / tz, zeros, -focal_x * tx / (tz * tz),
+            zeros, focal_y / tz, -focal_y * ty / (tz * tz),
+        ], dim=-1).view(-1, 2, 3)
+        T = J @ s.viewmatrix[:3, :3].T
+        cov2D = T @ cov3D @ T.transpose(1, 2)
+        a = cov2D[:, 0, 0] + 0.3
+        b = cov2D[:, 0, 1]
+        c = cov2D[:, 1, 1] + 0.3
+        det = a * c - b * b
+        safe_det = torch.where(det == 0, torch.ones_like(det), det)
+        conic = torch.stack([c / safe_det, -b / safe_det, a / safe_det], dim=-1)
+
+        # radii and tile rectangles; no gradient flows through these
+        with torch.no_grad():
+            mid = 0.5 * (a + c)
+            lambda1 = mid + torch.sqrt((mid * mid - det).clamp_min(0.1))
+            radius = torch.ceil(3.0 * torch.sqrt(lambda1))
+            px = ndc_to_pixel(p_proj[:, 0], W)
+            py = ndc_to_pixel(p_proj[:, 1], H)
+            grid_x = (W + BLOCK - 1) // BLOCK
+            grid_y = (H + BLOCK - 1) // BLOCK
+            x0 = ((px - radius) / BLOCK).floor().clamp(0, grid_x).long()
+            x1 = ((px + radius + BLOCK - 1) / BLOCK).floor().clamp(0, grid_x).long()
+            y0 = ((py - radius) / BLOCK).floor().clamp(0, grid_y).long()
+            y1 = ((py + radius + BLOCK - 1) / BLOCK).floor().clamp(0, grid_y).long()
+            tiles_touched = (x1 - x0) * (y1 - y0)
+            visible = (depths > 0.2) & (det != 0) & (tiles_touched > 0)
+            radii = torch.where(visible, radius, torch.zeros_like(radius)).int()
+            tiles_touched = torch.where(visible, tiles_touched, torch.zeros_like(tiles_touched))
+
+        # colours
+        if colors_precomp is None:
+            dirs = torch.nn.functional.normalize(means3D - s.campos[None, :], dim=-1)
+            colors = torch.clamp_min(eval_sh(s.sh_degree, shs.transpose(1, 2), dirs) + 0.5, 0.0)
+        else:
+            colors = colors_precomp
+
+        # screen positions; means2D enters in NDC so its gradient matches CUDA's
+        xy = torch.stack([
+            ndc_to_pixel(p_proj[:, 0] + means2D[:, 0], W),
+            ndc_to_pixel(p_proj[:, 1] + means2D[:, 1], H),
+        ], dim=-1)
+
+        image, depth, alpha = self.render_tiles(
+            xy, conic, opacities.view(-1), colors, depths, tiles_touched,
+            x0, x1, y0, y1, grid_x, grid_y, H, W, s.bg,
+        )
+        return image, radii, depth, alpha
+
+    def render_tiles(self, xy, conic, opacity, colors, depths, tiles_touched,
+                     x0, x1, y0, y1, grid_x, grid_y, H, W, bg):
+        device = xy.device
+        num_tiles = grid_x * grid_y
+        pixels = BLOCK * BLOCK
+
+        # (tile, gaussian) pairs ordered by tile then depth, like the CUDA key sort
+        with torch.no_grad():
+            ids = torch.nonzero(tiles_touched > 0).squeeze(1)
+            ids = ids[torch.sort(depths[ids], stable=True).indices]
+            counts = tiles_touched[ids]
+            gauss = torch.repeat_interleave(ids, counts)
+            offset = torch.arange(gauss.numel(), device=device) - torch.repeat_interleave(torch.cumsum(counts, 0) - counts, counts)
+            width = (x1 - x0)[gauss]
+            tile = (y0[gauss] + offset // width.clamp_min(1)) * grid_x + x0[gauss] + offset % width.clamp_min(1)
+            order = torch.sort(tile, stable=True).indices
+            gauss = gauss[order]
+            tile_counts = torch.bincount(tile[order], minlength=num_tiles)
+            tile_starts = torch.cumsum(tile_counts, 0) - tile_counts
+
+            local = torch.arange(pixels, device=device)
+            local_x = (local % BLOCK).float()
+            local_y = (local // BLOCK).float()
+
+        out_color = torch.zeros((num_tiles, pixels, 3), dtype=xy.dtype, device=device)
+        out_depth = torch.zeros((num_tiles, pixels), dtype=xy.dtype, device=device)
+        out_T = torch.ones((num_tiles, pixels), dtype=xy.dtype, device=device)
+
+        busy = torch.nonzero(tile_counts > 0).squeeze(1).tolist()
+        counts_host = tile_counts.tolist()
+        start = 0
+        while start < len(busy):
+            # as many tiles as fit the element budget at this chunk's longest list
+            end = start
+            longest = 0
+            while end < len(busy):
+                longest_next = max(longest, counts_host[busy[end]])
+                if end > start and (end - start + 1) * pixels * longest_next > CHUNK_ELEMENTS:
+                    break
+                longest = longest_next
+                end += 1
+            tiles = torch.tensor(busy[start:end], device=device)
+            start = end
+
+            with torch.no_grad():
+                slot = torch.arange(longest, device=device)
+                valid = slot[None, :] < tile_counts[tiles][:, None]
+                index = gauss[(tile_starts[tiles][:, None] + slot[None, :]).clamp_max(gauss.numel() - 1)]
+                pix_x = (tiles % grid_x)[:, None].float() * BLOCK + local_x[None, :]
+                pix_y = (tiles // grid_x)[:, None].float() * BLOCK + local_y[None, :]
+
+            # [tiles, pixels, gaussians]
+            dx = xy[index, 0][:, None, :] - pix_x[:, :, None]
+            dy = xy[index, 1][:, None, :] - pix_y[:, :, None]
+            con = conic[index]
+            power = -0.5 * (con[..., 0][:, None, :] * dx * dx + con[..., 2][:, None, :] * dy * dy) \
+                - con[..., 1][:, None, :] * dx * dy
+            alpha = (opacity[index][:, None, :] * torch.exp(power.clamp_max(0.0))).clamp_max(MAX_ALPHA)
+            keep = valid[:, None, :] & (power <= 0) & (alpha >= MIN_ALPHA)
+            alpha = torch.where(keep, alpha, torch.zeros_like(alpha))
+
+            transmittance = torch.cumprod(1 - alpha, dim=-1)
+            with torch.no_grad():
+                # a pixel stops at the first gaussian that would take T below 1e-4
+                alive = torch.cumprod((transmittance >= MIN_TRANSMITTANCE).to(alpha.dtype), dim=-1)
+            alpha = alpha * alive
+            transmittance = torch.cumprod(1 - alpha, dim=-1)
+            weight = alpha * torch.cat([torch.ones_like(transmittance[..., :1]), transmittance[..., :-1]], dim=-1)
+
+            out_color = out_color.index_copy(0, tiles, torch.einsum("tpg,tgc->tpc", weight, colors[index]))
+            out_depth = out_depth.index_copy(0, tiles, (weight * depths[index][:, None, :]).sum(-1))
+            out_T = out_T.index_copy(0, tiles, transmittance[..., -1])
+
+        def to_image(tiles):
+            # [tiles, pixels, C] -> [C, H, W]
+            C = tiles.shape[-1]
+            image = tiles.view(grid_y, grid_x, BLOCK, BLOCK, C).permute(4, 0, 2, 1, 3)
+            return image.reshape(C, grid_y * BLOCK, grid_x * BLOCK)[:, :H, :W]
+
+        color = to_image(out_color) + to_image(out_T[..., None]) * bg.view(3, 1, 1)
+        return color, to_image(out_depth[..., None]), 1 - to_image(out_T[..., None])
+
+
+def knn_dist2(points, k=3, chunk=KNN_CHUNK):
+    # mean squared distance to the k nearest neighbours, what simple_knn's
+    # distCUDA2 returns; brute force in chunks, fine for initialization sizes
+    n = points.shape[0]
+    if n <= 1:
+        return torch.zeros(n, dtype=points.dtype, device=points.device)
+    k = min(k, n - 1)
+    out = torch.empty(n, dtype=points.dtype, device=points.device)
+    for start in range(0, n, chunk):
+        block = points[start:start + chunk]
+        dist = torch.cdist(block, points).square_()
+        dist[torch.arange(block.shape[0]), torch.arange(start, start + block.shape[0])] = math.inf
+        out[start:start + chunk] = dist.topk(k, dim=1, largest=False).values.mean(dim=1)
+    return out
@@ -0,0 +1,256 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
+import os
+import sys
+import json
+import argparse
+
+import cv2
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+import main_coarse
+import main_refine
+import main_enhance
+from utils.criterion import PerceptualLoss
+from pipeline import STAGE_OVERRIDES
+
+# what a fresh `python main_*.py` pays before any model is loaded
+IMPORT_SECONDS = time.perf_counter() - PROCESS_START
+
+STAGES = ("coarse", "refine", "enhance")
+
+RESULT_PREFIX = "[WORKER RESULT] "
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def make_rgba(source, img_dir, item):
+    # what img_process/process_hair_real.py does to an aligned image: rgb
+    # outside the alpha mask is zeroed, written as <img_dir>/<item>-rgba.png
+    image = cv2.imread(source, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"cannot read {source}")
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 3:
+        # no alpha: leave the background to the resident rembg session in load_input
+        out = os.path.join(img_dir, f"{item}.png")
+    else:
+        mask = image[..., -1] > 0
+        image = np.concatenate([image[..., :3] * mask[..., None], mask[..., None] * 255], axis=2)
+        out = os.path.join(img_dir, f"{item}-rgba.png")
+    os.makedirs(img_dir, exist_ok=True)
+    cv2.imwrite(out, image.astype(np.uint8))
+    return out
+
+
+# Keeps the diffusion priors, VGG16 and rembg resident and runs the
+# coarse -> refine -> enhance stages in process, handing the gaussians from
+# stage to stage in memory instead of through _coarse.ply / _refine.ply.
+class Worker:
+    def __init__(self, config, device="cuda"):
+        self.config = OmegaConf.load(config)
+        self.device = torch.device(device)
+        self.models = {}
+        self.load_seconds = {}
+        self.bg_remover = None
+        self.jobs = 0
+
+    def _cached(self, name, load, events):
+        if name in self.models:
+            events.append((name, self.load_seconds[name], True))
+            return self.models[name]
+        print(f"[INFO] worker loading {name}...")
+        started = time.perf_counter()
+        self.models[name] = load()
+        synchronize()
+        self.load_seconds[name] = time.perf_counter() - started
+        events.append((name, self.load_seconds[name], False))
+        print(f"[INFO] worker loaded {name} in {self.load_seconds[name]:.1f}s")
+        return self.models[name]
+
+    def get_zero123(self, model_key, img_size, events):
+        from guidance.zero123_utils import Zero123
+
+        return self._cached(
+            f"zero123:{model_key}@{img_size}",
+            lambda: Zero123(self.device, model_key=model_key, img_size=img_size),
+            events,
+        )
+
+    def get_p_loss_func(self, events):
+        return self._cached("vgg16", lambda: PerceptualLoss().to(self.device), events)
+
+    def stage_config(self, stage, overrides=None):
+        return OmegaConf.merge(self.config, STAGE_OVERRIDES[stage], overrides or {})
+
+    def stage_opt(self, stage, input, save_path, outdir, overrides=None):
+        opt = OmegaConf.merge(
+            self.stage_config(stage, overrides),
+            {"input": input, "save_path": str(save_path)},
+        )
+        os.makedirs(outdir + '/video', exist_ok=True)
+        opt.outdir = outdir + '/' + opt.save_path
+        os.makedirs(opt.outdir, exist_ok=True)
+        return opt
+
+    def warmup(self):
+        events = []
+        for stage in STAGES:
+            opt = self.stage_config(stage)
+            if opt.lambda_zero123 > 0:
+                # the enhancer is built at the reference size, the synthesizer at zero123's 256
+                img_size = opt.ref_size if stage == "enhance" else 256
+                self.get_zero123(opt.zero123_path, img_size, events)
+        self.get_p_loss_func(events)
+        return {name: round(seconds, 3) for name, seconds, _ in events}
+
+    def run(self, input, save_path, outdir, overrides=None, keep_coarse=False):
+        overrides = overrides or {}
+        timings = {}
+        outputs = {}
+        renderer = None
+        job_start = time.perf_counter()
+
+        for stage in STAGES:
+            events = []
+            started = time.perf_counter()
+            opt = self.stage_opt(stage, input, save_path, outdir, overrides.get(stage))
+
+            guidance = None
+            if opt.lambda_zero123 > 0:
+                img_size = opt.ref_size if stage == "enhance" else 256
+                guidance = self.get_zero123(opt.zero123_path, img_size, events)
+
+            if stage == "coarse":
+                main = main_coarse.Main(opt, guidance_zero123=guidance, bg_remover=self.bg_remover)
+            else:
+                module = main_refine if stage == "refine" else main_enhance
+                main = module.Main(
+                    opt,
+                    renderer=renderer,
+                    guidance_zero123=guidance,
+                    p_loss_func=self.get_p_loss_func(events),
+                    bg_remover=self.bg_remover,
+                )
+            self.bg_remover = main.bg_remover
+            setup_done = time.perf_counter()
+
+            save = stage != "coarse" or keep_coarse
+            main.train(opt.iters, save=save)
+            synchronize()
+            finished = time.perf_counter()
+
+            if save:
+                outputs[stage] = os.path.join(opt.outdir, f"{opt.save_path}_{stage}.ply")
+            renderer = main.renderer
+
+            loaded = sum(seconds for _, seconds, hit in events if not hit)
+            reused = sum(seconds for _, seconds, hit in events if hit)
+            timings[stage] = {
+                "model_load_seconds": round(loaded, 3),
+                "setup_seconds": round(setup_done - started - loaded, 3),
+                "train_seconds": round(finished - setup_done, 3),
+                "total_seconds": round(finished - started, 3),
+                # a separate process would also pay the imports and every model load
+                "startup_saved_seconds": round(IMPORT_SECONDS + reused, 3),
+                "models_reused": [name for name, _, hit in events if hit],
+            }
+
+        self.jobs += 1
+        return {
+            "save_path": str(save_path),
+            "outputs": outputs,
+            "timings": timings,
+            "total_seconds": round(time.perf_counter() - job_start, 3),
+            "startup_saved_seconds": round(
+                sum(t["startup_saved_seconds"] for t in timings.values()), 3
+            ),
+            "worker_jobs": self.jobs,
+        }
+
+
+def print_timings(result):
+    print(f"[INFO] timings for {result['save_path']}:")
+    print(f"    {'stage':<8} {'load':>8} {'setup':>8} {'train':>9} {'total':>9} {'saved':>8}")
+    for stage, t in result["timings"].items():
+        print(
+            f"    {stage:<8} {t['model_load_seconds']:>7.1f}s {t['setup_seconds']:>7.1f}s "
+            f"{t['train_seconds']:>8.1f}s {t['total_seconds']:>8.1f}s {t['startup_saved_seconds']:>7.1f}s"
+        )
+    print(
+        f"    total {result['total_seconds']:.1f}s, startup saved vs. one process per stage: "
+        f"{result['startup_saved_seconds']:.1f}s"
+    )
+
+
+def serve(worker):
+    # one JSON request per stdin line:
+    # {"input": ..., "save_path": ..., "outdir": ..., "overrides": {stage: {...}}, "keep_coarse": false}
+    # or "source" (an aligned image) and "img_dir" instead of "input";
+    # answered by one RESULT_PREFIX line on stdout; training output is interleaved.
+    # service/worker_pool.py keeps one of these per GPU for the server.
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            if "source" in request:
+                request["input"] = make_rgba(request["source"], request["img_dir"], request["save_path"])
+            result = worker.run(
+                request["input"],
+                request["save_path"],
+                request["outdir"],
+                overrides=request.get("overrides"),
+                keep_coarse=request.get("keep_coarse", False),
+            )
+            print_timings(result)
+            response = {"ok": True, **result}
+        except Exception as e:
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        print(RESULT_PREFIX + json.dumps(response), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="configs/image.yaml", help="path to the yaml config file")
+    parser.add_argument("--items", nargs="*", default=[], help="image ids, read from <img_dir>/<id>-rgba.png")
+    parser.add_argument("--img_dir", default="./data/inputs")
+    parser.add_argument("--outdir", default="./data/logs/results")
+    parser.add_argument("--enhancer_path", default=None, help="override the enhance stage zero123_path")
+    parser.add_argument("--keep_coarse", action="store_true", help="also write <id>_coarse.ply")
+    parser.add_argument("--warmup", action="store_true", help="load every model before the first job")
+    parser.add_argument("--serve", action="store_true", help="read JSON job requests from stdin")
+    args = parser.parse_args()
+
+    worker = Worker(args.config)
+    print(f"[INFO] worker imports took {IMPORT_SECONDS:.1f}s")
+    if args.warmup or args.serve:
+        print(f"[INFO] warmup: {worker.warmup()}")
+
+    overrides = {}
+    if args.enhancer_path is not None:
+        overrides["enhance"] = {"zero123_path": args.enhancer_path}
+
+    for item in args.items:
+        result = worker.run(
+            f"{args.img_dir}/{item}-rgba.png",
+            item,
+            args.outdir,
+            overrides=overrides,
+            keep_coarse=args.keep_coarse,
+        )
+        print_timings(result)
+
+    if args.serve:
+        serve(worker)
@@ -0,0 +1,52 @@
+import io
+import os
+import tarfile
+import zipfile
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif", ".tif", ".tiff"}
+
+
+def is_image_name(name):
+    base = os.path.basename(name)
+    if not base or base.startswith("."):
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive_images(data, max_files=1000, max_total_bytes=512 * 1024 * 1024):
+    # Yields (member name, bytes) for every image inside a zip or tar stream.
+    total = 0
+
+    def check(size):
+        nonlocal total
+        total += size
+        if total > max_total_bytes:
+            raise ValueError("archive exceeds the maximum uncompressed size")
+
+    count = 0
+    if zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                count += 1
+                if count > max_files:
+                    raise ValueError(f"archive contains more than {max_files} images")
+                check(info.file_size)
+                yield info.filename, zf.read(info)
+        return
+
+    try:
+        tf = tarfile.open(fileobj=io.BytesIO(data), mode="r:*")
+    except tarfile.TarError:
+        raise ValueError("unsupported archive format, expected zip or tar")
+
+    with tf:
+        for member in tf:
+            if not member.isfile() or not is_image_name(member.name):
+                continue
+            count += 1
+            if count > max_files:
+                raise ValueError(f"archive contains more than {max_files} images")
+            check(member.size)
+            yield member.name, tf.extractfile(member).read()
@@ -0,0 +1,115 @@
+import os
+
+import torch
+from torch import nn
+
+BACKENDS = ("eager", "torchscript", "int8")
+NUM_CLASSES = 5
+
+MODEL_PATH = "model.pth"
+ARTIFACT_PATHS = {
+    "eager": MODEL_PATH,
+    "torchscript": "model_torchscript.pt",
+    "int8": "model_int8.pt",
+}
+
+
+def quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError("no quantized engine available in this torch build")
+
+
+def build_model(quantizable=False):
+    from torchvision import models
+
+    if quantizable:
+        model = models.quantization.resnet18(weights=None, quantize=False)
+    else:
+        model = models.resnet18(weights=None)
+    num_ftrs = model.fc.in_features
+    model.fc = nn.Sequential(
+        nn.Linear(num_ftrs, 1024), nn.ReLU(), nn.Dropout(0.5), nn.Linear(1024, NUM_CLASSES)
+    )
+    return model
+
+
+def load_state_dict(model, model_path, device):
+    # On CPU the checkpoint is memory-mapped and assigned in place, so the
+    # weights stay backed by the page cache and are shared by every worker
+    # process instead of being copied into private memory. Older torch
+    # releases without mmap/assign fall back to a regular load.
+    if torch.device(device).type == "cpu":
+        try:
+            state_dict = torch.load(model_path, map_location="cpu", mmap=True)
+            model.load_state_dict(state_dict, assign=True)
+            return model
+        except TypeError:
+            pass
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    return model
+
+
+def load_eager(device, model_path=MODEL_PATH, quantizable=False):
+    model = load_state_dict(build_model(quantizable), model_path, device)
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+def export_torchscript(example, model_path=MODEL_PATH, out_path=None):
+    out_path = out_path or ARTIFACT_PATHS["torchscript"]
+    model = load_eager("cpu", model_path)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    traced.save(out_path)
+    return out_path
+
+
+def export_int8(calibration_batches, model_path=MODEL_PATH, out_path=None):
+    # Static post-training quantization: conv+bn+relu are fused, observers are
+    # calibrated on real images, then every conv and linear layer runs in int8.
+    out_path = out_path or ARTIFACT_PATHS["int8"]
+    engine = quantized_engine()
+    torch.backends.quantized.engine = engine
+
+    model = load_eager("cpu", model_path, quantizable=True)
+    model.fuse_model()
+    model.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            model(batch)
+    torch.ao.quantization.convert(model, inplace=True)
+
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, calibration_batches[0][:1]))
+    traced.save(out_path)
+    return out_path
+
+
+def load_backend(name, device):
+    # Returns the model and the artifact it was loaded from, so callers can
+    # fingerprint exactly the weights that serve requests.
+    if name not in BACKENDS:
+        raise ValueError(f"unknown backend {name!r}, expected one of {BACKENDS}")
+
+    path = ARTIFACT_PATHS[name]
+    if not os.path.isfile(path):
+        raise FileNotFoundError(
+            f"{path} not found, run `python export.py --backend {name}` first"
+        )
+
+    if name == "eager":
+        return load_eager(device, path), path
+
+    if name == "int8":
+        if torch.device(device).type != "cpu":
+            raise ValueError("the int8 backend only runs on cpu")
+        torch.backends.quantized.engine = quantized_engine()
+
+    model = torch.jit.load(path, map_location=device)
+    model.eval()
+    return model, path
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class BatchMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = Counter()
+        self.queue_wait_ms = 0.0
+        self.inference_ms = 0.0
+        self.latencies_ms = deque(maxlen=2048)
+
+    def record_batch(self, queue_waits_ms, inference_ms, rows):
+        with self.lock:
+            self.requests += len(queue_waits_ms)
+            self.rows += rows
+            self.batches += 1
+            self.batch_sizes[rows] += 1
+            self.queue_wait_ms += sum(queue_waits_ms)
+            self.inference_ms += inference_ms
+            self.latencies_ms.extend(w + inference_ms for w in queue_waits_ms)
+
+    def record_depth(self, depth):
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            batches = max(self.batches, 1)
+            requests = max(self.requests, 1)
+            latencies = sorted(self.latencies_ms)
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "errors": self.errors,
+                "max_queue_depth": self.max_queue_depth,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / batches,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "mean_queue_wait_ms": self.queue_wait_ms / requests,
+                "mean_inference_ms": self.inference_ms / batches,
+                "p50_latency_ms": percentile(latencies, 0.50),
+                "p99_latency_ms": percentile(latencies, 0.99),
+            }
+
+
+class MicroBatcher:
+    # run_batch gets the list of queued inputs and must return one output per
+    # input; it runs on a single inference thread, off the event loop.
+    # item_size tells how many rows an input contributes to the batch.
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=5.0, item_size=None):
+        self.run_batch = run_batch
+        self.item_size = item_size or (lambda item: 1)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.metrics = BatchMetrics()
+        self.queue = None
+        self.worker = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="classify-infer"
+        )
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def start(self):
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.get_running_loop().create_task(self._loop())
+        return self
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, tensor):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((tensor, future, time.perf_counter()))
+        self.metrics.record_depth(self.queue.qsize())
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        rows = self.item_size(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            rows += self.item_size(item[0])
+        return batch
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            batch = [item for item in batch if not item[1].cancelled()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            queue_waits_ms = [(started - item[2]) * 1000 for item in batch]
+            try:
+                outputs = await loop.run_in_executor(
+                    self.executor, self.run_batch, [item[0] for item in batch]
+                )
+            except Exception as e:
+                self.metrics.record_error()
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            inference_ms = (time.perf_counter() - started) * 1000
+            self.metrics.record_batch(
+                queue_waits_ms,
+                inference_ms,
+                sum(self.item_size(item[0]) for item in batch),
+            )
+            for (_, future, _), row in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(row)
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        stats.update(
+            {
+                "queue_depth": self.queue_depth,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+        )
+        return stats
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import io
+import os
+import time
+
+import torch
+from PIL import Image
+
+from preprocess import Preprocessor, decode_image, normalize_batch, reference_transform
+
+
+def load_samples(img_dir, repeat):
+    samples = []
+    for name in sorted(os.listdir(img_dir)):
+        path = os.path.join(img_dir, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                samples.append(f.read())
+    return samples * repeat
+
+
+def bench_reference(samples, batch_size):
+    for start in range(0, len(samples), batch_size):
+        torch.stack(
+            [
+                reference_transform(Image.open(io.BytesIO(data)).convert("RGB"))
+                for data in samples[start : start + batch_size]
+            ]
+        )
+
+
+def bench_serial(samples, batch_size):
+    for start in range(0, len(samples), batch_size):
+        normalize_batch(
+            torch.stack([decode_image(data) for data in samples[start : start + batch_size]])
+        )
+
+
+def bench_pool(samples, batch_size, workers):
+    async def run():
+        preprocessor = Preprocessor(max_workers=workers)
+        tensors = await asyncio.gather(*(preprocessor(data) for data in samples))
+        for start in range(0, len(tensors), batch_size):
+            normalize_batch(torch.stack(tensors[start : start + batch_size]))
+        preprocessor.shutdown()
+
+    asyncio.run(run())
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def max_abs_diff(samples):
+    diff = 0.0
+    for data in samples:
+        ref = reference_transform(Image.open(io.BytesIO(data)).convert("RGB"))
+        new = normalize_batch(decode_image(data).unsqueeze(0))[0]
+        diff = max(diff, (ref - new).abs().max().item())
+    return diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--img_dir", default="../UniHair/data/img")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    samples = load_samples(args.img_dir, args.repeat)
+    print(f"{len(samples)} images, batch size {args.batch_size}")
+
+    results = [
+        ("PIL transform (current)", timed(bench_reference, samples, args.batch_size)),
+        ("draft + uint8 tensor, serial", timed(bench_serial, samples, args.batch_size)),
+        (
+            f"draft + uint8 tensor, {args.workers} workers",
+            timed(bench_pool, samples, args.batch_size, args.workers),
+        ),
+    ]
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(
+            f"{name:<36} {len(samples) / seconds:8.1f} img/s  x{baseline / seconds:.2f}"
+        )
+
+    unique = samples[: len(samples) // args.repeat]
+    print(f"max abs diff vs reference (normalized units): {max_abs_diff(unique):.4f}")
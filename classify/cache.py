@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+ENTRY_OVERHEAD_BYTES = 256
+DISK_PRUNE_INTERVAL = 256
+DISK_FLUSH_INTERVAL = 0.5
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_key(data, model_digest):
+    h = hashlib.sha256(model_digest.encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+class ResultCache:
+    # With a path, put() only queues the row; a writer thread inserts the
+    # queued rows in one transaction every flush_interval on its own
+    # connection, so a miss never waits for the disk.
+    def __init__(
+        self,
+        max_entries=4096,
+        max_bytes=64 * 1024 * 1024,
+        ttl_seconds=24 * 3600,
+        path=None,
+        max_disk_entries=100000,
+        flush_interval=DISK_FLUSH_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_writes = 0
+
+        self.db = None
+        self.write_db = None
+        self.pending = {}
+        self.flush_interval = flush_interval
+        self.write_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.writer = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+            self.write_db = sqlite3.connect(path, check_same_thread=False)
+            self.writer = threading.Thread(
+                target=self._run, name="classify-cache", daemon=True
+            )
+            self.writer.start()
+
+    def _entry_size(self, key, value):
+        return sys.getsizeof(key) + len(json.dumps(value)) + ENTRY_OVERHEAD_BYTES
+
+    def _drop(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def _insert(self, key, value, expires_at):
+        if key in self.entries:
+            self._drop(key)
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (expires_at, value, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _load_from_disk(self, key, now):
+        row = self.pending.get(key)
+        if row is None:
+            row = self.db.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = json.loads(row[0]), row[1]
+        if expires_at < now:
+            # the writer thread deletes expired rows when it prunes
+            self.expirations += 1
+            return None
+        self._insert(key, value, expires_at)
+        return value
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(key)
+                self.expirations += 1
+
+            if self.db is not None:
+                value = self._load_from_disk(key, now)
+                if value is not None:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._insert(key, value, expires_at)
+            if self.db is not None:
+                self.pending[key] = (json.dumps(value), expires_at)
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                rows, self.pending = self.pending, {}
+            if not rows or self.write_db is None:
+                return
+            self.write_db.executemany(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value, expires_at) for key, (value, expires_at) in rows.items()],
+            )
+            before, self.disk_writes = self.disk_writes, self.disk_writes + len(rows)
+            if before // DISK_PRUNE_INTERVAL != self.disk_writes // DISK_PRUNE_INTERVAL:
+                self.write_db.execute(
+                    "DELETE FROM results WHERE expires_at < ?", (time.time(),)
+                )
+                self.write_db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                    "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+            self.write_db.commit()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[classify] cache write failed: {e}", file=sys.stderr, flush=True)
+
+    def clear(self):
+        with self.write_lock, self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.pending.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM results")
+                self.db.commit()
+
+    def close(self):
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        self.flush()
+        with self.write_lock, self.lock:
+            if self.write_db is not None:
+                self.write_db.close()
+                self.write_db = None
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "persistent": self.db is not None,
+            }
+            if self.db is not None:
+                stats["disk_entries"] = self.db.execute(
+                    "SELECT COUNT(*) FROM results"
+                ).fetchone()[0]
+                stats["disk_pending"] = len(self.pending)
+            return stats
@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+
+from backends import BACKENDS, export_int8, export_torchscript, load_backend, load_eager
+from preprocess import decode_image, normalize_batch
+
+
+def load_images(img_dir, batch_size):
+    names, tensors = [], []
+    for name in sorted(os.listdir(img_dir)):
+        path = os.path.join(img_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            try:
+                tensors.append(decode_image(f.read()))
+            except Exception as e:
+                print(f"skip {name}: {e}")
+                continue
+        names.append(name)
+    if not tensors:
+        sys.exit(f"no images found in {img_dir}")
+    batches = [
+        normalize_batch(torch.stack(tensors[i : i + batch_size]))
+        for i in range(0, len(tensors), batch_size)
+    ]
+    return names, batches
+
+
+def predict(model, batches):
+    with torch.no_grad():
+        return torch.cat([F.softmax(model(batch), dim=1) for batch in batches])
+
+
+def check_parity(backend, names, batches):
+    reference = predict(load_eager("cpu"), batches)
+    model, _ = load_backend(backend, "cpu")
+    candidate = predict(model, batches)
+
+    ref_top1 = reference.argmax(dim=1)
+    new_top1 = candidate.argmax(dim=1)
+    agreement = (ref_top1 == new_top1).float().mean().item()
+    max_diff = (reference - candidate).abs().max().item()
+
+    for name, ref, new, diff in zip(
+        names, ref_top1, new_top1, (reference - candidate).abs().max(dim=1).values
+    ):
+        flag = "" if ref == new else "  <-- top-1 mismatch"
+        print(f"{name:<60} eager={ref.item()} {backend}={new.item()} max|dp|={diff:.4f}{flag}")
+    print(f"top-1 agreement: {agreement * 100:.1f}%  max |dp|: {max_diff:.4f}")
+    return agreement, max_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", required=True, choices=BACKENDS[1:])
+    parser.add_argument("--img_dir", default="../UniHair/data/img")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--check_only", action="store_true")
+    parser.add_argument("--min_agreement", type=float, default=0.95)
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    names, batches = load_images(args.img_dir, args.batch_size)
+
+    if not args.check_only:
+        if args.backend == "torchscript":
+            path = export_torchscript(batches[0])
+        else:
+            path = export_int8(batches)
+        print(f"exported {args.backend} model to {path}")
+
+    agreement, _ = check_parity(args.backend, names, batches)
+    if agreement < args.min_agreement:
+        sys.exit(
+            f"top-1 agreement {agreement:.3f} is below --min_agreement {args.min_agreement}"
+        )
@@ -0,0 +1,71 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+from torchvision import transforms
+
+IMAGE_SIZE = 256
+# Normalize(mean=0.5, std=0.5) on [0, 1] inputs == x / 127.5 - 1 on uint8 inputs
+NORM_SCALE = 127.5
+NORM_SHIFT = 1.0
+
+# the original per-image PIL path, kept as the accuracy and speed reference
+reference_transform = transforms.Compose(
+    [
+        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.5] * 3, std=[0.5] * 3),
+    ]
+)
+
+
+def decode_image(data, size=IMAGE_SIZE):
+    # Returns a uint8 [3, size, size] tensor.
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG" and min(img.size) >= 2 * size:
+        # let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below `size`
+        img.draft("RGB", (size, size))
+    img = img.convert("RGB")
+
+    tensor = torch.from_numpy(np.array(img)).permute(2, 0, 1)
+    if tensor.shape[1:] != (size, size):
+        tensor = TF.resize(tensor, [size, size], antialias=True)
+    return tensor.contiguous()
+
+
+def normalize_batch(batch, device=None):
+    # uint8 [B, 3, H, W] -> normalized float [B, 3, H, W]; the uint8 buffer is
+    # moved to the device first so the host-to-device copy is 4x smaller.
+    if device is not None:
+        batch = batch.to(device, non_blocking=True)
+    return batch.float().div_(NORM_SCALE).sub_(NORM_SHIFT)
+
+
+class Preprocessor:
+    def __init__(self, max_workers=None, max_pending=None, size=IMAGE_SIZE):
+        self.size = size
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="classify-decode"
+        )
+        self.max_pending = max_pending or 4 * self.max_workers
+        self.semaphore = None
+
+    async def run(self, fn, *args):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_pending)
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, fn, *args
+            )
+
+    async def __call__(self, data):
+        return await self.run(decode_image, data, self.size)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
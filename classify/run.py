@@ -1,63 +1,332 @@
-import io
+import asyncio
+import hashlib
+import os
+import time
+from typing import List, Optional
 
 import torch
 import torch.nn.functional as F
 import uvicorn
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from PIL import Image
-from torch import nn
-from torchvision import models, transforms
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-transform = transforms.Compose(
-    [
-        transforms.Resize((256, 256)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.5] * 3, std=[0.5] * 3),
-    ]
-)
-
-model = models.resnet18(weights=None)
-num_ftrs = model.fc.in_features
-model.fc = nn.Sequential(
-    nn.Linear(num_ftrs, 1024), nn.ReLU(), nn.Dropout(0.5), nn.Linear(1024, 5)
-)
-model.load_state_dict(torch.load("model.pth", map_location=device))
-model = model.to(device)
-model.eval()
+
+from archive import iter_archive_images
+from backends import load_backend
+from batching import MicroBatcher
+from cache import ResultCache, content_key, file_digest
+from preprocess import Preprocessor, normalize_batch
+from views import CROP_MODES, make_views
 
 class_names = ["Straight", "Wavy", "Curly", "Dreadlocks", "Kinky"]
 
+INFERENCE_BACKEND = os.environ.get("CLASSIFY_BACKEND", "eager")
+WORKERS = int(os.environ.get("CLASSIFY_WORKERS", 1))
+MAX_BATCH_SIZE = int(os.environ.get("CLASSIFY_MAX_BATCH_SIZE", 16))
+MAX_BATCH_WAIT_MS = float(os.environ.get("CLASSIFY_MAX_BATCH_WAIT_MS", 5))
+DECODE_WORKERS = int(os.environ.get("CLASSIFY_DECODE_WORKERS", os.cpu_count() or 4))
+BULK_CHUNK_SIZE = int(os.environ.get("CLASSIFY_BULK_CHUNK_SIZE", 64))
+BULK_MAX_FILES = int(os.environ.get("CLASSIFY_BULK_MAX_FILES", 1000))
+CACHE_MAX_ENTRIES = int(os.environ.get("CLASSIFY_CACHE_MAX_ENTRIES", 4096))
+CACHE_MAX_MB = float(os.environ.get("CLASSIFY_CACHE_MAX_MB", 64))
+CACHE_TTL_SECONDS = float(os.environ.get("CLASSIFY_CACHE_TTL_SECONDS", 24 * 3600))
+CACHE_PATH = os.environ.get("CLASSIFY_CACHE_PATH", "")
+
+process_start_time = time.time()
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+
+        # peak rather than current RSS, reported in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+def format_probabilities(probabilities):
+    return {
+        class_names[i]: float(round(prob, 4)) for i, prob in enumerate(probabilities)
+    }
+
+
+def top_k_classes(probabilities_dict, k):
+    ranked = sorted(probabilities_dict.items(), key=lambda item: item[1], reverse=True)
+    return [{"class": name, "probability": prob} for name, prob in ranked[:k]]
+
+
+class Classifier:
+    def __init__(self, backend=INFERENCE_BACKEND):
+        started = time.perf_counter()
+        rss_before = current_rss_bytes()
 
-@app.post("/classify")
-async def classify_image(file: UploadFile = File(...)):
-    img_bytes = await file.read()
-    img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-    img_tensor = transform(img).unsqueeze(0).to(device)
+        self.backend = backend
+        if backend == "int8":
+            self.device = torch.device("cpu")
+        else:
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    with torch.no_grad():
-        outputs = model(img_tensor)
-        probabilities = F.softmax(outputs, dim=1)
-        probabilities = probabilities.cpu().numpy()[0]
+        self.model, artifact = load_backend(backend, self.device)
+        self.model_digest = f"{backend}:{file_digest(artifact)}"
 
-        probabilities_dict = {
-            class_names[i]: float(round(prob, 4))
-            for i, prob in enumerate(probabilities)
+        self.preprocessor = Preprocessor(max_workers=DECODE_WORKERS)
+        self.batcher = MicroBatcher(
+            self.predict_batch,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=MAX_BATCH_WAIT_MS,
+            item_size=len,
+        )
+        self.cache = ResultCache(
+            max_entries=CACHE_MAX_ENTRIES,
+            max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+            ttl_seconds=CACHE_TTL_SECONDS,
+            path=CACHE_PATH or None,
+        )
+
+        self.load_seconds = time.perf_counter() - started
+        self.rss_after_load = current_rss_bytes()
+        self.rss_model_delta = (
+            self.rss_after_load - rss_before
+            if rss_before is not None and self.rss_after_load is not None
+            else None
+        )
+
+    def predict(self, batch):
+        batch = normalize_batch(batch, self.device)
+        with torch.no_grad():
+            outputs = self.model(batch)
+            probabilities = F.softmax(outputs, dim=1)
+        return probabilities.cpu().numpy()
+
+    def predict_batch(self, inputs):
+        # inputs are uint8 [n_i, 3, H, W] view stacks; one forward pass for all
+        probabilities = self.predict(torch.cat(inputs))
+        splits, start = [], 0
+        for item in inputs:
+            splits.append(probabilities[start : start + len(item)])
+            start += len(item)
+        return splits
+
+    def start(self):
+        self.batcher.start()
+        self.ready_at = time.time()
+        return self
+
+    async def stop(self):
+        await self.batcher.stop()
+        self.preprocessor.shutdown()
+        self.cache.close()
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "backend": self.backend,
+            "device": str(self.device),
+            "model_load_seconds": round(self.load_seconds, 3),
+            "startup_seconds": round(self.ready_at - process_start_time, 3),
+            "uptime_seconds": round(time.time() - self.ready_at, 3),
+            "rss_bytes": current_rss_bytes(),
+            "rss_after_load_bytes": self.rss_after_load,
+            "rss_model_delta_bytes": self.rss_model_delta,
         }
 
-    return JSONResponse(content=probabilities_dict)
+
+def get_classifier(app: FastAPI) -> Classifier:
+    # Loaded by the startup hook; the lazy path covers apps driven without
+    # lifespan events (e.g. a bare TestClient).
+    classifier = getattr(app.state, "classifier", None)
+    if classifier is None:
+        classifier = app.state.classifier = Classifier().start()
+    return classifier
+
+
+def unique_name(name, seen):
+    key = name
+    index = 1
+    while key in seen:
+        index += 1
+        key = f"{name} ({index})"
+    seen.add(key)
+    return key
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    @app.on_event("startup")
+    async def load_classifier():
+        classifier = get_classifier(app)
+        stats = classifier.stats()
+        rss_mb = (stats["rss_bytes"] or 0) / 2**20
+        print(
+            f"[classify] worker {stats['pid']} ready: backend={stats['backend']} "
+            f"device={stats['device']} model_load={stats['model_load_seconds']}s "
+            f"startup={stats['startup_seconds']}s rss={rss_mb:.1f}MiB",
+            flush=True,
+        )
+
+    @app.on_event("shutdown")
+    async def stop_classifier():
+        classifier = getattr(app.state, "classifier", None)
+        if classifier is not None:
+            await classifier.stop()
+
+    @app.post("/classify")
+    async def classify_image(
+        request: Request,
+        file: UploadFile = File(...),
+        mask: Optional[UploadFile] = File(None),
+        crop: str = "none",
+        flip: bool = False,
+        top_k: int = 0,
+    ):
+        classifier = get_classifier(request.app)
+        if crop not in CROP_MODES:
+            return JSONResponse(
+                content={"error": f"crop must be one of {', '.join(CROP_MODES)}"},
+                status_code=400,
+            )
+        if crop == "hair" and mask is None:
+            return JSONResponse(
+                content={"error": "crop=hair requires a mask upload"}, status_code=400
+            )
+
+        img_bytes = await file.read()
+        mask_bytes = await mask.read() if crop == "hair" else None
+        single_view = crop == "none" and not flip
+
+        cache_scope = classifier.model_digest
+        if not single_view:
+            cache_scope += f"|crop={crop}|flip={int(flip)}"
+            if mask_bytes is not None:
+                cache_scope += f"|mask={hashlib.sha256(mask_bytes).hexdigest()}"
+        cache_key = content_key(img_bytes, cache_scope)
+
+        probabilities_dict = classifier.cache.get(cache_key)
+        if probabilities_dict is None:
+            try:
+                if single_view:
+                    views = (await classifier.preprocessor(img_bytes)).unsqueeze(0)
+                else:
+                    views = await classifier.preprocessor.run(
+                        make_views, img_bytes, crop, flip, mask_bytes
+                    )
+            except (ValueError, OSError) as e:
+                # PIL raises UnidentifiedImageError (an OSError) for corrupt image or mask data
+                return JSONResponse(content={"error": str(e)}, status_code=400)
+
+            # all views of the request go through the model as one batch
+            probabilities = await classifier.batcher.submit(views)
+            probabilities_dict = format_probabilities(probabilities.mean(axis=0))
+            classifier.cache.put(cache_key, probabilities_dict)
+
+        if top_k > 0:
+            probabilities_dict = dict(probabilities_dict)
+            probabilities_dict["top_k"] = top_k_classes(probabilities_dict, top_k)
+
+        return JSONResponse(content=probabilities_dict)
+
+    @app.post("/classify/batch")
+    async def classify_batch(
+        request: Request,
+        files: Optional[List[UploadFile]] = File(None),
+        archive: Optional[UploadFile] = File(None),
+    ):
+        classifier = get_classifier(request.app)
+        items = []
+        seen = set()
+        for upload in files or []:
+            items.append((unique_name(upload.filename, seen), await upload.read()))
+
+        if archive is not None:
+            try:
+                for name, data in iter_archive_images(
+                    await archive.read(), max_files=BULK_MAX_FILES
+                ):
+                    items.append((unique_name(name, seen), data))
+            except ValueError as e:
+                return JSONResponse(content={"error": str(e)}, status_code=400)
+
+        if not items:
+            return JSONResponse(content={"error": "no images uploaded"}, status_code=400)
+        if len(items) > BULK_MAX_FILES:
+            return JSONResponse(
+                content={"error": f"at most {BULK_MAX_FILES} images per request"},
+                status_code=400,
+            )
+
+        results = {}
+        pending = []
+        for name, data in items:
+            cache_key = content_key(data, classifier.model_digest)
+            cached = classifier.cache.get(cache_key)
+            if cached is not None:
+                results[name] = cached
+            else:
+                pending.append((name, data, cache_key))
+
+        decoded = await asyncio.gather(
+            *(classifier.preprocessor(data) for _, data, _ in pending),
+            return_exceptions=True,
+        )
+
+        names, tensors, keys = [], [], []
+        for (name, _, cache_key), tensor in zip(pending, decoded):
+            if isinstance(tensor, (ValueError, OSError)):
+                results[name] = {"error": f"cannot decode image: {tensor}"}
+            elif isinstance(tensor, BaseException):
+                raise tensor
+            else:
+                names.append(name)
+                tensors.append(tensor)
+                keys.append(cache_key)
+
+        # chunks go through the micro-batcher like any other request, so they
+        # share its inference thread and show up in /metrics; awaiting them one
+        # at a time lets single /classify requests in between
+        for start in range(0, len(tensors), BULK_CHUNK_SIZE):
+            chunk = tensors[start : start + BULK_CHUNK_SIZE]
+            probabilities = await classifier.batcher.submit(torch.stack(chunk))
+            for name, cache_key, row in zip(
+                names[start : start + BULK_CHUNK_SIZE],
+                keys[start : start + BULK_CHUNK_SIZE],
+                probabilities,
+            ):
+                results[name] = format_probabilities(row)
+                classifier.cache.put(cache_key, results[name])
+
+        return JSONResponse(
+            content={name: results[name] for name, _ in items if name in results}
+        )
+
+    @app.get("/metrics")
+    async def get_metrics(request: Request):
+        return JSONResponse(content=get_classifier(request.app).batcher.stats())
+
+    @app.get("/cache/stats")
+    async def get_cache_stats(request: Request):
+        return JSONResponse(content=get_classifier(request.app).cache.stats())
+
+    @app.get("/health")
+    async def get_health(request: Request):
+        return JSONResponse(content=get_classifier(request.app).stats())
+
+    return app
 
 
-uvicorn.run(app, port=5000)
+if __name__ == "__main__":
+    uvicorn.run("run:create_app", factory=True, port=5000, workers=WORKERS)
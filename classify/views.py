@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+from preprocess import IMAGE_SIZE
+
+CROP_MODES = ("none", "center", "five", "hair")
+CROP_RATIO = 0.8
+HAIR_MARGIN = 0.15
+MIN_MASK_PIXELS = 16
+
+
+def decode_full(data, size=IMAGE_SIZE):
+    # uint8 [3, H, W] at (at least) 2x the model resolution, so crops keep detail
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG" and min(img.size) >= 4 * size:
+        img.draft("RGB", (2 * size, 2 * size))
+    img = img.convert("RGB")
+    return torch.from_numpy(np.array(img)).permute(2, 0, 1).contiguous()
+
+
+def mask_box(data, width, height):
+    # Bounding box (top, left, h, w) of the mask foreground in image coordinates.
+    mask = np.array(Image.open(io.BytesIO(data)).convert("L")) > 127
+    if mask.sum() < MIN_MASK_PIXELS:
+        raise ValueError("hair mask is empty")
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    sy = height / mask.shape[0]
+    sx = width / mask.shape[1]
+    top, bottom = rows[0] * sy, (rows[-1] + 1) * sy
+    left, right = cols[0] * sx, (cols[-1] + 1) * sx
+
+    # grow to a square with a margin, clamped to the image
+    side = max(bottom - top, right - left) * (1 + 2 * HAIR_MARGIN)
+    side = min(side, width, height)
+    cy, cx = (top + bottom) / 2, (left + right) / 2
+    top = int(round(min(max(cy - side / 2, 0), height - side)))
+    left = int(round(min(max(cx - side / 2, 0), width - side)))
+    side = int(round(side))
+    return top, left, side, side
+
+
+def crop_boxes(crop, width, height, hair_box=None):
+    if crop == "none":
+        return [(0, 0, height, width)]
+    if crop == "hair":
+        return [hair_box]
+
+    ch, cw = int(height * CROP_RATIO), int(width * CROP_RATIO)
+    center = ((height - ch) // 2, (width - cw) // 2, ch, cw)
+    if crop == "center":
+        return [center]
+    return [
+        (0, 0, ch, cw),
+        (0, width - cw, ch, cw),
+        (height - ch, 0, ch, cw),
+        (height - ch, width - cw, ch, cw),
+        center,
+    ]
+
+
+def make_views(data, crop="none", flip=False, mask=None, size=IMAGE_SIZE):
+    # Returns uint8 [V, 3, size, size] holding every requested view.
+    if crop not in CROP_MODES:
+        raise ValueError(f"unknown crop mode {crop!r}, expected one of {CROP_MODES}")
+    if crop == "hair" and mask is None:
+        raise ValueError("crop=hair requires a mask upload")
+
+    image = decode_full(data, size)
+    height, width = image.shape[1:]
+    hair_box = mask_box(mask, width, height) if crop == "hair" else None
+
+    views = [
+        TF.resize(image[:, top : top + h, left : left + w], [size, size], antialias=True)
+        for top, left, h, w in crop_boxes(crop, width, height, hair_box)
+    ]
+    views = torch.stack(views)
+    if flip:
+        views = torch.cat([views, torch.flip(views, dims=[-1])])
+    return views.contiguous()